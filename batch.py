@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from main import BatchRequest, job_queue, submit_newsletter_batch, worker_pool
+from lib.http import close_sessions
+from lib.jobs import FAILED
+from lib.renderer import close_browser_pools
+
+
+async def run_batch(batch: BatchRequest, workers: int, poll_interval: float) -> dict:
+    """
+    Runs a batch to completion with a local worker pool and returns its final status.
+
+    Jobs are queued in the same job queue as the API, so a batch interrupted
+    half-way resumes when the API or this command starts again.
+    """
+    worker_pool.concurrency = workers
+    worker_pool.start()
+    try:
+        submitted = await submit_newsletter_batch(batch)
+        batch_id = submitted["batch_id"]
+        print(f"Batch {batch_id}: {submitted['total']} items queued", flush=True)
+
+        reported = -1
+        while True:
+            status = job_queue.get_batch(batch_id)
+            if status["finished"] != reported:
+                reported = status["finished"]
+                print(
+                    f"Batch {batch_id}: {status['finished']}/{status['total']} finished",
+                    flush=True,
+                )
+            if status["done"]:
+                return status
+            await asyncio.sleep(poll_interval)
+    finally:
+        await worker_pool.stop()
+        await close_browser_pools()
+        await close_sessions()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate newsletters for many Notion pages at once."
+    )
+    parser.add_argument(
+        "items",
+        help='JSON file with a list of {"page_id", "repo_link", "ref"} objects',
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Most items of the batch processed at once "
+        "(default: no batch limit, so at most --workers)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Size of the local worker pool"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between progress checks",
+    )
+    args = parser.parse_args()
+
+    with open(args.items, "r", encoding="utf-8") as file:
+        items = json.load(file)
+    batch = BatchRequest(items=items, max_concurrency=args.max_concurrency)
+
+    status = asyncio.run(run_batch(batch, args.workers, args.poll_interval))
+    print(json.dumps(status, indent=2))
+
+    failed = [item for item in status["items"] if item["status"] == FAILED]
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
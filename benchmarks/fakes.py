@@ -0,0 +1,369 @@
+"""
+Local stand-ins for the services the pipeline calls: GitHub, Gemini,
+mermaid.ink, S3 and Notion.
+
+Each HTTP fake is a small aiohttp application on its own port, with a
+configurable latency and request counters, so the benchmark measures this
+service and not the network or third-party rate limits.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import random
+import socket
+import textwrap
+import uuid
+import zipfile
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+from lib.agent_template import (
+    chunk_summarizer_agent,
+    diagram_generator_agent,
+    newsletter_editor_agent,
+    newsletter_writer_agent,
+    text_to_json_writer,
+)
+
+# Smallest valid PNG: one transparent pixel
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d4944415478da63f8ffff3f0005fe02fea7d6a4e000"
+    "00000049454e44ae426082"
+)
+
+
+class FakeService:
+    """
+    An aiohttp application served on a free local port.
+
+    Args:
+        latency (float): Seconds every request waits before it is answered.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self.app = web.Application(client_max_size=64 * 1024**2)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def _delay(self, route: str):
+        self.requests[route] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def start(self) -> str:
+        """Starts serving and returns the base URL."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.SockSite(self._runner, sock).start()
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def synthetic_repository(name: str, files: int, file_bytes: int) -> dict:
+    """
+    Builds the files of a fake repository: a README and Python modules of
+    about file_bytes each, with classes, functions and docstrings.
+    """
+    seed = int(hashlib.sha256(name.encode("utf-8")).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    contents = {
+        "README.md": f"# {name}\n\nA synthetic repository for benchmarks.\n\n"
+        + "## Usage\n\nRun `python -m app` to start.\n" * 4
+    }
+    for index in range(max(0, files - 1)):
+        module = [f'"""Module {index} of {name}."""\n', "import os\n\n"]
+        size = sum(len(part) for part in module)
+        function = 0
+        while size < file_bytes:
+            body = textwrap.dedent(
+                f'''
+                class Handler{function}:
+                    """Handles requests of kind {function}."""
+
+                    def __init__(self, limit={rng.randint(1, 100)}):
+                        self.limit = limit
+
+                    def handle(self, items):
+                        """Returns the items below the limit."""
+                        return [item for item in items if item < self.limit]
+
+
+                def process_{function}(value, factor={rng.randint(1, 9)}):
+                    """Scales value by factor."""
+                    total = 0
+                    for step in range(factor):
+                        total += value * step
+                    return os.environ.get("MODE", "x") and total
+                '''
+            )
+            module.append(body)
+            size += len(body)
+            function += 1
+        contents[f"app/pkg{index % 10}/module_{index}.py"] = "".join(module)
+    return contents
+
+
+class FakeGitHub(FakeService):
+    """
+    Serves commit lookups and zipballs of synthetic repositories.
+
+    Every repository name gets its own deterministic files and commit SHA.
+
+    Args:
+        files (int): Files per repository.
+        file_bytes (int): Approximate size of each file.
+        latency (float): Seconds before each response.
+    """
+
+    def __init__(
+        self, files: int = 50, file_bytes: int = 4096, latency: float = 0.0
+    ):
+        super().__init__(latency)
+        self.files = files
+        self.file_bytes = file_bytes
+        self._zips: dict = {}
+        self.app.router.add_get(
+            "/api/repos/{owner}/{repo}/commits/{ref:.*}", self.commit
+        )
+        self.app.router.add_get("/{owner}/{repo}/archive/{name:.*}", self.archive)
+
+    @staticmethod
+    def sha(owner: str, repo: str) -> str:
+        return hashlib.sha1(f"{owner}/{repo}".encode("utf-8")).hexdigest()
+
+    def zipball(self, owner: str, repo: str) -> bytes:
+        key = (owner, repo)
+        if key not in self._zips:
+            prefix = f"{repo}-{self.sha(owner, repo)}"
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+                repository = synthetic_repository(
+                    f"{owner}/{repo}", self.files, self.file_bytes
+                )
+                for path, content in repository.items():
+                    archive.writestr(f"{prefix}/{path}", content)
+            self._zips[key] = buffer.getvalue()
+        return self._zips[key]
+
+    async def commit(self, request: web.Request):
+        await self._delay("commit")
+        sha = self.sha(request.match_info["owner"], request.match_info["repo"])
+        etag = f'"{sha}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=sha, headers={"ETag": etag})
+
+    async def archive(self, request: web.Request):
+        await self._delay("archive")
+        body = self.zipball(request.match_info["owner"], request.match_info["repo"])
+        return web.Response(body=body, content_type="application/zip")
+
+
+class FakeMermaidInk(FakeService):
+    """Answers every mermaid.ink render with a one-pixel PNG."""
+
+    def __init__(self, latency: float = 0.2):
+        super().__init__(latency)
+        self.app.router.add_get("/img/{encoded}", self.render)
+
+    async def render(self, request: web.Request):
+        await self._delay("render")
+        return web.Response(body=PIXEL_PNG, content_type="image/png")
+
+
+class FakeS3(FakeService):
+    """
+    A path-style S3 endpoint in the manner of moto's server mode: objects
+    are kept in memory and served back on GET.
+    """
+
+    def __init__(self, latency: float = 0.05):
+        super().__init__(latency)
+        self.objects: dict = {}
+        self.app.router.add_put("/{bucket}/{key:.+}", self.put_object)
+        self.app.router.add_get("/{bucket}/{key:.+}", self.get_object)
+
+    async def put_object(self, request: web.Request):
+        await self._delay("put")
+        data = await request.read()
+        key = (request.match_info["bucket"], request.match_info["key"])
+        self.objects[key] = (data, request.content_type)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        return web.Response(headers={"ETag": etag})
+
+    async def get_object(self, request: web.Request):
+        await self._delay("get")
+        key = (request.match_info["bucket"], request.match_info["key"])
+        if key not in self.objects:
+            return web.Response(status=404)
+        data, content_type = self.objects[key]
+        return web.Response(body=data, content_type=content_type)
+
+
+class FakeNotion(FakeService):
+    """
+    Accepts page creation, block appends and page archiving like the Notion API.
+
+    Args:
+        latency (float): Seconds before each response.
+        rate_limit_ratio (float): Share of requests answered with 429 and a
+            one-second Retry-After, to exercise the client's back-off.
+    """
+
+    def __init__(self, latency: float = 0.15, rate_limit_ratio: float = 0.0):
+        super().__init__(latency)
+        self.rate_limit_ratio = rate_limit_ratio
+        self.blocks = 0
+        self._random = random.Random(0)
+        self.app.router.add_post("/v1/pages", self.create_page)
+        self.app.router.add_patch("/v1/blocks/{block_id}/children", self.append)
+        self.app.router.add_patch("/v1/pages/{page_id}", self.update_page)
+
+    def _rate_limited(self) -> Optional[web.Response]:
+        if self._random.random() < self.rate_limit_ratio:
+            self.requests["429"] += 1
+            return web.json_response(
+                {"code": "rate_limited"}, status=429, headers={"Retry-After": "1"}
+            )
+        return None
+
+    async def create_page(self, request: web.Request):
+        await self._delay("pages")
+        payload = await request.json()
+        response = self._rate_limited()
+        if response is not None:
+            return response
+        self.blocks += len(payload.get("children", []))
+        return web.json_response({"object": "page", "id": str(uuid.uuid4())})
+
+    async def append(self, request: web.Request):
+        await self._delay("append")
+        payload = await request.json()
+        response = self._rate_limited()
+        if response is not None:
+            return response
+        self.blocks += len(payload.get("children", []))
+        return web.json_response({"object": "list", "results": []})
+
+    async def update_page(self, request: web.Request):
+        await self._delay("update")
+        payload = await request.json()
+        page_id = request.match_info["page_id"]
+        return web.json_response({"object": "page", "id": page_id, **payload})
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.cached_content_token_count = 0
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Response:
+    """Mimics a Gemini response, streamed or not."""
+
+    def __init__(self, parts: list[str], delay: float, usage: _Usage):
+        self._parts = parts
+        self._delay = delay
+        self.text = "".join(parts)
+        self.usage_metadata = usage
+
+    async def __aiter__(self):
+        for part in self._parts:
+            await asyncio.sleep(self._delay)
+            yield _Chunk(part)
+
+
+class FakeGemini:
+    """
+    A stand-in for the Gemini model client that answers each agent with
+    output of the right shape after a simulated latency.
+
+    Args:
+        first_token_latency (float): Seconds before the first token.
+        tokens_per_second (float): Output speed after the first token.
+        output_tokens (int): Approximate tokens in each answer.
+        prompt_tokens_per_second (float): Prompt processing speed, which adds
+            to the time to first token (default: 0, prompt size is free).
+    """
+
+    def __init__(
+        self,
+        first_token_latency: float = 0.5,
+        tokens_per_second: float = 200,
+        output_tokens: int = 800,
+        prompt_tokens_per_second: float = 0,
+    ):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.calls: Counter = Counter()
+        self.prompt_tokens: Counter = Counter()
+
+    def _answer(self, prompt: str) -> tuple[str, str]:
+        words = max(1, self.output_tokens * 3 // 4)
+        prose = " ".join(f"word{i % 97}" for i in range(words))
+        if diagram_generator_agent.strip()[:80] in prompt:
+            return "diagram", (
+                "```mermaid\ngraph TD\n    A[Request] --> B[Pipeline]\n"
+                "    B --> C[Newsletter]\n```"
+            )
+        if text_to_json_writer.strip()[:80] in prompt:
+            blocks = [{"type": "heading_2", "text": "Overview"}]
+            blocks.append({"type": "image", "url": "<DIAGRAM_IMAGE_URL>"})
+            for start in range(0, len(prose), 1500):
+                text = prose[start : start + 1500]
+                blocks.append({"type": "paragraph", "text": text})
+            return "json_writer", f"```json\n{json.dumps({'blocks': blocks})}\n```"
+        if chunk_summarizer_agent.strip()[:80] in prompt:
+            return "chunk_summarizer", f"Summary: {prose[: len(prose) // 4]}"
+        if newsletter_editor_agent.strip()[:80] in prompt:
+            name = "editor"
+        elif newsletter_writer_agent.strip()[:80] in prompt:
+            name = "writer"
+        else:
+            name = "other"
+        paragraphs = [prose[start : start + 600] for start in range(0, len(prose), 600)]
+        body = "\n\n".join(paragraphs)
+        return name, (
+            f"## Overview\n\n{body}\n\n<DIAGRAM_IMAGE_URL>\n\n"
+            f"## Next steps\n\n{body[:300]}\n"
+        )
+
+    async def generate_content_async(self, prompt, stream=False, request_options=None):
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        agent, text = self._answer(prompt)
+        self.calls[agent] += 1
+        usage = _Usage(len(prompt) // 4, len(text) // 4)
+        self.prompt_tokens[agent] += usage.prompt_token_count
+        latency = self.first_token_latency
+        if self.prompt_tokens_per_second > 0:
+            latency += usage.prompt_token_count / self.prompt_tokens_per_second
+        await asyncio.sleep(latency)
+        parts = [text[start : start + 200] for start in range(0, len(text), 200)]
+        # Time to produce each 200-character part at tokens_per_second
+        delay = 50 / self.tokens_per_second
+        if stream:
+            return _Response(parts, delay, usage)
+        await asyncio.sleep(delay * len(parts))
+        return _Response(parts, delay, usage)
@@ -0,0 +1,106 @@
+"""
+Cold-start benchmark: how long a fresh interpreter takes to import the app.
+
+Each run starts a new Python process, so nothing is cached in memory, and
+imports the module with -X importtime to attribute the time:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 10 --max-seconds 1.5
+
+With --max-seconds it exits with status 1 when the median is slower, so it
+can guard cold-start time in CI.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Prints the import time measured inside the child process
+MEASURE = (
+    "import time; start = time.perf_counter(); import {module}; "
+    "print('IMPORT_SECONDS', time.perf_counter() - start)"
+)
+
+
+def measure(module: str) -> tuple[float, dict]:
+    """
+    Imports module in a fresh interpreter.
+
+    Returns:
+        tuple[float, dict]: Seconds taken, and the cumulative microseconds of
+            each module that module imports directly.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MEASURE.format(module=module)],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+    )
+    seconds = next(
+        float(line.split()[1])
+        for line in result.stdout.splitlines()
+        if line.startswith("IMPORT_SECONDS")
+    )
+    imports: dict = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | <two spaces per level>name"
+        parts = line[len("import time:") :].split("|")
+        if not line.startswith("import time:") or len(parts) != 3:
+            continue
+        cumulative, name = parts[1].strip(), parts[2]
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if cumulative.isdigit() and depth == 1:
+            imports[name.strip()] = int(cumulative)
+    return seconds, imports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure how long a fresh interpreter takes to import the app."
+    )
+    parser.add_argument("--module", default="main", help="Module to import.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh imports to time.")
+    parser.add_argument("--top", type=int, default=10, help="Imports to list.")
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        help="Fail when the median import takes longer than this.",
+    )
+    parser.add_argument("--output", help="Also write the results as JSON here.")
+    args = parser.parse_args(argv)
+
+    timings, breakdowns = [], []
+    for _ in range(max(1, args.runs)):
+        seconds, packages = measure(args.module)
+        timings.append(seconds)
+        breakdowns.append(packages)
+
+    median = statistics.median(timings)
+    names = set().union(*breakdowns)
+    imports = {
+        name: statistics.median(b.get(name, 0) for b in breakdowns) / 1e6
+        for name in names
+    }
+    slowest = sorted(imports.items(), key=lambda item: -item[1])[: args.top]
+
+    print(
+        f"import {args.module}: median {median:.3f}s, "
+        f"min {min(timings):.3f}s, max {max(timings):.3f}s over {len(timings)} runs"
+    )
+    for name, seconds in slowest:
+        print(f"  {name:<28}{seconds:>8.3f}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"timings": timings, "imports": imports}, file, indent=2)
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"Median import time is above {args.max_seconds}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
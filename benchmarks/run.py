@@ -0,0 +1,430 @@
+"""
+End-to-end benchmark of the newsletter service against local fakes.
+
+Starts the FastAPI app in-process with GitHub, Gemini, mermaid.ink, S3 and
+Notion replaced by the stand-ins of benchmarks.fakes, submits jobs to
+POST /newsletter at a fixed (or Poisson) rate and reports job latency
+percentiles, throughput, peak memory and a per-stage breakdown:
+
+    python -m benchmarks.run --jobs 30 --rate 2 --workers 4
+    python -m benchmarks.run --files 400 --file-kb 8 --output report.json
+    python -m benchmarks.run --jobs 60 --rate 4 --processes 4
+
+Every run uses fresh queue, cache and workspace directories, so results do
+not depend on earlier runs.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Optional
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the newsletter pipeline against local fakes."
+    )
+    load = parser.add_argument_group("load")
+    load.add_argument("--jobs", type=int, default=20, help="Jobs to submit.")
+    load.add_argument(
+        "--rate", type=float, default=1.0, help="Submissions per second."
+    )
+    load.add_argument(
+        "--poisson",
+        action="store_true",
+        help="Randomise arrivals around --rate instead of spacing them evenly.",
+    )
+    load.add_argument(
+        "--repos",
+        type=int,
+        default=5,
+        help="Distinct repositories; jobs cycle through them, so repeats "
+        "exercise the snapshot and LLM caches.",
+    )
+    load.add_argument("--workers", type=int, default=4, help="WORKER_CONCURRENCY.")
+    load.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Worker processes sharing the queue, caches and locks; the first "
+        "one also serves the API.",
+    )
+    load.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the LLM and diagram caches.",
+    )
+    load.add_argument(
+        "--timeout", type=float, default=900, help="Seconds before giving up."
+    )
+
+    repository = parser.add_argument_group("synthetic repositories")
+    repository.add_argument("--files", type=int, default=50, help="Files per repo.")
+    repository.add_argument(
+        "--file-kb", type=float, default=4, help="Approximate KB per file."
+    )
+
+    services = parser.add_argument_group("fake services")
+    services.add_argument("--github-latency", type=float, default=0.05)
+    services.add_argument(
+        "--gemini-latency", type=float, default=0.5, help="Seconds to first token."
+    )
+    services.add_argument(
+        "--gemini-tps", type=float, default=200, help="Output tokens per second."
+    )
+    services.add_argument(
+        "--gemini-tokens", type=int, default=800, help="Tokens per answer."
+    )
+    services.add_argument(
+        "--gemini-prefill-tps",
+        type=float,
+        default=0,
+        help="Prompt tokens processed per second before the first token "
+        "(default: 0, prompt size adds no latency).",
+    )
+    services.add_argument("--ink-latency", type=float, default=0.2)
+    services.add_argument("--s3-latency", type=float, default=0.05)
+    services.add_argument("--notion-latency", type=float, default=0.15)
+    services.add_argument(
+        "--notion-429",
+        type=float,
+        default=0.0,
+        help="Share of Notion requests answered with 429 Too Many Requests.",
+    )
+
+    parser.add_argument("--output", help="Also write the report as JSON here.")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, workdir: str):
+    """
+    Points the service's configuration at scratch directories and dummy
+    credentials. Must run before any lib module is imported.
+    """
+    os.environ.update(
+        {
+            "API_KEY": "benchmark",
+            "GEMINI_API_KEY": "benchmark",
+            "NOTION_API_KEY": "benchmark",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_S3_BUCKET": "benchmark",
+            "AWS_S3_REGION": "us-east-1",
+            "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+            "CACHE_DIR": os.path.join(workdir, "cache"),
+            "REPO_CACHE_DIR": os.path.join(workdir, "snapshots"),
+            "WORKSPACE_ROOT": os.path.join(workdir, "jobs"),
+            "WORKER_CONCURRENCY": str(args.workers),
+            "JOB_MAX_ATTEMPTS": "1",
+            "JOB_POLL_INTERVAL": "0.1",
+            "MERMAID_RENDERER": "ink",
+            "CONTEXT_CACHE_BACKEND": "local",
+            # Only problems; the report is the output
+            "LOG_LEVEL": "WARNING",
+            "LLM_CACHE_ENABLED": "false" if args.no_cache else "true",
+            "DIAGRAM_CACHE_ENABLED": "false" if args.no_cache else "true",
+        }
+    )
+    os.environ.pop("GITHUB_TOKEN", None)
+    os.environ.pop("AWS_S3_ENDPOINT_URL", None)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def percentile(values: list, fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, or None without values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+async def _wait_for_job(session, base_url: str, job_id: str, deadline: float):
+    while True:
+        async with session.get(f"{base_url}/newsletter/{job_id}") as response:
+            job = await response.json()
+        if job["status"] in TERMINAL_STATUSES or time.monotonic() > deadline:
+            return job
+        await asyncio.sleep(0.1)
+
+
+async def drive_load(args: argparse.Namespace, base_url: str) -> list[dict]:
+    """Submits args.jobs newsletter requests at args.rate and waits for them."""
+    import aiohttp
+
+    rng = random.Random(0)
+    headers = {"x-api-key": os.environ["API_KEY"]}
+    deadline = time.monotonic() + args.timeout
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def submit(index: int, delay: float) -> dict:
+            await asyncio.sleep(delay)
+            repo = f"https://github.com/bench/repo{index % max(1, args.repos)}"
+            payload = {
+                "data": {
+                    "id": f"{index:032x}",
+                    "properties": {"GitHub": {"url": repo}},
+                }
+            }
+            submitted = time.time()
+            async with session.post(f"{base_url}/newsletter", json=payload) as response:
+                if response.status != 200:
+                    return {"status": "rejected", "error": await response.text()}
+                job_id = (await response.json())["job_id"]
+            job = await _wait_for_job(session, base_url, job_id, deadline)
+            job["submitted_at"] = submitted
+            return job
+
+        delays, offset = [], 0.0
+        for _ in range(args.jobs):
+            delays.append(offset)
+            gap = 1 / args.rate if args.rate > 0 else 0
+            offset += rng.expovariate(args.rate) if args.poisson and gap else gap
+        return await asyncio.gather(
+            *(submit(index, delay) for index, delay in enumerate(delays))
+        )
+
+
+def build_report(args: argparse.Namespace, jobs: list[dict], fakes: dict) -> dict:
+    succeeded = [job for job in jobs if job.get("status") == "succeeded"]
+    latencies = [job["finished_at"] - job["submitted_at"] for job in succeeded]
+    waits = [job["started_at"] - job["created_at"] for job in succeeded]
+    stages: dict = {}
+    critical: dict = {}
+    for job in succeeded:
+        result = job.get("result") or {}
+        for stage, seconds in (result.get("stages") or {}).items():
+            stages.setdefault(stage, []).append(seconds)
+        for stage in result.get("critical_path") or []:
+            critical[stage] = critical.get(stage, 0) + 1
+
+    span = 0.0
+    if succeeded:
+        first = min(job["submitted_at"] for job in jobs if "submitted_at" in job)
+        span = max(job["finished_at"] for job in succeeded) - first
+    failures = [job for job in jobs if job.get("status") != "succeeded"]
+    return {
+        "config": vars(args),
+        "jobs": {"submitted": len(jobs), "succeeded": len(succeeded)},
+        "failures": [
+            {"status": job.get("status"), "error": job.get("error")}
+            for job in failures[:10]
+        ],
+        "latency_seconds": summarize(latencies),
+        "queue_wait_seconds": summarize(waits),
+        "jobs_per_minute": len(succeeded) / span * 60 if span else 0.0,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "critical_path": critical,
+        "fake_requests": {
+            name: dict(service.requests) for name, service in fakes.items()
+        },
+    }
+
+
+def format_report(report: dict) -> str:
+    def seconds(value) -> str:
+        return "-" if value is None else f"{value:.2f}s"
+
+    jobs = report["jobs"]
+    latency = report["latency_seconds"]
+    lines = [
+        f"Jobs: {jobs['succeeded']}/{jobs['submitted']} succeeded",
+        f"Latency: p50 {seconds(latency['p50'])}  p95 {seconds(latency['p95'])}  "
+        f"p99 {seconds(latency['p99'])}  max {seconds(latency['max'])}",
+        f"Queue wait p95: {seconds(report['queue_wait_seconds']['p95'])}",
+        f"Throughput: {report['jobs_per_minute']:.1f} jobs/min",
+        f"Peak RSS: {report['peak_rss_mb']:.1f} MB",
+        "",
+        f"{'stage':<16}{'p50':>10}{'p95':>10}{'p99':>10}{'on critical path':>18}",
+    ]
+    by_median = sorted(
+        report["stages"].items(), key=lambda item: -(item[1]["p50"] or 0)
+    )
+    for stage, values in by_median:
+        lines.append(
+            f"{stage:<16}{seconds(values['p50']):>10}{seconds(values['p95']):>10}"
+            f"{seconds(values['p99']):>10}{report['critical_path'].get(stage, 0):>18}"
+        )
+    lines.append("")
+    for name, requests in report["fake_requests"].items():
+        counts = ", ".join(f"{route}={count}" for route, count in requests.items())
+        lines.append(f"{name}: {counts or 'no requests'}")
+    for failure in report["failures"]:
+        lines.append(f"Failed: {failure['status']}: {failure['error']}")
+    return "\n".join(lines)
+
+
+def use_fakes(args: argparse.Namespace, urls: dict):
+    """
+    Points the service's clients at the fake services.
+
+    Returns:
+        FakeGemini: The model stand-in, which counts the calls of this process.
+    """
+    from benchmarks.fakes import FakeGemini
+    import lib.gemini
+    import lib.github
+    import lib.notion
+    import lib.s3
+    import lib.tools
+
+    lib.github.GITHUB_URL = urls["github"]
+    lib.github.GITHUB_API_URL = f"{urls['github']}/api"
+    lib.tools.MERMAID_INK_URL = urls["mermaid_ink"]
+    lib.s3.endpoint_url = urls["s3"]
+    lib.s3._client = None
+    lib.notion.NOTION_API_URL = f"{urls['notion']}/v1"
+    gemini = FakeGemini(
+        args.gemini_latency,
+        args.gemini_tps,
+        args.gemini_tokens,
+        args.gemini_prefill_tps,
+    )
+    lib.gemini._model = gemini
+    return gemini
+
+
+def run_worker_process(args, workdir: str, urls: dict, stop, calls):
+    """
+    Runs a worker pool without the API in a separate process, taking jobs
+    from the queue shared with the benchmarked service until stop is set.
+    """
+    configure_environment(args, workdir)
+
+    async def work():
+        gemini = use_fakes(args, urls)
+        import main
+
+        main.worker_pool.start()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        await main.worker_pool.stop()
+        await main.close_sessions()
+        calls.put((gemini.calls, gemini.prompt_tokens))
+
+    asyncio.run(work())
+
+
+async def run_benchmark(args: argparse.Namespace, workdir: str) -> dict:
+    """Runs one benchmark and returns its report."""
+    import uvicorn
+
+    from benchmarks.fakes import (
+        FakeGitHub,
+        FakeMermaidInk,
+        FakeNotion,
+        FakeS3,
+    )
+
+    fakes = {
+        "github": FakeGitHub(
+            args.files, int(args.file_kb * 1024), latency=args.github_latency
+        ),
+        "mermaid_ink": FakeMermaidInk(latency=args.ink_latency),
+        "s3": FakeS3(latency=args.s3_latency),
+        "notion": FakeNotion(
+            latency=args.notion_latency, rate_limit_ratio=args.notion_429
+        ),
+    }
+    for service in fakes.values():
+        await service.start()
+    urls = {name: service.url for name, service in fakes.items()}
+    gemini = use_fakes(args, urls)
+
+    import main
+
+    # Fresh interpreters, like the processes of a gunicorn deployment
+    context = multiprocessing.get_context("spawn")
+    stop, calls = context.Event(), context.Queue()
+    processes = [
+        context.Process(
+            target=run_worker_process, args=(args, workdir, urls, stop, calls)
+        )
+        for _ in range(args.processes - 1)
+    ]
+    for process in processes:
+        process.start()
+
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    serving = asyncio.ensure_future(server.serve())
+    try:
+        while not server.started:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.05)
+        jobs = await drive_load(args, f"http://127.0.0.1:{port}")
+    finally:
+        server.should_exit = True
+        await serving
+        stop.set()
+        gemini_calls = Counter(gemini.calls)
+        prompt_tokens = Counter(gemini.prompt_tokens)
+        for process in processes:
+            try:
+                counts = await asyncio.to_thread(calls.get, True, 60)
+            except queue.Empty:
+                counts = ({}, {})
+            gemini_calls.update(counts[0])
+            prompt_tokens.update(counts[1])
+            await asyncio.to_thread(process.join)
+        for service in fakes.values():
+            await service.stop()
+
+    report = build_report(args, jobs, fakes)
+    report["fake_requests"]["gemini"] = dict(gemini_calls)
+    report["fake_requests"]["gemini_prompt_tokens"] = dict(prompt_tokens)
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="newsletter-bench-") as workdir:
+        configure_environment(args, workdir)
+        report = asyncio.run(run_benchmark(args, workdir))
+    print(format_report(report), flush=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if report["jobs"]["succeeded"] < report["jobs"]["submitted"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for running the service as several worker processes:
+
+    gunicorn main:app
+
+Every process serves the API and runs WORKER_CONCURRENCY newsletter jobs.
+The processes share the job queue (JOB_QUEUE_PATH), the LLM and diagram
+caches (CACHE_DIR), the repository snapshots (REPO_CACHE_DIR) and the job
+locks (LOCK_BACKEND), so these must point at the same paths for all of them.
+Rate limits and the workspace disk quota (WORKSPACE_QUOTA_BYTES) are per
+process.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Each process opens its own connections, sessions and browser after forking
+preload_app = False
+# Seconds a worker may go without a heartbeat before it is restarted
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# Seconds a stopping worker gets; the jobs it was running go back to the queue
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+accesslog = "-"
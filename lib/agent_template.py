@@ -1,4 +1,3 @@
-from lib.tools import mermaid_to_png
 from typing import Optional, Union
 from pydantic import BaseModel
 from typing import Literal
@@ -72,6 +71,24 @@ Output the content of the newsletter article in markdown format that can be easi
 """
 
 
+chunk_summarizer_agent = """
+<background>
+You are a senior software engineer who reads unfamiliar codebases and writes precise technical summaries for other writers.
+</background>
+<task>
+Summarise the part of a repository provided by the user. It is one module of a larger project, so describe only what is in front of you. Cover:
+1. The purpose of the module
+2. Its entry points, public classes and functions, with their signatures
+3. How it fits into the rest of the project (what it calls and what calls it, where this is visible)
+4. External services, libraries and configuration it depends on
+Keep names, URLs, commands and code identifiers exactly as they appear in the source.
+</task>
+<output>
+Output a concise markdown summary of at most 300 words. Do not include any text other than the summary.
+</output>
+"""
+
+
 class NotionBlock(BaseModel):
     type: Literal[
         "paragraph",
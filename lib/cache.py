@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/newsletter_cache")
+
+
+def make_key(*parts) -> str:
+    """
+    Builds a content-addressed cache key from the given parts.
+
+    Returns:
+        str: Hex SHA-256 digest of the JSON-encoded parts.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    A string cache with an in-memory LRU tier in front of a persistent SQLite tier.
+
+    Entries older than ``ttl`` seconds are treated as missing. The memory tier
+    holds at most ``max_entries`` values; the disk tier is trimmed to
+    ``max_disk_bytes``, dropping the least recently used entries first.
+
+    Args:
+        name (str): Cache name, used for the SQLite file name.
+        max_entries (int): Capacity of the in-memory tier (0 disables it).
+        max_disk_bytes (int): Size budget of the disk tier (0 disables it).
+        ttl (float): Time-to-live in seconds, or None for no expiry.
+        path (str): SQLite file path (default: CACHE_DIR/<name>.sqlite3).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 256,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.path = path or os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self._memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached value for key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._memory[key]
+
+            if self.max_disk_bytes:
+                db = self._connect()
+                row = db.execute(
+                    "SELECT value, created_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    db.execute(
+                        "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+                if row is not None:
+                    db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """Stores value under key in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self.max_disk_bytes:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO entries "
+                    "(key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode("utf-8")), now, now),
+                )
+                self._evict(db, now)
+                db.commit()
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        Like get, for coroutines: the disk tier may wait on other processes
+        writing to the same file, so the lookup runs in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, key)
+
+    async def aset(self, key: str, value: str):
+        """Like set, for coroutines; see aget."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.set, key, value)
+
+    def clear(self):
+        """Removes every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self.max_disk_bytes:
+                db = self._connect()
+                db.execute("DELETE FROM entries")
+                db.commit()
+
+    def _remember(self, key: str, created_at: float, value: str):
+        if not self.max_entries:
+            return
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        if self.ttl is not None:
+            db.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        stale = []
+        for key, size in db.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at ASC"
+        ):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters of this cache."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import re
+import uuid
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from lib.file_reader import BYTES_PER_TOKEN
+from lib.gemini import GEMINI_MODEL, get_genai, get_model
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "gemini" uses Gemini context caching, "local" the in-process stand-in, "off" neither
+CONTEXT_CACHE_BACKEND = os.getenv("CONTEXT_CACHE_BACKEND", "gemini").lower()
+# Gemini refuses to cache less than this; smaller contexts are sent inline
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+# Safety net for contexts of jobs that fail before releasing them
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "900"))
+# Context caching needs an explicit model version, e.g. models/gemini-1.5-flash-002.
+# Defaults to GEMINI_MODEL if that is versioned; otherwise the gemini backend is off
+CONTEXT_CACHE_MODEL = os.getenv("CONTEXT_CACHE_MODEL") or (
+    f"models/{GEMINI_MODEL}" if re.search(r"-\d{3}$", GEMINI_MODEL) else None
+)
+
+_client = None
+
+if CONTEXT_CACHE_BACKEND == "gemini" and CONTEXT_CACHE_MODEL is None:
+    logger.info(
+        "Context caching is off: GEMINI_MODEL %r has no version, "
+        "set CONTEXT_CACHE_MODEL to enable it",
+        GEMINI_MODEL,
+    )
+
+
+class GeminiContextCacheClient:
+    """Stores contexts with the Gemini context caching API."""
+
+    def create(self, text: str, ttl: int):
+        return get_genai().caching.CachedContent.create(
+            model=CONTEXT_CACHE_MODEL,
+            display_name="newsletter-repository",
+            contents=[text],
+            ttl=ttl,
+        )
+
+    def model_for(self, handle):
+        return get_genai().GenerativeModel.from_cached_content(handle)
+
+    def delete(self, handle):
+        handle.delete()
+
+
+class _LocalCachedModel:
+    def __init__(self, text: str, model):
+        self._text = text
+        self._model = model
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return await self._model.generate_content_async(
+            f"{self._text}\n\n{prompt}", **kwargs
+        )
+
+
+class LocalContextCacheClient:
+    """
+    In-process stand-in for Gemini context caching, for tests and offline use.
+
+    Contexts are kept in memory and put in front of every prompt that uses
+    them, so agents see the same input as with the real cache.
+    """
+
+    def __init__(self):
+        self.contexts: dict = {}
+        self.created = 0
+
+    def create(self, text: str, ttl: int) -> str:
+        name = f"local/{uuid.uuid4().hex}"
+        self.contexts[name] = text
+        self.created += 1
+        return name
+
+    def model_for(self, handle):
+        return _LocalCachedModel(self.contexts[handle], get_model())
+
+    def delete(self, handle):
+        self.contexts.pop(handle, None)
+
+
+def get_context_cache_client():
+    """Returns the client of CONTEXT_CACHE_BACKEND, or None if caching is off."""
+    global _client
+    if _client is None and CONTEXT_CACHE_BACKEND == "local":
+        _client = LocalContextCacheClient()
+    elif _client is None and CONTEXT_CACHE_BACKEND == "gemini" and CONTEXT_CACHE_MODEL:
+        _client = GeminiContextCacheClient()
+    return _client
+
+
+def set_context_cache_client(client):
+    """Replaces the context cache client, e.g. with a local one in tests."""
+    global _client
+    _client = client
+
+
+class SharedContext:
+    """
+    A large input, such as the repository, shared by several agents of a job.
+
+    When ``handle`` is set the text lives in a server-side cache and agents
+    only send their own instructions; otherwise it is sent inline with each
+    call, exactly as without caching.
+    """
+
+    def __init__(self, text: str, handle=None, client=None):
+        self.text = text
+        self.handle = handle
+        self._client = client
+        self._model = None
+
+    @property
+    def cached(self) -> bool:
+        return self.handle is not None
+
+    def model(self):
+        """Returns a model that answers with this context in front of every prompt."""
+        if self._model is None:
+            self._model = self._client.model_for(self.handle)
+        return self._model
+
+    async def release(self):
+        """Deletes the server-side copy of the context, if there is one."""
+        if self.handle is None:
+            return
+        handle, self.handle = self.handle, None
+        self._model = None
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._client.delete, handle)
+        except Exception as e:
+            # It expires on its own after CONTEXT_CACHE_TTL
+            logger.warning("Could not delete cached context: %s", e)
+
+
+async def share_context(text: str, min_tokens: Optional[int] = None) -> SharedContext:
+    """
+    Registers text as a context that several agents can reference.
+
+    Contexts below the caching threshold, or that fail to be cached, are
+    returned uncached and sent inline, so callers never need a second path.
+    """
+    min_tokens = CONTEXT_CACHE_MIN_TOKENS if min_tokens is None else min_tokens
+    client = get_context_cache_client()
+    tokens = len(text.encode("utf-8")) // BYTES_PER_TOKEN
+    if client is None or tokens < min_tokens:
+        return SharedContext(text)
+
+    loop = asyncio.get_running_loop()
+    try:
+        handle = await loop.run_in_executor(
+            None, client.create, text, CONTEXT_CACHE_TTL
+        )
+    except Exception as e:
+        logger.warning("Context caching failed, sending the context inline: %s", e)
+        return SharedContext(text)
+    logger.info("Cached a context of about %d tokens", tokens)
+    return SharedContext(text, handle, client)
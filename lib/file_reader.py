@@ -1,22 +1,277 @@
+import fnmatch
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+from dotenv import load_dotenv
 
-def read_files_in_directory(directory_path: str, get_files: Optional[list[str]] = None):
+from lib.skeleton import python_skeleton
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the bytes of file content read from a repository
+READER_MAX_BYTES = int(os.getenv("READER_MAX_BYTES", "400000"))
+READER_WORKERS = int(os.getenv("READER_WORKERS", "8"))
+# "full" reads files verbatim; "digest" reduces Python files to their AST
+# skeletons and keeps Markdown and other files in full
+READER_MODES = ("full", "digest")
+# Byte budget of a digest, kept below SUMMARY_THRESHOLD_BYTES so that digests
+# are given to the agents as they are, without map-reduce summarisation
+READER_DIGEST_MAX_BYTES = int(os.getenv("READER_DIGEST_MAX_BYTES", "120000"))
+# Most source bytes a digest reads, however small the skeletons turn out
+READER_DIGEST_SCAN_BYTES = int(
+    os.getenv("READER_DIGEST_SCAN_BYTES", str(10 * READER_DIGEST_MAX_BYTES))
+)
+# Rough size of a token, used to turn token budgets into byte budgets
+BYTES_PER_TOKEN = 4
+
+# Always skipped, in addition to the repository's own .gitignore
+DEFAULT_EXCLUDES = [
+    ".git/",
+    ".github/",
+    "node_modules/",
+    "__pycache__/",
+    ".venv/",
+    "venv/",
+    ".tox/",
+    "build/",
+    "dist/",
+    "site-packages/",
+    "*.egg-info/",
+    "*.min.js",
+]
+
+
+def load_ignore_patterns(directory_path: str) -> list[str]:
+    """
+    Reads the .gitignore at the root of a repository.
+
+    Returns:
+        list[str]: The patterns, without comments and blank lines.
+    """
+    path = os.path.join(directory_path, ".gitignore")
+    if not os.path.isfile(path):
+        return []
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        return [
+            line.strip()
+            for line in file
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def _pattern_matches(pattern: str, relative_path: str, is_dir: bool) -> bool:
+    if pattern.endswith("/"):
+        if not is_dir:
+            return False
+        pattern = pattern.rstrip("/")
+    if pattern.startswith("/") or "/" in pattern:
+        # Anchored at the repository root
+        return fnmatch.fnmatch(relative_path, pattern.lstrip("/"))
+    return fnmatch.fnmatch(os.path.basename(relative_path), pattern)
+
+
+def is_ignored(relative_path: str, patterns: list[str], is_dir: bool = False) -> bool:
+    """
+    Checks a path against .gitignore-style patterns. Later patterns win, and
+    patterns starting with "!" re-include what earlier ones excluded.
+
+    Args:
+        relative_path (str): Path relative to the repository root, using "/".
+        patterns (list[str]): The patterns to apply, in order.
+        is_dir (bool): Whether the path is a directory.
+    """
+    ignored = False
+    for pattern in patterns:
+        negated = pattern.startswith("!")
+        if _pattern_matches(pattern.lstrip("!"), relative_path, is_dir):
+            ignored = not negated
+    return ignored
+
+
+def list_repository_files(
+    directory_path: str,
+    get_files: Optional[list[str]] = None,
+    excludes: Optional[list[str]] = None,
+) -> list[str]:
+    """
+    Walks a directory tree and lists the files to give to the agents.
+
+    Ignored directories are pruned without being descended into. Files are
+    ordered by importance: README files first, then shallower files before
+    deeper ones, then by path.
+
+    Returns:
+        list[str]: Paths relative to directory_path, using "/".
+    """
+    patterns = DEFAULT_EXCLUDES + load_ignore_patterns(directory_path)
+    if excludes:
+        patterns += excludes
+
+    found = []
+    for root, dirs, files in os.walk(directory_path):
+        relative_root = os.path.relpath(root, directory_path).replace(os.sep, "/")
+        prefix = "" if relative_root == "." else relative_root + "/"
+        dirs[:] = sorted(
+            d for d in dirs if not is_ignored(prefix + d, patterns, is_dir=True)
+        )
+        for filename in files:
+            relative_path = prefix + filename
+            if get_files is not None and not any(
+                filename.endswith(ext) for ext in get_files
+            ):
+                continue
+            if not is_ignored(relative_path, patterns):
+                found.append(relative_path)
+
+    def priority(path: str):
+        is_readme = os.path.basename(path).lower().startswith("readme")
+        return (not is_readme, path.count("/"), path)
+
+    return sorted(found, key=priority)
+
+
+def _read_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        return file.read()
+
+
+def _read_digest(path: str) -> str:
+    content = _read_file(path)
+    return python_skeleton(content) if path.endswith(".py") else content
+
+
+def _read_digests(
+    directory_path: str, paths: list[str], budget: int
+) -> tuple[dict, int]:
+    """
+    Reads files in order as digests until budget bytes of digest are taken.
+
+    Returns:
+        tuple[dict, int]: The digests by path, and the number of files skipped.
+    """
+    scan, skipped = [], 0
+    remaining_scan = READER_DIGEST_SCAN_BYTES
+    for relative_path in paths:
+        try:
+            size = os.path.getsize(os.path.join(directory_path, relative_path))
+        except OSError:
+            continue
+        if size > remaining_scan:
+            skipped += 1
+            continue
+        scan.append(relative_path)
+        remaining_scan -= size
+
+    digests = {}
+    with ThreadPoolExecutor(max_workers=READER_WORKERS) as executor:
+        contents = executor.map(
+            _read_digest, (os.path.join(directory_path, p) for p in scan)
+        )
+        for relative_path, content in zip(scan, contents):
+            size = len(content.encode("utf-8"))
+            if size > budget:
+                skipped += 1
+                continue
+            digests[relative_path] = content
+            budget -= size
+    return digests, skipped
+
+
+def read_files_in_directory(
+    directory_path: str,
+    get_files: Optional[list[str]] = None,
+    max_bytes: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    excludes: Optional[list[str]] = None,
+    mode: str = "full",
+):
     """
-    Reads all text files in a directory and returns their contents.
+    Reads the text files of a repository, recursively and concurrently, up to a size budget.
+
+    Files are taken in the order of list_repository_files. A file that does
+    not fit in the remaining budget is skipped, so the result stays bounded
+    however large the repository is.
+
+    In "digest" mode, Python files are replaced by their skeletons (see
+    lib.skeleton) and the budget, READER_DIGEST_MAX_BYTES by default, applies
+    to the skeletons, so a small prompt still covers much of a large
+    codebase. Markdown and other files are kept in full.
 
     Args:
         directory_path (str): The path to the directory to read files from.
+        get_files (list[str]): File extensions to read, e.g. ["md", "py"] (default: all files).
+        max_bytes (int): Byte budget for file contents (default: READER_MAX_BYTES,
+            or READER_DIGEST_MAX_BYTES in "digest" mode).
+        max_tokens (int): Token budget; overrides max_bytes when given.
+        excludes (list[str]): Extra .gitignore-style patterns to skip.
+        mode (str): "full" or "digest", see READER_MODES.
 
     Returns:
-        dict: A dictionary where the keys are file names and the values are file contents.
+        dict: A dictionary where the keys are relative file paths and the values are file contents, in reading order.
     """
-    file_contents = {}
-    for filename in os.listdir(directory_path):
-        if get_files is None or any(filename.endswith(ext) for ext in get_files):
-            print("Getting file: ", filename)
-            with open(os.path.join(directory_path, filename), "r") as file:
-                file_contents[filename] = file.read()
+    if max_tokens is not None:
+        max_bytes = max_tokens * BYTES_PER_TOKEN
+    if mode not in READER_MODES:
+        raise ValueError(f"Unknown reader mode: {mode}")
+    if max_bytes is None:
+        max_bytes = READER_DIGEST_MAX_BYTES if mode == "digest" else READER_MAX_BYTES
+    remaining = max_bytes
+
+    listing = list_repository_files(directory_path, get_files, excludes)
+    if mode == "digest":
+        file_contents, skipped = _read_digests(directory_path, listing, remaining)
+        logger.info(
+            "Read %d file digests from %s%s",
+            len(file_contents),
+            directory_path,
+            f" ({skipped} skipped by the size budget)" if skipped else "",
+        )
+        return file_contents
+
+    selected = []
+    skipped = 0
+    for relative_path in listing:
+        try:
+            size = os.path.getsize(os.path.join(directory_path, relative_path))
+        except OSError:
+            continue
+        if size > remaining:
+            # One record per file; sampled with LOG_DEBUG_SAMPLE on large repositories
+            logger.debug(
+                "Skipping %s (%d bytes) over the size budget", relative_path, size
+            )
+            skipped += 1
+            continue
+        selected.append(relative_path)
+        remaining -= size
+
+    with ThreadPoolExecutor(max_workers=READER_WORKERS) as executor:
+        contents = executor.map(
+            _read_file, (os.path.join(directory_path, p) for p in selected)
+        )
+        file_contents = dict(zip(selected, contents))
 
+    logger.info(
+        "Read %d files from %s%s",
+        len(file_contents),
+        directory_path,
+        f" ({skipped} skipped by the size budget)" if skipped else "",
+    )
     return file_contents
+
+
+def format_files_document(file_contents: dict) -> str:
+    """
+    Renders file contents as one compact document for a prompt.
+
+    Returns:
+        str: Each file wrapped in a <file path="..."> element, in the given order.
+    """
+    return "\n".join(
+        f'<file path="{path}">\n{content.rstrip()}\n</file>'
+        for path, content in file_contents.items()
+    )
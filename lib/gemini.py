@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import os
+import weakref
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+
+from lib.cache import TieredCache, make_key
+from lib.metrics import (
+    ERRORS,
+    GEMINI_SECONDS,
+    GEMINI_TOKENS,
+    LLM_CACHE_REQUESTS,
+    span,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# Maximum number of Gemini requests in flight across all jobs in this process
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+# Per-call timeout in seconds
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "120"))
+# Cache of agent outputs keyed by model, agent prompt and user input
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_genai = None
+_model = None
+# One semaphore per event loop, so the limiter is never shared across loops
+_semaphores = weakref.WeakKeyDictionary()
+
+llm_cache = TieredCache(
+    "llm",
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    max_disk_bytes=LLM_CACHE_MAX_BYTES,
+    ttl=LLM_CACHE_TTL,
+)
+
+
+class AgentResponse:
+    """Agent result in a format similar to the original Runner."""
+
+    def __init__(self, output):
+        self.final_output = output
+
+
+def get_genai():
+    """
+    Returns the configured google.generativeai module, importing it on first
+    use: it takes most of a second to import, which would slow every start.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+
+        genai.configure(api_key=GEMINI_API_KEY)
+        _genai = genai
+    return _genai
+
+
+def get_model():
+    """Return the process-wide Gemini model client, creating it on first use."""
+    global _model
+    if _model is None:
+        _model = get_genai().GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+def _prepare_request(agent_prompt, user_input, context=None):
+    """
+    Returns the model, prompt and output cache key of an agent call.
+
+    A shared context is part of the agent's input. If it is cached on the
+    server, only the agent prompt and the extra user input are sent.
+    """
+    if context is not None:
+        user_input = f"{context.text}\n\n{user_input}" if user_input else context.text
+    cache_key = make_key(GEMINI_MODEL, agent_prompt, user_input)
+    if context is not None and context.cached:
+        extra = user_input[len(context.text) :].strip()
+        prompt = f"{agent_prompt}\n\nUser Input: the content provided above."
+        if extra:
+            prompt += f"\n\nAdditional User Input:\n{extra}"
+        return context.model(), prompt, cache_key
+    # Combine agent prompt with user input
+    return get_model(), f"{agent_prompt}\n\nUser Input:\n{user_input}", cache_key
+
+
+async def _cached_output(cache_key: str, agent_name: str):
+    cached = await llm_cache.aget(cache_key)
+    LLM_CACHE_REQUESTS.inc(
+        agent=agent_name, result="miss" if cached is None else "hit"
+    )
+    return cached
+
+
+def _record_usage(response, agent_name: str):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, field in (
+        ("prompt", "prompt_token_count"),
+        ("output", "candidates_token_count"),
+        ("cached", "cached_content_token_count"),
+    ):
+        count = getattr(usage, field, 0) or 0
+        if count:
+            GEMINI_TOKENS.inc(count, agent=agent_name, kind=kind)
+
+
+async def stream_agent_with_gemini(
+    agent_prompt,
+    user_input,
+    timeout=None,
+    use_cache=None,
+    context=None,
+    agent_name="agent",
+) -> AsyncIterator[str]:
+    """
+    Run an agent prompt against Gemini, yielding the output as it is generated.
+
+    Shares the concurrency limit and output cache of run_agent_with_gemini; a
+    cached output is yielded as a single chunk. The timeout applies to the
+    whole response, not to each chunk.
+
+    The response is read by a separate task into a buffer, and the
+    concurrency slot is held only while that task reads. A consumer that
+    waits between chunks, e.g. for another agent, never holds a slot that
+    agent needs.
+
+    Yields:
+        str: Consecutive pieces of the generated text.
+    """
+    timeout = timeout or GEMINI_TIMEOUT
+    if use_cache is None:
+        use_cache = LLM_CACHE_ENABLED
+    model, full_prompt, cache_key = _prepare_request(agent_prompt, user_input, context)
+    if use_cache:
+        cached = await _cached_output(cache_key, agent_name)
+        if cached is not None:
+            yield cached
+            return
+
+    deadline = asyncio.get_running_loop().time() + timeout
+    chunks = []
+    buffer: asyncio.Queue = asyncio.Queue()
+
+    async def read():
+        try:
+            async with _get_semaphore():
+                with GEMINI_SECONDS.time(agent=agent_name), span(
+                    "gemini", agent=agent_name, stream=True
+                ):
+                    async for text in _stream_response(
+                        model, full_prompt, timeout, deadline, agent_name
+                    ):
+                        buffer.put_nowait(text)
+        finally:
+            buffer.put_nowait(None)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            text = await buffer.get()
+            if text is None:
+                break
+            chunks.append(text)
+            yield text
+        # Raises what ended the stream early, if anything
+        await reader
+    except asyncio.TimeoutError:
+        ERRORS.inc(component="gemini")
+        logger.error(
+            "Gemini API timed out after %ss", timeout, extra={"agent": agent_name}
+        )
+        raise
+    except Exception as e:
+        ERRORS.inc(component="gemini")
+        logger.error("Gemini API error: %s", e, extra={"agent": agent_name})
+        raise
+    finally:
+        if not reader.done():
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    if use_cache:
+        await llm_cache.aset(cache_key, "".join(chunks))
+
+
+async def _stream_response(model, full_prompt, timeout, deadline, agent_name):
+    loop = asyncio.get_running_loop()
+    response = await asyncio.wait_for(
+        model.generate_content_async(
+            full_prompt, stream=True, request_options={"timeout": timeout}
+        ),
+        timeout=deadline - loop.time(),
+    )
+    iterator = response.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(
+                iterator.__anext__(), timeout=deadline - loop.time()
+            )
+        except StopAsyncIteration:
+            break
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts, e.g. the final usage metadata
+            continue
+        if text:
+            yield text
+    _record_usage(response, agent_name)
+
+
+async def run_agent_with_gemini(
+    agent_prompt,
+    user_input,
+    timeout=None,
+    use_cache=None,
+    on_chunk=None,
+    context=None,
+    agent_name="agent",
+):
+    """
+    Run an agent prompt against Gemini without blocking the event loop.
+
+    Calls are made through the native async API of the shared model client and
+    at most GEMINI_MAX_CONCURRENCY of them run at once; the rest wait their turn.
+    Outputs are cached by model, agent prompt and user input, so identical
+    requests are answered without calling the API.
+
+    Args:
+        agent_prompt (str): The agent's system prompt.
+        user_input (str): The user message appended to the prompt.
+        timeout (float): Seconds before the call is abandoned (default: GEMINI_TIMEOUT).
+        use_cache (bool): Whether to read and write the output cache
+            (default: LLM_CACHE_ENABLED).
+        on_chunk (Callable[[str], None]): If given, the response is streamed
+            and every piece of text is passed to it as soon as it arrives.
+        context (SharedContext): Input shared with other agents, placed
+            before user_input; see lib.context_cache.share_context.
+        agent_name (str): Label of the agent in metrics and traces.
+
+    Returns:
+        AgentResponse: The generated text as ``final_output``.
+    """
+    if on_chunk is not None:
+        chunks = []
+        async for chunk in stream_agent_with_gemini(
+            agent_prompt, user_input, timeout, use_cache, context, agent_name
+        ):
+            chunks.append(chunk)
+            on_chunk(chunk)
+        return AgentResponse("".join(chunks))
+
+    timeout = timeout or GEMINI_TIMEOUT
+    if use_cache is None:
+        use_cache = LLM_CACHE_ENABLED
+    model, full_prompt, cache_key = _prepare_request(agent_prompt, user_input, context)
+    if use_cache:
+        cached = await _cached_output(cache_key, agent_name)
+        if cached is not None:
+            return AgentResponse(cached)
+
+    try:
+        async with _get_semaphore():
+            with GEMINI_SECONDS.time(agent=agent_name), span(
+                "gemini", agent=agent_name
+            ):
+                response = await asyncio.wait_for(
+                    model.generate_content_async(
+                        full_prompt, request_options={"timeout": timeout}
+                    ),
+                    timeout=timeout,
+                )
+
+        output = response.text
+        _record_usage(response, agent_name)
+    except asyncio.TimeoutError:
+        ERRORS.inc(component="gemini")
+        logger.error(
+            "Gemini API timed out after %ss", timeout, extra={"agent": agent_name}
+        )
+        raise
+    except Exception as e:
+        ERRORS.inc(component="gemini")
+        logger.error("Gemini API error: %s", e, extra={"agent": agent_name})
+        raise
+
+    if use_cache:
+        await llm_cache.aset(cache_key, output)
+    return AgentResponse(output)
@@ -1,74 +1,692 @@
+import io
+import logging
 import os
+import shutil
 import tempfile
-import aiohttp
+import time
 import asyncio
+from collections import OrderedDict
+from functools import partial
+from typing import TYPE_CHECKING, Optional
 from urllib.parse import urlparse
 import zipfile
-import ssl
-import certifi
 
+try:
+    import fcntl
+except ImportError:  # Windows: pins only protect snapshots within the process
+    fcntl = None
 
-async def download_github_repo(repo_url, dest_folder="/tmp/newsletter_repos"):
+from dotenv import load_dotenv
+
+from lib.http import get_session
+from lib.metrics import DOWNLOAD_SECONDS, ERRORS, span
+
+if TYPE_CHECKING:
+    import aiohttp
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GITHUB_URL = "https://github.com"
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+# Extracted repository snapshots, one directory per owner/repo/commit SHA
+REPO_CACHE_DIR = os.getenv("REPO_CACHE_DIR", "/tmp/newsletter_repos/snapshots")
+REPO_CACHE_MAX_BYTES = int(os.getenv("REPO_CACHE_MAX_BYTES", str(2 * 1024**3)))
+
+SNAPSHOT_MARKER = ".snapshot-complete"
+
+# Archives up to this size are buffered in memory, larger ones spill to disk
+ZIP_SPOOL_MAX_BYTES = int(os.getenv("ZIP_SPOOL_MAX_BYTES", str(32 * 1024**2)))
+# Files larger than this are skipped when extracting
+ZIP_MAX_FILE_BYTES = int(os.getenv("ZIP_MAX_FILE_BYTES", str(1024**2)))
+# Archives whose selected files exceed this uncompressed size are rejected
+ZIP_MAX_UNCOMPRESSED_BYTES = int(
+    os.getenv("ZIP_MAX_UNCOMPRESSED_BYTES", str(512 * 1024**2))
+)
+
+# Leading path segments of a /tree/ URL that are tried as the ref
+REF_MAX_SEGMENTS = 4
+# Answers to a commit lookup meaning the ref does not exist
+REF_NOT_FOUND_STATUSES = {404, 422}
+
+# Commit lookups whose ETag is remembered, least recently used dropped first
+COMMIT_ETAG_MAX_ENTRIES = int(os.getenv("COMMIT_ETAG_MAX_ENTRIES", "4096"))
+
+# ETag and SHA of the last commit lookup per (owner, repo, ref)
+_commit_etags: "OrderedDict[tuple, tuple[str, str]]" = OrderedDict()
+# Snapshots in use by running jobs, which eviction must not remove: path ->
+# (pin count, marker file holding a shared lock that other processes see)
+_pinned_snapshots: dict = {}
+# Snapshots being downloaded, so concurrent jobs for one commit share a download
+_inflight_downloads: dict = {}
+
+
+class RepositoryNotFoundError(Exception):
+    """Raised when GitHub has no archive for a repository and ref."""
+
+
+class RefResolutionError(Exception):
     """
-    Asynchronously downloads the contents of a public GitHub repository as a zip file and extracts it to dest_folder.
-    Args:
-            repo_url (str): The URL of the GitHub repository.
-            dest_folder (str): The folder to extract the repo into (default: '/tmp/newsletter_repos').
+    Raised when GitHub could not say whether a ref exists, e.g. because of a
+    rate limit, a server error or a timeout; trying again later may work.
+    """
+
+
+def parse_github_url(repo_url: str) -> tuple[str, str]:
+    """
+    Extracts the owner and repository name from a GitHub URL.
+
     Returns:
-            str: Path to the extracted repository folder.
+        tuple[str, str]: (owner, repo)
     """
     parsed = urlparse(repo_url)
     path_parts = parsed.path.strip("/").split("/")
     if len(path_parts) < 2:
         raise ValueError("Invalid GitHub repository URL")
-    owner, repo = path_parts[0], path_parts[1].replace(".git", "")
-    zip_urls = [
-        f"https://github.com/{owner}/{repo}/archive/refs/heads/main.zip",
-        f"https://github.com/{owner}/{repo}/archive/refs/heads/master.zip",
-        f"https://github.com/{owner}/{repo}/archive/HEAD.zip",
+    return path_parts[0], path_parts[1].replace(".git", "")
+
+
+async def resolve_commit_sha(
+    session: "aiohttp.ClientSession", owner: str, repo: str, ref: str = "HEAD"
+) -> Optional[str]:
+    """
+    Resolves a ref to its commit SHA with a single lightweight API call.
+
+    Returns:
+        Optional[str]: The commit SHA, or None if it could not be resolved.
+    """
+    try:
+        return await _lookup_commit_sha(session, owner, repo, ref)
+    except RefResolutionError as e:
+        logger.warning("%s", e)
+        return None
+
+
+async def _lookup_commit_sha(
+    session: "aiohttp.ClientSession", owner: str, repo: str, ref: str
+) -> Optional[str]:
+    """
+    Looks up the commit SHA of a ref.
+
+    The request asks for the bare SHA and sends the ETag of the previous
+    lookup, so an unchanged ref is answered with 304 Not Modified, which
+    GitHub does not count against the rate limit.
+
+    Returns:
+        Optional[str]: The commit SHA, or None if the ref does not exist.
+
+    Raises:
+        RefResolutionError: If GitHub gave no answer, e.g. when rate limited.
+    """
+    cache_key = (owner, repo, ref)
+    headers = {"Accept": "application/vnd.github.sha"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    previous = _commit_etags.get(cache_key)
+    if previous:
+        headers["If-None-Match"] = previous[0]
+
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/commits/{ref}"
+    import aiohttp
+
+    try:
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            if response.status == 304 and previous:
+                _commit_etags.move_to_end(cache_key)
+                return previous[1]
+            if response.status == 200:
+                sha = (await response.text()).strip()
+                etag = response.headers.get("ETag")
+                if etag:
+                    _remember_etag(cache_key, etag, sha)
+                return sha
+            status = response.status
+    except Exception as e:
+        raise RefResolutionError(f"Could not resolve {owner}/{repo}@{ref}: {e}") from e
+    if status in REF_NOT_FOUND_STATUSES:
+        logger.info("%s/%s has no ref '%s'", owner, repo, ref)
+        return None
+    raise RefResolutionError(f"Could not resolve {owner}/{repo}@{ref}: HTTP {status}")
+
+
+def _remember_etag(cache_key: tuple, etag: str, sha: str):
+    _commit_etags[cache_key] = (etag, sha)
+    _commit_etags.move_to_end(cache_key)
+    while len(_commit_etags) > COMMIT_ETAG_MAX_ENTRIES:
+        _commit_etags.popitem(last=False)
+
+
+async def resolve_ref(
+    session: "aiohttp.ClientSession", owner: str, repo: str, ref: str = "HEAD"
+) -> tuple[str, Optional[str]]:
+    """
+    Resolves a ref taken from a URL path, which may run past the ref itself:
+    in /tree/main/docs the ref is "main", but in /tree/feature/x it may be
+    "feature/x". The first REF_MAX_SEGMENTS prefixes of the path are looked
+    up at the same time and the longest that exists wins; if GitHub says
+    none exists, a multi-segment path falls back to the default branch.
+
+    Returns:
+        tuple[str, Optional[str]]: The ref, and its commit SHA if it resolved.
+
+    Raises:
+        RefResolutionError: If a multi-segment path could not be resolved
+            because GitHub gave no answer, e.g. when rate limited.
+    """
+    if is_commit_sha(ref):
+        return ref.lower(), ref.lower()
+    parts = ref.split("/")
+    if len(parts) == 1:
+        return ref, await resolve_commit_sha(session, owner, repo, ref)
+    candidates = [
+        "/".join(parts[:end]) for end in range(min(len(parts), REF_MAX_SEGMENTS), 0, -1)
     ]
-    os.makedirs(dest_folder, exist_ok=True)
-    last_error = None
+    results = await asyncio.gather(
+        *(_lookup_commit_sha(session, owner, repo, c) for c in candidates),
+        return_exceptions=True,
+    )
+    for candidate, result in zip(candidates, results):
+        if isinstance(result, BaseException):
+            # A longer prefix may be the ref: guessing a shorter one, or the
+            # default branch, could publish the wrong branch
+            raise result
+        if result:
+            return candidate, result
+    logger.warning(
+        "No prefix of '%s' is a ref of %s/%s, using the default branch",
+        ref,
+        owner,
+        repo,
+    )
+    return "HEAD", await resolve_commit_sha(session, owner, repo, "HEAD")
+
+
+def _snapshot_path(
+    owner: str, repo: str, sha: str, extensions: Optional[list[str]] = None
+) -> str:
+    return os.path.join(REPO_CACHE_DIR, owner, repo, sha, _extensions_tag(extensions))
+
+
+def _snapshot_is_complete(snapshot: str) -> bool:
+    return os.path.isfile(os.path.join(snapshot, SNAPSHOT_MARKER))
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
 
-    # Create SSL context for secure connections
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
+def _store_snapshot(extracted_folder: str, snapshot: str):
+    """Moves a freshly extracted tree into the snapshot store."""
+    with open(os.path.join(extracted_folder, SNAPSHOT_MARKER), "w") as marker:
+        marker.write(str(_directory_size(extracted_folder)))
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    if _snapshot_is_complete(snapshot):
+        # Another job stored the same commit first
+        shutil.rmtree(extracted_folder, ignore_errors=True)
+        return
+    try:
+        os.replace(extracted_folder, snapshot)
+    except OSError:
+        if _snapshot_is_complete(snapshot):
+            shutil.rmtree(extracted_folder, ignore_errors=True)
+            return
+        # The workspace may live on another filesystem
+        staging = f"{snapshot}.{os.getpid()}.tmp"
+        shutil.copytree(extracted_folder, staging)
+        os.replace(staging, snapshot)
+        shutil.rmtree(extracted_folder, ignore_errors=True)
 
-    for zip_url in zip_urls:
+
+def _touch_snapshot(snapshot: str):
+    os.utime(os.path.join(snapshot, SNAPSHOT_MARKER))
+
+
+def _pin_snapshot(snapshot: str, workspace):
+    """
+    Protects a snapshot from eviction, by this or any other process sharing
+    REPO_CACHE_DIR, until the workspace is cleaned up.
+    """
+    count, marker = _pinned_snapshots.get(snapshot, (0, None))
+    if marker is None and fcntl is not None:
         try:
-            print(f"Trying to download from: {zip_url}", flush=True)
-            async with aiohttp.ClientSession(connector=connector) as session:
-                timeout = aiohttp.ClientTimeout(total=30)
-                async with session.get(zip_url, timeout=timeout) as response:
-                    print(f"Response status: {response.status}", flush=True)
-                    if response.status == 200:
-                        print("Download successful, extracting...", flush=True)
-                        with tempfile.NamedTemporaryFile(
-                            delete=False, suffix=".zip"
-                        ) as tmp_zip:
-                            while True:
-                                chunk = await response.content.read(8192)
-                                if not chunk:
-                                    break
-                                tmp_zip.write(chunk)
-                            tmp_zip_path = tmp_zip.name
-                        with zipfile.ZipFile(tmp_zip_path, "r") as zip_ref:
-                            zip_ref.extractall(dest_folder)
-                        os.remove(tmp_zip_path)
-                        extracted_folder = os.path.join(
-                            dest_folder, os.listdir(dest_folder)[0]
-                        )
-                        print(f"Extracted to: {extracted_folder}", flush=True)
-                        return extracted_folder
-                    else:
-                        print(
-                            f"HTTP {response.status}: {await response.text()}",
-                            flush=True,
-                        )
-        except Exception as e:
-            print(f"Error downloading from {zip_url}: {str(e)}", flush=True)
-            last_error = e
+            marker = open(os.path.join(snapshot, SNAPSHOT_MARKER))
+            fcntl.flock(marker, fcntl.LOCK_SH)
+        except OSError as e:
+            logger.warning("Could not lock snapshot %s: %s", snapshot, e)
+    _pinned_snapshots[snapshot] = (count + 1, marker)
+
+    def unpin():
+        count, marker = _pinned_snapshots.get(snapshot, (1, None))
+        if count > 1:
+            _pinned_snapshots[snapshot] = (count - 1, marker)
+            return
+        _pinned_snapshots.pop(snapshot, None)
+        if marker is not None:
+            marker.close()
+
+    workspace.on_cleanup(unpin)
+
+
+def _remove_unpinned_snapshot(path: str) -> bool:
+    """Deletes a snapshot unless another process has it pinned."""
+    if fcntl is None:
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+    try:
+        with open(os.path.join(path, SNAPSHOT_MARKER)) as marker:
+            fcntl.flock(marker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            shutil.rmtree(path, ignore_errors=True)
+    except BlockingIOError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def evict_snapshots(max_bytes: int = REPO_CACHE_MAX_BYTES, keep: Optional[str] = None):
+    """
+    Deletes the least recently used snapshots until the store fits in max_bytes.
+
+    Args:
+        max_bytes (int): Disk budget of the snapshot store.
+        keep (str): A snapshot path that must not be evicted.
+    """
+    snapshots = []
+    for root, dirs, files in os.walk(REPO_CACHE_DIR):
+        if SNAPSHOT_MARKER in files:
+            marker = os.path.join(root, SNAPSHOT_MARKER)
+            try:
+                with open(marker) as f:
+                    size = int(f.read().strip() or 0)
+                snapshots.append((os.path.getmtime(marker), size, root))
+            except (OSError, ValueError):
+                continue
+            dirs[:] = []
+
+    total = sum(size for _, size, _ in snapshots)
+    for _, size, path in sorted(snapshots):
+        if total <= max_bytes:
+            break
+        if path == keep or path in _pinned_snapshots:
             continue
-    raise Exception(
-        f"Failed to download repo from {repo_url}. Last error: {last_error}"
+        if _remove_unpinned_snapshot(path):
+            logger.info("Evicted repository snapshot: %s", path)
+            total -= size
+
+
+def _matches_extensions(name: str, extensions: Optional[list[str]]) -> bool:
+    return extensions is None or any(
+        name.endswith("." + ext.lstrip(".")) for ext in extensions
     )
+
+
+def _extensions_tag(extensions: Optional[list[str]]) -> str:
+    if extensions is None:
+        return "all"
+    return "-".join(sorted(ext.lstrip(".") for ext in extensions))
+
+
+def iter_zip_members(
+    archive,
+    extensions: Optional[list[str]] = None,
+    max_file_bytes: int = ZIP_MAX_FILE_BYTES,
+    max_total_bytes: int = ZIP_MAX_UNCOMPRESSED_BYTES,
+):
+    """
+    Yields the text files of a GitHub zipball whose names match extensions.
+
+    Members larger than max_file_bytes and binary files are skipped, and the
+    archive is rejected once the selected members exceed max_total_bytes
+    uncompressed. The top-level "<repo>-<ref>/" folder is stripped from paths.
+
+    Args:
+        archive: Path or binary file object of the zip archive.
+        extensions (list[str]): File extensions to keep, e.g. ["md", "py"]; None keeps all.
+
+    Yields:
+        tuple[str, bytes]: (relative path, file contents)
+    """
+    total = 0
+    with zipfile.ZipFile(archive, "r") as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            parts = info.filename.split("/", 1)
+            if len(parts) < 2 or not parts[1]:
+                continue
+            relative = os.path.normpath(parts[1])
+            if os.path.isabs(relative) or relative.startswith(".."):
+                continue
+            # .gitignore files are kept so the reader can honour them
+            if not _matches_extensions(relative, extensions) and (
+                os.path.basename(relative) != ".gitignore"
+            ):
+                continue
+            if info.file_size > max_file_bytes:
+                continue
+            total += info.file_size
+            if total > max_total_bytes:
+                raise ValueError(
+                    f"Archive exceeds {max_total_bytes} uncompressed bytes"
+                )
+            with zip_ref.open(info) as member:
+                # Never trust the declared size: read at most one byte past the limit
+                data = member.read(max_file_bytes + 1)
+            if len(data) > max_file_bytes or b"\0" in data[:8192]:
+                continue
+            yield relative, data
+
+
+def extract_zip_members(
+    archive, dest_folder: str, extensions: Optional[list[str]] = None
+) -> int:
+    """
+    Extracts the matching text files of a GitHub zipball into dest_folder,
+    without the archive's top-level folder.
+
+    Returns:
+        int: Number of files written.
+    """
+    count = 0
+    for relative, data in iter_zip_members(archive, extensions):
+        path = os.path.join(dest_folder, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        count += 1
+    return count
+
+
+def _selected_size(archive, extensions: Optional[list[str]] = None) -> int:
+    """Uncompressed size of the members extract_zip_members would write."""
+    with zipfile.ZipFile(archive, "r") as zip_ref:
+        return sum(
+            info.file_size
+            for info in zip_ref.infolist()
+            if not info.is_dir()
+            and info.file_size <= ZIP_MAX_FILE_BYTES
+            and (
+                _matches_extensions(info.filename, extensions)
+                or os.path.basename(info.filename) == ".gitignore"
+            )
+        )
+
+
+def _zip_top_folder(archive) -> str:
+    with zipfile.ZipFile(archive, "r") as zip_ref:
+        names = zip_ref.namelist()
+    return names[0].split("/", 1)[0] if names else "repo"
+
+
+async def _fetch_zip(session, zip_url):
+    """
+    Downloads a zipball into memory, spooling to disk only above ZIP_SPOOL_MAX_BYTES.
+
+    Returns:
+        Optional[BinaryIO]: The archive positioned at its start, a BytesIO or a
+        temporary file, or None if the repository or ref does not exist.
+
+    Raises:
+        RuntimeError: If the server answered with another error, which may pass.
+    """
+    logger.info("Trying to download from: %s", zip_url)
+    import aiohttp
+
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with session.get(zip_url, timeout=timeout) as response:
+        logger.debug("Response status: %s", response.status)
+        if response.status != 200:
+            logger.warning("HTTP %s: %s", response.status, await response.text())
+            if response.status == 404:
+                return None
+            raise RuntimeError(f"GitHub returned HTTP {response.status}")
+        logger.debug("Download successful, extracting...")
+        # Not a SpooledTemporaryFile: before Python 3.11 it lacks seekable(),
+        # which zipfile needs
+        archive = io.BytesIO()
+        try:
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                archive.write(chunk)
+                if isinstance(archive, io.BytesIO) and (
+                    archive.tell() > ZIP_SPOOL_MAX_BYTES
+                ):
+                    spilled = tempfile.TemporaryFile()
+                    spilled.write(archive.getvalue())
+                    archive.close()
+                    archive = spilled
+        except BaseException:
+            archive.close()
+            raise
+    archive.seek(0)
+    return archive
+
+
+async def _extract_archive(archive, dest_folder, extensions=None, workspace=None):
+    """
+    Extracts the matching files of a downloaded zipball into dest_folder.
+
+    If a workspace is given, the extracted size is reserved from its disk
+    quota first, waiting for other jobs to release space if necessary.
+
+    Returns:
+        str: Path to the extracted repository folder.
+    """
+    loop = asyncio.get_running_loop()
+    with archive:
+        if workspace is not None:
+            size = await loop.run_in_executor(
+                None, _selected_size, archive, extensions
+            )
+            await workspace.reserve(size)
+            archive.seek(0)
+        extracted_folder = os.path.join(dest_folder, _zip_top_folder(archive))
+        archive.seek(0)
+        count = await loop.run_in_executor(
+            None, extract_zip_members, archive, extracted_folder, extensions
+        )
+    os.makedirs(extracted_folder, exist_ok=True)
+    logger.info("Extracted %d files to: %s", count, extracted_folder)
+    return extracted_folder
+
+
+async def _discard_fetch(task: asyncio.Task):
+    """Cancels a zipball download that is no longer needed."""
+    task.cancel()
+    try:
+        archive = await task
+    except BaseException:
+        return
+    if archive is not None:
+        archive.close()
+
+
+def _archive_url(owner: str, repo: str, ref: str) -> str:
+    return f"{GITHUB_URL}/{owner}/{repo}/archive/{ref}.zip"
+
+
+def parse_github_ref(repo_url: str) -> Optional[str]:
+    """
+    Extracts an explicit branch, tag or commit from a GitHub URL such as
+    https://github.com/owner/repo/tree/<ref> or .../commit/<sha>.
+
+    The path after /tree/ may continue into a directory of the ref, e.g.
+    /tree/main/docs; resolve_ref finds where the ref ends.
+
+    Returns:
+        Optional[str]: The ref, or None if the URL points at the repository itself.
+    """
+    path_parts = urlparse(repo_url).path.strip("/").split("/")
+    if len(path_parts) >= 4 and path_parts[2] in ("tree", "commit"):
+        return "/".join(path_parts[3:])
+    return None
+
+
+def is_commit_sha(ref: str) -> bool:
+    return len(ref) == 40 and all(c in "0123456789abcdef" for c in ref.lower())
+
+
+async def download_github_repo(
+    repo_url, dest_folder=None, extensions=None, workspace=None, ref=None
+):
+    """
+    Asynchronously downloads the contents of a public GitHub repository as a zip file and extracts it to dest_folder.
+
+    The ref (explicit, taken from the URL, or HEAD for the default branch) is
+    resolved to a commit SHA while the archive of that ref is already being
+    downloaded on the process-wide HTTP session, so a cache miss costs a single
+    round trip. If the commit has already been extracted, the download is
+    cancelled and the cached snapshot is returned; otherwise the archive is
+    stored in the snapshot cache (REPO_CACHE_DIR), which is kept under
+    REPO_CACHE_MAX_BYTES by evicting the least recently used snapshots. An
+    explicit commit SHA needs no resolution at all.
+
+    The archive is buffered in memory and only text files matching extensions
+    are extracted; binaries and oversized files are skipped.
+
+    When a job workspace is given, extraction happens inside it under its disk
+    quota, and the returned snapshot is protected from eviction until the
+    workspace is cleaned up. Concurrent calls for the same commit share one
+    download.
+
+    Args:
+            repo_url (str): The URL of the GitHub repository.
+            dest_folder (str): The folder to extract the repo into when the commit cannot be resolved (default: the workspace, or '/tmp/newsletter_repos').
+            extensions (list[str]): File extensions to extract, e.g. ["md", "py"] (default: all files).
+            workspace (Workspace): The job's workspace from lib.workspace.job_workspace.
+            ref (str): Branch, tag or commit SHA to download (default: from the URL, else the default branch).
+    Returns:
+            str: Path to the extracted repository folder.
+    """
+    start = time.perf_counter()
+    try:
+        with span("github.download", repo=repo_url):
+            path, source = await _download_github_repo(
+                repo_url, dest_folder, extensions, workspace, ref
+            )
+    except Exception:
+        ERRORS.inc(component="github")
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - start, source="error")
+        raise
+    DOWNLOAD_SECONDS.observe(time.perf_counter() - start, source=source)
+    return path
+
+
+async def _download_github_repo(repo_url, dest_folder, extensions, workspace, ref):
+    """
+    Does the work of download_github_repo.
+
+    Returns:
+        tuple[str, str]: The repository folder, and where it came from:
+            "snapshot", "shared", "download" or "uncached".
+    """
+    owner, repo = parse_github_url(repo_url)
+    ref = ref or parse_github_ref(repo_url) or "HEAD"
+    if dest_folder is None:
+        dest_folder = workspace.path if workspace else "/tmp/newsletter_repos"
+    os.makedirs(dest_folder, exist_ok=True)
+
+    session = get_session()
+    sha = ref.lower() if is_commit_sha(ref) else None
+    if sha and _snapshot_is_complete(_snapshot_path(owner, repo, sha, extensions)):
+        fetch_task = None
+    else:
+        fetch_task = asyncio.ensure_future(
+            _fetch_zip(session, _archive_url(owner, repo, sha or ref))
+        )
+
+    leader = None
+    try:
+        if sha is None:
+            resolved, sha = await resolve_ref(session, owner, repo, ref)
+            if resolved != ref:
+                # The URL path ran past the ref, e.g. /tree/main/docs
+                await _discard_fetch(fetch_task)
+                ref = resolved
+                fetch_task = asyncio.ensure_future(
+                    _fetch_zip(session, _archive_url(owner, repo, sha or ref))
+                )
+        if sha:
+            snapshot = _snapshot_path(owner, repo, sha, extensions)
+            if _snapshot_is_complete(snapshot):
+                if fetch_task is not None:
+                    await _discard_fetch(fetch_task)
+                logger.info("Using cached snapshot: %s", snapshot)
+                _touch_snapshot(snapshot)
+                if workspace is not None:
+                    _pin_snapshot(snapshot, workspace)
+                return snapshot, "snapshot"
+
+            shared = _inflight_downloads.get(snapshot)
+            if shared is not None:
+                # Another job is already downloading this commit: share its result
+                await _discard_fetch(fetch_task)
+                logger.info("Waiting for in-flight download of %s", snapshot)
+                if not await asyncio.shield(shared):
+                    raise RuntimeError("The shared download of this commit failed")
+                if workspace is not None:
+                    _pin_snapshot(snapshot, workspace)
+                return snapshot, "shared"
+            leader = asyncio.get_running_loop().create_future()
+            _inflight_downloads[snapshot] = leader
+
+        archive = await fetch_task
+    except BaseException as e:
+        if fetch_task is not None and not fetch_task.done():
+            await _discard_fetch(fetch_task)
+        _finish_inflight(leader, sha and snapshot, False)
+        if isinstance(e, Exception):
+            raise Exception(
+                f"Failed to download repo from {repo_url}. Last error: {e}"
+            ) from e
+        raise
+    if archive is None:
+        _finish_inflight(leader, sha and snapshot, False)
+        raise RepositoryNotFoundError(
+            f"Failed to download repo from {repo_url}. Ref '{ref}' was not found"
+        )
+
+    if not sha:
+        # The commit is unknown, so the tree cannot be cached
+        path = await _extract_archive(archive, dest_folder, extensions, workspace)
+        return path, "uncached"
+
+    staging_root = workspace.path if workspace else REPO_CACHE_DIR
+    os.makedirs(staging_root, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=staging_root, prefix=".staging-")
+    stored = False
+    try:
+        extracted_folder = await _extract_archive(
+            archive, staging, extensions, workspace
+        )
+        # Sizing, copying and evicting walk whole trees: keep them off the loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _store_snapshot, extracted_folder, snapshot)
+        stored = True
+        if workspace is not None:
+            _pin_snapshot(snapshot, workspace)
+        await loop.run_in_executor(None, partial(evict_snapshots, keep=snapshot))
+        logger.info("Stored snapshot: %s", snapshot)
+        return snapshot, "download"
+    finally:
+        _finish_inflight(leader, snapshot, stored)
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _finish_inflight(leader, snapshot, stored: bool):
+    """Tells jobs waiting on a shared download whether the snapshot is ready."""
+    if leader is None:
+        return
+    _inflight_downloads.pop(snapshot, None)
+    if not leader.done():
+        leader.set_result(stored)
+
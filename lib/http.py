@@ -0,0 +1,99 @@
+import asyncio
+import os
+import ssl
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import aiohttp
+
+load_dotenv()
+
+# Maximum number of pooled connections per process (0 means unlimited)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_SIZE_PER_HOST = int(os.getenv("HTTP_POOL_SIZE_PER_HOST", "20"))
+
+# One session per event loop; aiohttp sessions cannot be shared across loops
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_session() -> "aiohttp.ClientSession":
+    """
+    Returns the process-wide HTTP session, creating it on first use.
+
+    The session keeps a pool of keep-alive connections and a DNS cache, so
+    repeated requests to GitHub, Notion or Mermaid Ink skip the TCP and TLS
+    handshakes. Callers must not close it; use close_sessions on shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # Imported with the first session, not at startup
+        import aiohttp
+        import certifi
+
+        # Create SSL context for secure connections
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_context,
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_SIZE_PER_HOST,
+            ttl_dns_cache=300,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+
+async def close_sessions():
+    """Closes the session of the running event loop."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by every task of the process.
+
+    Each call to acquire reserves the next free slot and sleeps until it, so
+    waiting callers are served in order and bursts never exceed capacity.
+    Reservations are plain timestamps, which makes the bucket usable from any
+    event loop.
+
+    Args:
+        rate (float): Requests allowed per second on average.
+        capacity (int): Requests allowed back to back after an idle period.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._next_free = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        interval = 1.0 / self.rate
+        with self._lock:
+            # An idle bucket refills up to capacity tokens
+            slot = max(self._next_free, now - (self.capacity - 1) * interval)
+            self._next_free = slot + interval
+        return slot - now
+
+    async def acquire(self):
+        """Waits until a request may be sent."""
+        if self.rate <= 0:
+            return
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Holds back every caller for the given time, e.g. after a 429 response."""
+        with self._lock:
+            self._next_free = max(self._next_free, time.monotonic() + seconds)
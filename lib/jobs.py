@@ -0,0 +1,665 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import partial
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+from lib.locks import LockBackend, get_lock_backend, new_owner_id
+from lib.log import job_context
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+# Number of jobs processed at the same time by this process
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Delay before the first retry; doubled on every further attempt
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "30"))
+# How often idle workers look for due jobs (retries become due over time)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Seconds a claimed job stays reserved without a heartbeat from its worker;
+# workers renew their leases every third of it, so only dead workers lose jobs
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "60"))
+# Completed jobs answer duplicate submissions for this many seconds
+DEDUPE_WINDOW = float(os.getenv("DEDUPE_WINDOW", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by a job handler for a failure that retrying cannot fix, such as
+    an invalid input; the job fails without using its remaining attempts.
+    """
+
+
+class JobQueue:
+    """
+    A persistent FIFO job queue stored in SQLite.
+
+    Several worker processes can share one queue file. A claimed job is
+    leased to its worker, which renews the lease while the job runs; a job
+    whose lease ran out was interrupted, e.g. by a crash or a restart, and is
+    put back in the queue.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(
+                self.path, check_same_thread=False, timeout=30, isolation_level=None
+            )
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                "error TEXT, result TEXT, created_at REAL NOT NULL, "
+                "available_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(jobs)")]
+            if "dedupe_key" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+            if "batch_id" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN batch_id TEXT")
+            if "lease_owner" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN lease_owner TEXT")
+                db.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batches ("
+                "id TEXT PRIMARY KEY, created_at REAL NOT NULL, max_concurrency INTEGER)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batch_items ("
+                "batch_id TEXT NOT NULL, position INTEGER NOT NULL, "
+                "job_id TEXT NOT NULL, item TEXT NOT NULL, "
+                "PRIMARY KEY (batch_id, position))"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, available_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, created_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, status)"
+            )
+            self._db = db
+        return self._db
+
+    def recover(self) -> int:
+        """
+        Re-queues running jobs whose lease has expired, because the worker
+        holding it stopped without finishing them.
+
+        Returns:
+            int: Number of jobs re-queued.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_owner = NULL, "
+                "lease_expires_at = NULL WHERE status = ? "
+                "AND (lease_expires_at IS NULL OR lease_expires_at <= ?)",
+                (QUEUED, now, RUNNING, now),
+            )
+            return cursor.rowcount
+
+    def enqueue(self, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """
+        Adds a job to the queue.
+
+        Returns:
+            str: The new job's id.
+        """
+        job_id = uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO jobs (id, payload, status, max_attempts, created_at, "
+                "available_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), QUEUED, max_attempts, now, now),
+            )
+        return job_id
+
+    def enqueue_unique(
+        self,
+        payload: dict,
+        dedupe_key: str,
+        window: float = DEDUPE_WINDOW,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        batch_id: Optional[str] = None,
+    ) -> tuple[str, bool]:
+        """
+        Adds a job unless an equivalent one makes it redundant (single-flight).
+
+        A job with the same dedupe_key that is still queued or running, or
+        that succeeded less than window seconds ago, is returned instead.
+        Failed jobs never absorb new submissions. A new job created for a
+        batch counts towards that batch's concurrency limit.
+
+        Returns:
+            tuple[str, bool]: The job id, and whether a new job was created.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? AND (status IN (?, ?) "
+                    "OR (status = ? AND finished_at >= ?)) "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (dedupe_key, QUEUED, RUNNING, SUCCEEDED, now - window),
+                ).fetchone()
+                if row is not None:
+                    db.execute("COMMIT")
+                    return row["id"], False
+                job_id = uuid4().hex
+                db.execute(
+                    "INSERT INTO jobs (id, payload, status, max_attempts, created_at, "
+                    "available_at, dedupe_key, batch_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job_id,
+                        json.dumps(payload),
+                        QUEUED,
+                        max_attempts,
+                        now,
+                        now,
+                        dedupe_key,
+                        batch_id,
+                    ),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return job_id, True
+
+    def create_batch(self, max_concurrency: Optional[int] = None) -> str:
+        """
+        Creates an empty batch.
+
+        Args:
+            max_concurrency (int): Most jobs of this batch allowed to run at
+                once, so a large batch cannot take every worker (default: no limit).
+
+        Returns:
+            str: The new batch's id.
+        """
+        batch_id = uuid4().hex
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO batches (id, created_at, max_concurrency) VALUES (?, ?, ?)",
+                (batch_id, time.time(), max_concurrency),
+            )
+        return batch_id
+
+    def add_batch_item(self, batch_id: str, position: int, job_id: str, item: dict):
+        """Records that item number position of a batch is handled by job_id."""
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO batch_items (batch_id, position, job_id, item) "
+                "VALUES (?, ?, ?, ?)",
+                (batch_id, position, job_id, json.dumps(item)),
+            )
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        """
+        Returns aggregate progress and per-item results of a batch, or None.
+        """
+        with self._lock:
+            db = self._connect()
+            batch = db.execute(
+                "SELECT * FROM batches WHERE id = ?", (batch_id,)
+            ).fetchone()
+            if batch is None:
+                return None
+            rows = db.execute(
+                "SELECT i.position, i.item, j.id AS job_id, j.status, j.attempts, "
+                "j.error, j.result, j.started_at, j.finished_at "
+                "FROM batch_items i JOIN jobs j ON j.id = i.job_id "
+                "WHERE i.batch_id = ? ORDER BY i.position",
+                (batch_id,),
+            ).fetchall()
+
+        items = []
+        progress = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+        for row in rows:
+            progress[row["status"]] = progress.get(row["status"], 0) + 1
+            items.append(
+                {
+                    **json.loads(row["item"]),
+                    "job_id": row["job_id"],
+                    "status": row["status"],
+                    "attempts": row["attempts"],
+                    "error": row["error"],
+                    "result": json.loads(row["result"]) if row["result"] else None,
+                }
+            )
+        finished = progress[SUCCEEDED] + progress[FAILED]
+        return {
+            "batch_id": batch_id,
+            "created_at": batch["created_at"],
+            "max_concurrency": batch["max_concurrency"],
+            "total": len(items),
+            "finished": finished,
+            "done": finished == len(items),
+            "progress": progress,
+            "items": items,
+        }
+
+    def claim(self, owner: str, ttl: float = JOB_LEASE_TTL) -> Optional[dict]:
+        """
+        Takes the oldest due job, marks it running and leases it to owner for
+        ttl seconds. Jobs of a batch that already has max_concurrency jobs
+        running are left for later.
+
+        Returns:
+            Optional[dict]: The claimed job, or None if nothing is due.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT j.id FROM jobs j LEFT JOIN batches b ON b.id = j.batch_id "
+                    "WHERE j.status = ? AND j.available_at <= ? AND ("
+                    "b.max_concurrency IS NULL OR (SELECT COUNT(*) FROM jobs r "
+                    "WHERE r.batch_id = j.batch_id AND r.status = ?) < b.max_concurrency"
+                    ") ORDER BY j.available_at LIMIT 1",
+                    (QUEUED, now, RUNNING),
+                ).fetchone()
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, "
+                    "started_at = ?, error = NULL, lease_owner = ?, "
+                    "lease_expires_at = ? WHERE id = ?",
+                    (RUNNING, now, owner, now + ttl, row["id"]),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def renew(
+        self, owner: str, job_ids: list[str], ttl: float = JOB_LEASE_TTL
+    ) -> set[str]:
+        """
+        Extends owner's leases on running jobs by ttl seconds.
+
+        Returns:
+            set[str]: The ids among job_ids that owner no longer holds.
+        """
+        if not job_ids:
+            return set()
+        marks = ", ".join("?" * len(job_ids))
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                f"UPDATE jobs SET lease_expires_at = ? WHERE status = ? "
+                f"AND lease_owner = ? AND id IN ({marks})",
+                (time.time() + ttl, RUNNING, owner, *job_ids),
+            )
+            held = db.execute(
+                f"SELECT id FROM jobs WHERE status = ? AND lease_owner = ? "
+                f"AND id IN ({marks})",
+                (RUNNING, owner, *job_ids),
+            ).fetchall()
+        return set(job_ids) - {row["id"] for row in held}
+
+    def release(self, job_id: str, owner: str, delay: float = 0.0):
+        """
+        Puts a job owner could not finish back in the queue after delay
+        seconds, without counting the attempt.
+        """
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), "
+                "available_at = ?, lease_owner = NULL, lease_expires_at = NULL "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (QUEUED, time.time() + delay, job_id, RUNNING, owner),
+            )
+
+    def _holds_lease(self, db, job_id: str, owner: Optional[str]) -> bool:
+        if owner is None:
+            return True
+        row = db.execute(
+            "SELECT 1 FROM jobs WHERE id = ? AND status = ? AND lease_owner = ?",
+            (job_id, RUNNING, owner),
+        ).fetchone()
+        if row is None:
+            logger.warning("Job %s is no longer leased to this worker", job_id)
+        return row is not None
+
+    def complete(self, job_id: str, result=None, owner: Optional[str] = None):
+        """
+        Marks a job as succeeded and stores its result. With owner, nothing
+        happens unless owner still holds the job's lease.
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._holds_lease(db, job_id, owner):
+                    db.execute(
+                        "UPDATE jobs SET status = ?, result = ?, finished_at = ? "
+                        "WHERE id = ?",
+                        (SUCCEEDED, json.dumps(result), time.time(), job_id),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def fail(
+        self,
+        job_id: str,
+        error: str,
+        owner: Optional[str] = None,
+        retry: bool = True,
+    ) -> bool:
+        """
+        Records a failed attempt. The job is retried with exponential backoff
+        until it has used max_attempts, or unless retry is False, after which
+        it is marked failed. With owner, nothing happens unless owner still
+        holds the job's lease.
+
+        Returns:
+            bool: True if the job will be retried.
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                retrying = self._fail(db, job_id, error, owner, retry)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return retrying
+
+    def _fail(
+        self, db, job_id: str, error: str, owner: Optional[str], retry: bool
+    ) -> bool:
+        now = time.time()
+        if not self._holds_lease(db, job_id, owner):
+            return False
+        row = db.execute(
+            "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        if retry and row["attempts"] < row["max_attempts"]:
+            delay = JOB_RETRY_BACKOFF * 2 ** (row["attempts"] - 1)
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ? WHERE id = ?",
+                (QUEUED, error, now + delay, job_id),
+            )
+            return True
+        db.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (FAILED, error, now, job_id),
+        )
+        return False
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns a job with its payload and result decoded, or None."""
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+                .fetchone()
+            )
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def stats(self, window: int = 100) -> dict:
+        """
+        Reports queue depth and latency, for sizing the worker pool.
+
+        Args:
+            window (int): Number of recently started jobs the averages cover.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            counts = dict(
+                db.execute(
+                    "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+                ).fetchall()
+            )
+            oldest = db.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+            averages = db.execute(
+                "SELECT AVG(started_at - created_at), AVG(finished_at - started_at) "
+                "FROM (SELECT * FROM jobs WHERE started_at IS NOT NULL "
+                "ORDER BY started_at DESC LIMIT ?)",
+                (window,),
+            ).fetchone()
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "succeeded": counts.get(SUCCEEDED, 0),
+            "failed": counts.get(FAILED, 0),
+            "oldest_queued_seconds": now - oldest if oldest else 0.0,
+            "avg_wait_seconds": averages[0] or 0.0,
+            "avg_run_seconds": averages[1] or 0.0,
+        }
+
+
+class WorkerPool:
+    """
+    Runs queued jobs with a fixed number of asyncio workers.
+
+    Any number of pools, in one or several processes, can share a queue: each
+    pool leases the jobs it claims and renews the leases while they run. A
+    job whose lease is lost is cancelled, since another worker may take it.
+
+    Args:
+        queue (JobQueue): The queue to take jobs from.
+        handler (Callable): Coroutine function called with each job dict; its
+            return value is stored as the job result, an exception fails the
+            attempt, and a PermanentJobError fails the job.
+        concurrency (int): Number of jobs run at the same time.
+        poll_interval (float): Seconds an idle worker waits before checking again.
+        lock_key (Callable): Returns the key of the resource a job works on,
+            e.g. its Notion page, or None. Jobs with the same key never run at
+            the same time; a claimed job whose key is taken waits in the queue.
+        locks (LockBackend): Where those keys are locked (default: LOCK_BACKEND).
+        lease_ttl (float): Seconds a job and its key stay leased without renewal.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[dict], Awaitable],
+        concurrency: int = WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        lock_key: Optional[Callable[[dict], Optional[str]]] = None,
+        locks: Optional[LockBackend] = None,
+        lease_ttl: float = JOB_LEASE_TTL,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lock_key = lock_key
+        self.locks = locks
+        self.lease_ttl = lease_ttl
+        self.owner: Optional[str] = None
+        self.busy = 0
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # Running job id -> (handler task, locked key)
+        self._running: dict[str, tuple[asyncio.Task, Optional[str]]] = {}
+        self._lost: set[str] = set()
+
+    def start(self):
+        # Created here rather than at import, so forked processes differ
+        self.owner = new_owner_id()
+        if self.lock_key is not None and self.locks is None:
+            self.locks = get_lock_backend()
+        recovered = self.queue.recover()
+        if recovered:
+            logger.info("Re-queued %d interrupted jobs", recovered)
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.ensure_future(self._heartbeat()))
+        logger.info("Started %d newsletter workers as %s", self.concurrency, self.owner)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wakes idle workers after a job has been enqueued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _key_owner(self, job_id: str) -> str:
+        return f"{self.owner}:{job_id}"
+
+    def _run(self, function, *args, **kwargs) -> asyncio.Future:
+        """
+        Runs a queue or lock call in a thread: they block on SQLite while
+        other processes write, which must not stall the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(None, partial(function, *args, **kwargs))
+
+    async def _claim(self) -> Optional[dict]:
+        claim = self._run(self.queue.claim, self.owner, self.lease_ttl)
+        try:
+            return await asyncio.shield(claim)
+        except asyncio.CancelledError:
+            # Stopped mid-claim: hand back a job the thread may have leased
+            job = await claim
+            if job is not None:
+                await self._run(self.queue.release, job["id"], self.owner)
+            raise
+
+    async def _heartbeat(self):
+        """
+        Renews the leases of running jobs and re-queues jobs whose workers
+        died. Jobs whose job or key lease was lost are cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                lost = await self._run(
+                    self.queue.renew, self.owner, list(self._running), self.lease_ttl
+                )
+                for job_id, (_, key) in list(self._running.items()):
+                    if key and not await self._run(
+                        self.locks.renew, key, self._key_owner(job_id), self.lease_ttl
+                    ):
+                        lost.add(job_id)
+                for job_id in lost:
+                    task, _ = self._running.get(job_id, (None, None))
+                    if task is not None and not task.done():
+                        logger.warning("Lost the lease of job %s; stopping it", job_id)
+                        self._lost.add(job_id)
+                        task.cancel()
+                recovered = await self._run(self.queue.recover)
+                if recovered:
+                    logger.info("Re-queued %d jobs of stopped workers", recovered)
+            except Exception as e:
+                logger.error("Could not renew job leases: %s", e)
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            job = await self._claim()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id = job["id"]
+            key = self.lock_key(job) if self.lock_key else None
+            if key and not await self._run(
+                self.locks.acquire, key, self._key_owner(job_id), self.lease_ttl
+            ):
+                # Another worker is running a job for the same resource
+                await self._run(
+                    self.queue.release, job_id, self.owner, delay=self.poll_interval
+                )
+                continue
+
+            self.busy += 1
+            # Everything the job logs, in any task it starts, carries its id
+            with job_context(job_id):
+                task = asyncio.ensure_future(self.handler(job))
+                self._running[job_id] = (task, key)
+                try:
+                    result = await task
+                except asyncio.CancelledError:
+                    # Shutting down, or the lease was lost: hand the job over
+                    await self._run(self.queue.release, job_id, self.owner)
+                    if job_id not in self._lost:
+                        raise
+                except Exception as e:
+                    retrying = await self._run(
+                        self.queue.fail,
+                        job_id,
+                        str(e),
+                        self.owner,
+                        retry=not isinstance(e, PermanentJobError),
+                    )
+                    logger.warning(
+                        "Job attempt %d failed: %s%s",
+                        job["attempts"],
+                        e,
+                        " (will retry)" if retrying else "",
+                    )
+                else:
+                    await self._run(self.queue.complete, job_id, result, self.owner)
+                finally:
+                    self.busy -= 1
+                    self._running.pop(job_id, None)
+                    self._lost.discard(job_id)
+                    if key:
+                        await self._run(
+                            self.locks.release, key, self._key_owner(job_id)
+                        )
+
+    def stats(self) -> dict:
+        return {
+            **self.queue.stats(),
+            "workers": self.concurrency,
+            "busy_workers": self.busy,
+        }
@@ -0,0 +1,215 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+import socket
+import sqlite3
+import threading
+import time
+from typing import Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# sqlite (shared by the processes of one host), file (fcntl locks, also on a
+# shared volume) or memory (Redis-like stand-in, this process only)
+LOCK_BACKEND = os.getenv("LOCK_BACKEND", "sqlite").lower()
+LOCK_DB_PATH = os.getenv("LOCK_DB_PATH", "data/locks.sqlite3")
+LOCK_DIR = os.getenv("LOCK_DIR", "data/locks")
+
+_backend = None
+
+
+def new_owner_id() -> str:
+    """A lease owner id that is unique per host, process and call."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+class LockBackend(ABC):
+    """
+    Lease-based locks: a key is held by one owner until it is released or its
+    ttl runs out, so a crashed holder never blocks the key for good.
+
+    The three operations map onto Redis as SET key owner NX PX ttl, and
+    compare-and-expire / compare-and-delete scripts on the owner.
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """Takes key for ttl seconds unless another owner holds a live lease."""
+
+    @abstractmethod
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        """Extends owner's lease on key; False if the lease was lost."""
+
+    @abstractmethod
+    def release(self, key: str, owner: str):
+        """Frees key if owner still holds it."""
+
+
+class MemoryLockBackend(LockBackend):
+    """
+    In-process stand-in for a Redis lock server, for single-process
+    deployments and tests. It does not coordinate separate processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: dict[str, tuple[str, float]] = {}
+
+    def _holder(self, key: str) -> Optional[str]:
+        lease = self._leases.get(key)
+        if lease is None or lease[1] <= time.time():
+            self._leases.pop(key, None)
+            return None
+        return lease[0]
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            if self._holder(key) not in (None, owner):
+                return False
+            self._leases[key] = (owner, time.time() + ttl)
+            return True
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            if self._holder(key) != owner:
+                return False
+            self._leases[key] = (owner, time.time() + ttl)
+            return True
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            if self._holder(key) == owner:
+                del self._leases[key]
+
+
+class SQLiteLockBackend(LockBackend):
+    """Leases stored in a SQLite file shared by every process on the host."""
+
+    def __init__(self, path: str = LOCK_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(
+                self.path, check_same_thread=False, timeout=30, isolation_level=None
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS locks ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT INTO locks (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, "
+                "expires_at = excluded.expires_at "
+                "WHERE locks.expires_at <= ? OR locks.owner = excluded.owner",
+                (key, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE locks SET expires_at = ? "
+                "WHERE key = ? AND owner = ? AND expires_at > ?",
+                (now + ttl, key, owner, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner)
+            )
+
+
+class FileLockBackend(LockBackend):
+    """
+    One lease file per key in a directory, updated under an exclusive fcntl
+    lock. Works wherever the processes share the directory and its locks.
+    """
+
+    def __init__(self, directory: str = LOCK_DIR):
+        self.directory = directory
+
+    def _update(self, key: str, change) -> bool:
+        import fcntl
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        with open(os.path.join(self.directory, f"{name}.lock"), "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            holder, _, expires = file.read().partition(" ")
+            try:
+                lease = (holder, float(expires)) if holder else None
+            except ValueError:
+                lease = None
+            if lease is not None and lease[1] <= time.time():
+                lease = None
+            updated, lease = change(lease)
+            file.seek(0)
+            file.truncate()
+            if lease is not None:
+                file.write(f"{lease[0]} {lease[1]}")
+            return updated
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        def change(lease):
+            if lease is not None and lease[0] != owner:
+                return False, lease
+            return True, (owner, time.time() + ttl)
+
+        return self._update(key, change)
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        def change(lease):
+            if lease is None or lease[0] != owner:
+                return False, lease
+            return True, (owner, time.time() + ttl)
+
+        return self._update(key, change)
+
+    def release(self, key: str, owner: str):
+        def change(lease):
+            if lease is not None and lease[0] == owner:
+                return True, None
+            return False, lease
+
+        self._update(key, change)
+
+
+def get_lock_backend() -> LockBackend:
+    """Returns the process-wide lock backend selected by LOCK_BACKEND."""
+    global _backend
+    if _backend is None:
+        if LOCK_BACKEND == "memory":
+            _backend = MemoryLockBackend()
+        elif LOCK_BACKEND == "file":
+            _backend = FileLockBackend()
+        else:
+            if LOCK_BACKEND != "sqlite":
+                logger.warning("Unknown LOCK_BACKEND %r, using sqlite", LOCK_BACKEND)
+            _backend = SQLiteLockBackend()
+    return _backend
+
+
+def set_lock_backend(backend: LockBackend):
+    """Replaces the lock backend, e.g. with a client of a shared lock server."""
+    global _backend
+    _backend = backend
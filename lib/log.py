@@ -0,0 +1,172 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for people, "json" for log collectors
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Longer messages, such as request bodies or agent output, are cut here
+LOG_MAX_MESSAGE = int(os.getenv("LOG_MAX_MESSAGE", "1000"))
+# Only every Nth debug record from the same line is kept, e.g. per-file logs
+LOG_DEBUG_SAMPLE = int(os.getenv("LOG_DEBUG_SAMPLE", "1"))
+# Records waiting for the writer thread; further records are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Job the running task works for, attached to every record it logs
+_job_id: contextvars.ContextVar = contextvars.ContextVar("job_id", default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+    "job_id",
+}
+
+
+def truncate(text, limit: Optional[int] = None) -> str:
+    """Cuts text to limit characters, noting how much was left out."""
+    text = str(text)
+    limit = LOG_MAX_MESSAGE if limit is None else limit
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text) - limit} more chars)"
+
+
+@contextmanager
+def job_context(job_id: Optional[str]):
+    """Tags the records logged by the enclosed code, and its tasks, with job_id."""
+    token = _job_id.set(job_id)
+    try:
+        yield
+    finally:
+        _job_id.reset(token)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Runs in the thread that logs, before the record is queued: adds the job
+    id, samples debug records and truncates long messages.
+    """
+
+    def __init__(self, debug_sample: int = 1):
+        super().__init__()
+        self.debug_sample = max(1, debug_sample)
+        self._seen: dict = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample > 1:
+            site = (record.pathname, record.lineno)
+            count = self._seen.get(site, 0)
+            self._seen[site] = count + 1
+            if count % self.debug_sample:
+                return False
+        record.job_id = _job_id.get()
+        record.msg = truncate(record.getMessage())
+        record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed through extra=."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+        entry = {
+            "time": f"{timestamp}.{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "job_id", None):
+            entry["job_id"] = record.job_id
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable lines, with the job id and extra= fields after the message."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {
+            name: value
+            for name, value in vars(record).items()
+            if name not in _RECORD_ATTRIBUTES
+        }
+        if getattr(record, "job_id", None):
+            fields = {"job": record.job_id, **fields}
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of blocking when the writer falls behind."""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def configure_logging(
+    level: Optional[str] = None, log_format: Optional[str] = None, stream=None
+):
+    """
+    Sends the service's log records to a background thread that writes them.
+
+    Logging calls only format the message and put it on a bounded queue, so
+    they never block the event loop on stdout. Safe to call repeatedly; later
+    calls replace the handler.
+    """
+    global _listener
+    stop_logging()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    formatter = JsonFormatter() if (log_format or LOG_FORMAT) == "json" else None
+    handler.setFormatter(formatter or TextFormatter())
+
+    queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(_ContextFilter(LOG_DEBUG_SAMPLE))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, _DroppingQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level or LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    _listener.start()
+
+
+def stop_logging():
+    """Writes out the queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
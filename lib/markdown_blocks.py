@@ -0,0 +1,241 @@
+import re
+from typing import AsyncIterable, AsyncIterator, Optional
+
+from lib.notion import NotionBlock, NotionBlocks
+
+# Marker the editor leaves where the architecture diagram goes
+DIAGRAM_PLACEHOLDER = "<DIAGRAM_IMAGE_URL>"
+# Notion rejects rich text objects longer than this
+MAX_TEXT_LENGTH = 2000
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_NUMBERED = re.compile(r"^\s{0,3}\d+[.)]\s+(.*)$")
+_BULLETED = re.compile(r"^\s{0,3}[-*+]\s+(.*)$")
+_FENCE = re.compile(r"^\s{0,3}(```|~~~)\s*([\w+-]*)")
+_RULE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+_IMAGE = re.compile(r"!\[([^\]]*)\]\(\s*<?([^)>\s]+)>?\s*\)")
+# Splits a paragraph around images and diagram placeholders
+_IMAGE_OR_DIAGRAM = re.compile(
+    rf"({re.escape(DIAGRAM_PLACEHOLDER)}|!\[[^\]]*\]\([^)]*\))"
+)
+_LINK = re.compile(r"\[([^\]]+)\]\(\s*<?([^)>\s]+)>?\s*\)")
+_BARE_URL = re.compile(r"^<?(https?://\S+?)>?$")
+# Emphasis only opens and closes at word boundaries, so the underscores in
+# run_agent_with_gemini and the asterisks in 2*3*4 are kept
+_EMPHASIS = re.compile(r"(?<!\w)(\*\*|__|\*|_|~~)(?=\S)(.+?)(?<=\S)\1(?!\w)")
+_INLINE_CODE = re.compile(r"(`+)(.+?)\1")
+_URL = re.compile(r"https?://[^\s<>()*`]+")
+# Stands in for a code span or URL while emphasis is removed
+_PROTECTED = re.compile("\x00(\\d+)\x00")
+
+
+def _inline_text(text: str) -> str:
+    """Removes inline Markdown formatting, keeping link targets readable."""
+
+    protected: list[str] = []
+
+    def protect(value: str) -> str:
+        protected.append(value)
+        return f"\x00{len(protected) - 1}\x00"
+
+    def link_text(match) -> str:
+        label, url = match.group(1), protect(match.group(2))
+        return url if label == match.group(2) else f"{label} ({url})"
+
+    def emphasis(match) -> str:
+        if match.group(1) == "__" and match.group(2).isidentifier():
+            # A dunder name such as __init__, not bold text
+            return match.group(0)
+        return match.group(2)
+
+    text = _INLINE_CODE.sub(lambda m: protect(m.group(2).strip()), text)
+    text = _LINK.sub(link_text, text)
+    text = _URL.sub(lambda m: protect(m.group(0)), text)
+    previous = None
+    while previous != text:
+        previous, text = text, _EMPHASIS.sub(emphasis, text)
+    return _PROTECTED.sub(lambda m: protected[int(m.group(1))], text).strip()
+
+
+def _split_text(text: str) -> list[str]:
+    if len(text) <= MAX_TEXT_LENGTH:
+        return [text]
+    parts = []
+    while len(text) > MAX_TEXT_LENGTH:
+        cut = text.rfind("\n", 0, MAX_TEXT_LENGTH)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, MAX_TEXT_LENGTH)
+        if cut <= 0:
+            cut = MAX_TEXT_LENGTH
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    return parts + ([text] if text else [])
+
+
+def _text_blocks(
+    block_type: str, text: str, is_code: bool = False
+) -> list[NotionBlock]:
+    return [
+        NotionBlock(type=block_type, text=part, is_code=is_code)
+        for part in _split_text(text)
+    ]
+
+
+class MarkdownBlockCompiler:
+    """
+    Compiles Markdown into NotionBlocks, incrementally.
+
+    Text can be fed in arbitrary pieces, e.g. as an agent streams it; each
+    block is returned as soon as the line that ends it has arrived.
+    Supported: ATX headings, paragraphs, numbered and bulleted lists,
+    fenced code, links, images and the diagram placeholder, which becomes
+    an image block. Inline formatting is removed, as NotionBlock holds
+    plain text.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._paragraph: list[str] = []
+        self._item: Optional[tuple[str, list[str]]] = None
+        self._code: Optional[list[str]] = None
+        self._fence = ""
+
+    def feed(self, text: str) -> list[NotionBlock]:
+        """Adds Markdown text and returns the blocks it completed."""
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        blocks: list[NotionBlock] = []
+        for line in lines:
+            blocks += self._line(line.rstrip("\r"))
+        return blocks
+
+    def close(self) -> list[NotionBlock]:
+        """Flushes the last line and any open block."""
+        blocks = self._line(self._pending) if self._pending else []
+        self._pending = ""
+        if self._code is not None:
+            blocks += self._close_code()
+        return blocks + self._flush()
+
+    def _flush(self) -> list[NotionBlock]:
+        blocks = []
+        if self._paragraph:
+            blocks += self._inline_blocks(" ".join(self._paragraph))
+            self._paragraph = []
+        if self._item is not None:
+            block_type, parts = self._item
+            blocks += _text_blocks(block_type, _inline_text(" ".join(parts)))
+            self._item = None
+        return blocks
+
+    def _close_code(self) -> list[NotionBlock]:
+        code = "\n".join(self._code).strip("\n")
+        self._code = None
+        return _text_blocks("paragraph", code, is_code=True) if code else []
+
+    def _inline_blocks(self, text: str) -> list[NotionBlock]:
+        """Turns a paragraph into blocks, splitting out images and lone links."""
+        blocks = []
+        for piece in _IMAGE_OR_DIAGRAM.split(text):
+            if not piece.strip():
+                continue
+            image = _IMAGE.fullmatch(piece.strip())
+            if piece == DIAGRAM_PLACEHOLDER or (
+                image and DIAGRAM_PLACEHOLDER.strip("<>") in image.group(2)
+            ):
+                blocks.append(NotionBlock(type="image", url=DIAGRAM_PLACEHOLDER))
+            elif image:
+                blocks.append(
+                    NotionBlock(
+                        type="link_preview", text=image.group(1), url=image.group(2)
+                    )
+                )
+            else:
+                blocks += self._text_or_link(piece.strip())
+        return blocks
+
+    def _text_or_link(self, text: str) -> list[NotionBlock]:
+        link = _LINK.fullmatch(text)
+        bare = _BARE_URL.fullmatch(text)
+        if link:
+            return [
+                NotionBlock(type="link_preview", text=link.group(1), url=link.group(2))
+            ]
+        if bare:
+            return [NotionBlock(type="link_preview", url=bare.group(1))]
+        plain = _inline_text(text)
+        return _text_blocks("paragraph", plain) if plain else []
+
+    def _line(self, line: str) -> list[NotionBlock]:
+        if self._code is not None:
+            if line.strip().startswith(self._fence):
+                return self._close_code()
+            self._code.append(line)
+            return []
+
+        fence = _FENCE.match(line)
+        if fence:
+            blocks = self._flush()
+            if fence.group(2).lower() in ("markdown", "md"):
+                # Agents sometimes wrap their whole answer in a Markdown fence;
+                # its closing fence opens an empty code block that is dropped
+                return blocks
+            self._code, self._fence = [], fence.group(1)
+            return blocks
+        if not line.strip():
+            return self._flush()
+        if _RULE.match(line):
+            return self._flush()
+
+        heading = _HEADING.match(line)
+        if heading:
+            # Notion has three heading levels
+            block_type = f"heading_{min(len(heading.group(1)), 3)}"
+            text = _inline_text(heading.group(2))
+            return self._flush() + (_text_blocks(block_type, text) if text else [])
+
+        for pattern, block_type in (
+            (_NUMBERED, "numbered_list_item"),
+            (_BULLETED, "bulleted_list_item"),
+        ):
+            item = pattern.match(line)
+            if item:
+                blocks = self._flush()
+                content = item.group(1).strip()
+                if DIAGRAM_PLACEHOLDER in content or _IMAGE.search(content):
+                    return blocks + self._inline_blocks(content)
+                self._item = (block_type, [content])
+                return blocks
+
+        text = line.strip().lstrip(">").strip()
+        if _LINK.fullmatch(text) or _BARE_URL.fullmatch(text):
+            # A link on a line of its own becomes a link preview
+            return self._flush() + self._text_or_link(text)
+        if self._item is not None and line[:1].isspace():
+            # Indented continuation of a list item
+            self._item[1].append(text)
+            return []
+        if self._item is not None:
+            blocks = self._flush()
+            self._paragraph.append(text)
+            return blocks
+        self._paragraph.append(text)
+        return []
+
+
+def compile_markdown(markdown: str) -> NotionBlocks:
+    """Compiles a complete Markdown document into NotionBlocks."""
+    compiler = MarkdownBlockCompiler()
+    return NotionBlocks(blocks=compiler.feed(markdown) + compiler.close())
+
+
+async def compile_markdown_stream(
+    chunks: AsyncIterable[str],
+) -> AsyncIterator[NotionBlock]:
+    """Yields NotionBlocks from streamed Markdown as each block completes."""
+    compiler = MarkdownBlockCompiler()
+    async for chunk in chunks:
+        for block in compiler.feed(chunk):
+            yield block
+    for block in compiler.close():
+        yield block
@@ -0,0 +1,260 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Record a trace of spans for every job and keep it with the job's result
+JOB_TRACING = os.getenv("JOB_TRACING", "false").lower() == "true"
+
+# Seconds; covers fast cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+
+_lock = threading.Lock()
+_metrics: list = []
+_collectors: list[Callable[[], Iterable]] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict = {}
+        with _lock:
+            _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"{self.name} expects labels {self.labels}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with _lock:
+            return [
+                (self.name, dict(zip(self.labels, key)), value)
+                for key, value in self._values.items()
+            ]
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. requests or errors."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. busy workers."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. durations in seconds."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the block, whether it succeeds or not."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        samples = []
+        for name, labels, (counts, total) in super().samples():
+            for bound, count in zip(self.buckets, counts):
+                bucket_labels = {**labels, "le": _format_value(bound)}
+                samples.append((f"{name}_bucket", bucket_labels, count))
+            samples.append((f"{name}_sum", labels, total))
+            samples.append((f"{name}_count", labels, counts[-1]))
+        return samples
+
+
+def register_collector(collect: Callable[[], Iterable]):
+    """
+    Registers a callback that reports values computed at scrape time, such as
+    queue depth. It returns (name, type, help, [(labels, value), ...]) tuples.
+    """
+    _collectors.append(collect)
+
+
+def render_metrics() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        metrics = list(_metrics)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for collect in _collectors:
+        try:
+            families = list(collect())
+        except Exception as e:
+            logger.warning("Metrics collector failed: %s", e)
+            continue
+        for name, metric_type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+JOB_SECONDS = Histogram(
+    "newsletter_job_seconds", "Duration of newsletter jobs.", ["outcome"]
+)
+STAGE_SECONDS = Histogram(
+    "newsletter_stage_seconds", "Duration of pipeline stages.", ["stage", "outcome"]
+)
+ERRORS = Counter(
+    "newsletter_errors_total", "Errors by component.", ["component"]
+)
+DOWNLOAD_SECONDS = Histogram(
+    "github_download_seconds", "Time to provide a repository snapshot.", ["source"]
+)
+GEMINI_SECONDS = Histogram(
+    "gemini_request_seconds",
+    "Duration of Gemini calls, cache hits excluded.",
+    ["agent"],
+)
+GEMINI_TOKENS = Counter(
+    "gemini_tokens_total", "Tokens used per agent.", ["agent", "kind"]
+)
+LLM_CACHE_REQUESTS = Counter(
+    "llm_cache_requests_total",
+    "Agent calls answered from the output cache or not.",
+    ["agent", "result"],
+)
+DIAGRAM_SECONDS = Histogram(
+    "diagram_seconds", "Time to provide a diagram URL.", ["source"]
+)
+S3_UPLOAD_SECONDS = Histogram(
+    "s3_upload_seconds", "Duration of S3 uploads.", ["outcome"]
+)
+NOTION_REQUEST_SECONDS = Histogram(
+    "notion_request_seconds", "Duration of Notion API requests.", ["method", "status"]
+)
+NOTION_RETRIES = Counter(
+    "notion_retries_total", "Notion requests retried, by response status.", ["status"]
+)
+
+
+# Spans of the job running in the current task, if tracing is on
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Spans recorded while one job runs, with times relative to its start."""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.spans: list[dict] = []
+
+    def add(self, name: str, start: float, end: float, error=None, **attributes):
+        span = {
+            "name": name,
+            "start": round(start - self.started, 4),
+            "duration": round(end - start, 4),
+            **attributes,
+        }
+        if error is not None:
+            span["error"] = f"{type(error).__name__}: {error}"
+        self.spans.append(span)
+
+
+@contextmanager
+def start_trace(trace_id: Optional[str] = None, enabled: Optional[bool] = None):
+    """
+    Collects the spans of the enclosed code, and of the tasks it starts, in a
+    Trace. Yields None when tracing is off, so spans cost nothing.
+    """
+    enabled = JOB_TRACING if enabled is None else enabled
+    trace = Trace(trace_id) if enabled else None
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Records the enclosed block as a span of the current trace, if any."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        trace.add(name, start, time.perf_counter(), error=e, **attributes)
+        raise
+    trace.add(name, start, time.perf_counter(), **attributes)
@@ -1,24 +1,48 @@
-import requests
-from typing import Optional, Union
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Optional, Union
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
 from typing import Literal
 import json
+import logging
+import time
+
+from lib.http import TokenBucket, get_session
+from lib.metrics import ERRORS, NOTION_REQUEST_SECONDS, NOTION_RETRIES, span
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
+NOTION_API_URL = "https://api.notion.com/v1"
+NOTION_VERSION = "2022-06-28"
+# Notion accepts at most 100 children per create or append request
+NOTION_MAX_BLOCKS_PER_REQUEST = 100
+# Notion allows an average of 3 requests per second per integration
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))
+NOTION_RATE_BURST = int(os.getenv("NOTION_RATE_BURST", "3"))
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+NOTION_TIMEOUT = float(os.getenv("NOTION_TIMEOUT", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Blocks collected before each request when publishing a stream of blocks
+NOTION_STREAM_BATCH_BLOCKS = int(os.getenv("NOTION_STREAM_BATCH_BLOCKS", "20"))
+
+# Shared by every job of the process, so concurrent publishing stays within the limit
+notion_rate_limiter = TokenBucket(NOTION_RATE_LIMIT, NOTION_RATE_BURST)
 
 
 class NotionBlock(BaseModel):
     type: Literal[
         "paragraph",
-        "heading1",
+        "heading_1",
         "heading_2",
+        "heading_3",
         "link_preview",
         "image",
         "numbered_list_item",
+        "bulleted_list_item",
     ]
     text: Optional[str] = None
     url: Optional[str] = None
@@ -29,6 +53,102 @@ class NotionBlocks(BaseModel):
     blocks: list[NotionBlock]
 
 
+class NotionBlockStreamParser:
+    """
+    Extracts NotionBlocks from JSON writer output while it is still streaming.
+
+    The output is expected to contain one array of block objects, either
+    bare or under "blocks"; anything before the array, such as a code fence,
+    is ignored. Each block is returned by feed as soon as its closing brace
+    arrives. Blocks that are not valid JSON or do not match NotionBlock are
+    skipped with a warning.
+    """
+
+    def __init__(self):
+        self.parsed = 0
+        self.skipped = 0
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._ended = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start = 0
+
+    def feed(self, text: str) -> list[NotionBlock]:
+        """Adds streamed text and returns the blocks it completed."""
+        if self._ended:
+            return []
+        self._buffer += text
+        blocks = []
+        buffer = self._buffer
+        while self._pos < len(buffer):
+            char = buffer[self._pos]
+            if not self._in_array:
+                self._in_array = char == "["
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._start = self._pos
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    block = self._parse(buffer[self._start : self._pos + 1])
+                    if block is not None:
+                        blocks.append(block)
+            elif char == "]" and self._depth == 0:
+                self._ended = True
+                break
+            self._pos += 1
+        if self._depth == 0:
+            # Everything up to here is consumed; keep only the unread tail
+            self._buffer = buffer[self._pos :]
+            self._pos = 0
+        return blocks
+
+    def _parse(self, text: str) -> Optional[NotionBlock]:
+        try:
+            block = NotionBlock(**json.loads(text))
+        except (ValueError, TypeError) as e:
+            self.skipped += 1
+            logger.warning("Skipping invalid Notion block %r: %s", text[:200], e)
+            return None
+        self.parsed += 1
+        return block
+
+    def close(self):
+        """
+        Checks the stream once it has ended.
+
+        Raises:
+            ValueError: If no valid block was found.
+        """
+        if not self.parsed:
+            raise ValueError(
+                f"No valid Notion blocks in the JSON writer output "
+                f"({self.skipped} invalid)"
+            )
+
+
+async def parse_block_stream(chunks: AsyncIterable[str]) -> AsyncIterator[NotionBlock]:
+    """Yields NotionBlocks from streamed JSON writer output as they complete."""
+    parser = NotionBlockStreamParser()
+    async for chunk in chunks:
+        for block in parser.feed(chunk):
+            yield block
+    parser.close()
+
+
 def convert_json_to_notion_blocks(
     content_blocks: NotionBlocks, diagram_url: str
 ) -> list[dict]:
@@ -101,6 +221,18 @@ def convert_json_to_notion_blocks(
                     },
                 }
             )
+        elif item.type == "bulleted_list_item":
+            notion_blocks.append(
+                {
+                    "object": "block",
+                    "type": "bulleted_list_item",
+                    "bulleted_list_item": {
+                        "rich_text": [
+                            {"type": "text", "text": {"content": item.text or ""}}
+                        ]
+                    },
+                }
+            )
         elif item.type == "image":
             notion_blocks.append(
                 {
@@ -124,51 +256,255 @@ def convert_json_to_notion_blocks(
     return notion_blocks
 
 
-def add_newsletter_to_notion(parent_id: str, content_blocks: list):
+class NotionError(Exception):
+    """Raised when the Notion API rejects a request."""
+
+    def __init__(self, status: int, body):
+        super().__init__(f"Notion API returned {status}: {body}")
+        self.status = status
+        self.body = body
+
+    @property
+    def retryable(self) -> bool:
+        """Whether the request may succeed later: conflicts, rate limits, outages."""
+        return self.status in (409, 429) or self.status >= 500
+
+
+def _retry_delay(response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return min(2**attempt, 30)
+
+
+async def notion_request(
+    method: str,
+    path: str,
+    payload: Optional[dict] = None,
+    idempotent: bool = True,
+):
     """
-    Add newsletter content to a Notion page.
+    Sends a request to the Notion API on the pooled session.
 
-    Args:
-        parent_id (str): The Notion page ID (should be a valid UUID)
-        content_blocks (list): List of Notion block dictionaries
+    Every request first takes a token from the process-wide rate limiter.
+    Rate-limited (429) and unavailable (5xx) responses are retried after
+    their Retry-After delay, and a 429 holds back all other jobs too. A
+    request that is not idempotent, such as creating a page, is only retried
+    after a 429: after a 5xx Notion may have carried it out anyway.
+
+    Returns:
+        dict: The decoded JSON response.
+
+    Raises:
+        NotionError: If Notion rejects the request or retries run out.
     """
+    import aiohttp
+
+    url = f"{NOTION_API_URL}/{path.lstrip('/')}"
+    headers = {
+        "Authorization": f"Bearer {NOTION_API_KEY}",
+        "Content-Type": "application/json",
+        "Notion-Version": NOTION_VERSION,
+    }
+    session = get_session()
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        await notion_rate_limiter.acquire()
+        start = time.perf_counter()
+        status = "error"
+        try:
+            with span("notion", method=method, attempt=attempt):
+                async with session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=NOTION_TIMEOUT),
+                ) as response:
+                    status = response.status
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        body = await response.text()
+        finally:
+            NOTION_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=method, status=status
+            )
+        if status == 200:
+            return body
+        retryable = status in RETRY_STATUSES and (idempotent or status == 429)
+        if not retryable or attempt == NOTION_MAX_RETRIES:
+            raise NotionError(status, body)
+        delay = _retry_delay(response, attempt)
+        if status == 429:
+            notion_rate_limiter.pause(delay)
+        NOTION_RETRIES.inc(status=status)
+        logger.warning("Notion returned %s, retrying in %.1fs", status, delay)
+        await asyncio.sleep(delay)
+
+
+def chunk_blocks(blocks: list, size: Optional[int] = None) -> list[list]:
+    """Splits blocks into lists small enough for one Notion request."""
+    size = size or NOTION_MAX_BLOCKS_PER_REQUEST
+    return [blocks[i : i + size] for i in range(0, len(blocks), size)] or [[]]
+
+
+def is_valid_page_id(parent_id: str) -> bool:
     # Validate that parent_id looks like a UUID
     if parent_id == "notion-page-id" or len(parent_id) < 32:
-        print(
-            f"Warning: Using test page ID '{parent_id}'. This won't work with real Notion API.",
-            flush=True,
-        )
-        print(
+        logger.warning(
+            "Using test page ID '%s'. This won't work with real Notion API. "
             "Please provide a valid Notion page UUID to actually create the page.",
-            flush=True,
+            parent_id,
         )
         return False
+    return True
 
-    url = "https://api.notion.com/v1/pages"
-    headers = {
-        "Authorization": f"Bearer {NOTION_API_KEY}",
-        "Content-Type": "application/json",
-        "Notion-Version": "2022-06-28",
-    }
 
-    data = {
-        "parent": {"page_id": parent_id},
-        "properties": {
-            "title": {"title": [{"text": {"content": f"Newsletter Draft"}}]}
-        },
-        "children": content_blocks,
-    }
+async def archive_page(page_id: str):
+    """Moves a page to the trash; failures are logged, not raised."""
+    import aiohttp
+
+    try:
+        await notion_request("PATCH", f"pages/{page_id}", {"archived": True})
+        logger.info("Archived the partly published page %s", page_id)
+    except (NotionError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(
+            "Could not archive the partly published page %s: %s", page_id, e
+        )
 
-    print(
-        f"Attempting to create Notion page with {len(content_blocks)} blocks",
-        flush=True,
+
+async def publish_blocks_stream(
+    parent_id: str, content_blocks: AsyncIterable[dict], batch_size: Optional[int] = None
+):
+    """
+    Publish Notion blocks to a new page while they are still being produced.
+
+    The page is created as soon as batch_size blocks (or all of them) are
+    available, and later blocks are appended in order in requests of at most
+    NOTION_MAX_BLOCKS_PER_REQUEST blocks. Blocks that arrive while a request
+    is in flight go out together in the next one. If the producer or a
+    request fails, the page is archived and the exception is raised, so a
+    retried job does not leave partial or duplicate pages behind.
+
+    Args:
+        parent_id (str): The Notion page ID (should be a valid UUID)
+        content_blocks (AsyncIterable[dict]): Notion block dictionaries
+        batch_size (int): Blocks to wait for before each request, unless the
+            stream has ended (default: NOTION_STREAM_BATCH_BLOCKS).
+
+    Returns:
+        bool: True once every block was added, or False if parent_id is not
+            a valid page ID.
+
+    Raises:
+        NotionError: If Notion rejects a request or retries run out.
+    """
+    import aiohttp
+
+    if not is_valid_page_id(parent_id):
+        return False
+    batch_size = min(
+        batch_size or NOTION_STREAM_BATCH_BLOCKS, NOTION_MAX_BLOCKS_PER_REQUEST
     )
-    response = requests.post(url, headers=headers, json=data)
-
-    if response.status_code == 200:
-        print("Newsletter added to Notion successfully.", flush=True)
-        return True
-    else:
-        print("Failed to add newsletter to Notion.", flush=True)
-        print("Response:", response.json(), flush=True)
+
+    pending: list = []
+    finished = False
+    arrived = asyncio.Event()
+
+    async def read():
+        nonlocal finished
+        try:
+            async for block in content_blocks:
+                pending.append(block)
+                if len(pending) >= batch_size:
+                    arrived.set()
+        finally:
+            finished = True
+            arrived.set()
+
+    reader = asyncio.ensure_future(read())
+    page_id = None
+    sent = requests = 0
+    try:
+        while True:
+            await arrived.wait()
+            arrived.clear()
+            if reader.done() and reader.exception() is not None:
+                raise reader.exception()
+            if not pending and not (finished and page_id is None):
+                if finished:
+                    break
+                continue
+            chunk = pending[:NOTION_MAX_BLOCKS_PER_REQUEST]
+            del pending[: len(chunk)]
+            if page_id is None:
+                page = await notion_request(
+                    "POST",
+                    "pages",
+                    {
+                        "parent": {"page_id": parent_id},
+                        "properties": {
+                            "title": {
+                                "title": [{"text": {"content": f"Newsletter Draft"}}]
+                            }
+                        },
+                        "children": chunk,
+                    },
+                    idempotent=False,
+                )
+                page_id = page["id"]
+            else:
+                await notion_request(
+                    "PATCH", f"blocks/{page_id}/children", {"children": chunk}
+                )
+            sent += len(chunk)
+            requests += 1
+            if finished or len(pending) >= batch_size:
+                arrived.set()
+    except BaseException as e:
+        if isinstance(e, (NotionError, aiohttp.ClientError, asyncio.TimeoutError)):
+            ERRORS.inc(component="notion")
+            logger.error("Failed to add newsletter to Notion. Response: %s", e)
+        if page_id is not None:
+            await archive_page(page_id)
+        raise
+    finally:
+        if not reader.done():
+            reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+
+    logger.info(
+        "Newsletter added to Notion successfully (%d blocks in %d requests).",
+        sent,
+        requests,
+    )
+    return True
+
+
+async def _iterate(items: list):
+    for item in items:
+        yield item
+
+
+async def add_newsletter_to_notion(parent_id: str, content_blocks: list):
+    """
+    Add newsletter content to a Notion page.
+
+    The page is created with the first NOTION_MAX_BLOCKS_PER_REQUEST blocks
+    and the rest are appended in order, as Notion rejects more than 100
+    children per request.
+
+    Args:
+        parent_id (str): The Notion page ID (should be a valid UUID)
+        content_blocks (list): List of Notion block dictionaries
+    """
+    import aiohttp
+
+    logger.info("Attempting to create Notion page with %d blocks", len(content_blocks))
+    try:
+        return await publish_blocks_stream(
+            parent_id, _iterate(content_blocks), NOTION_MAX_BLOCKS_PER_REQUEST
+        )
+    except (NotionError, aiohttp.ClientError, asyncio.TimeoutError):
         return False
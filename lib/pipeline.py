@@ -0,0 +1,227 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable, Optional
+
+from lib.metrics import STAGE_SECONDS, span
+
+
+class Stage:
+    """
+    A named step of a pipeline.
+
+    Args:
+        name (str): Unique stage name; its result is stored under this key.
+        func (Callable): Coroutine function called with the results of its
+            dependencies as keyword arguments, keyed by dependency name.
+        depends_on (Iterable[str]): Names of the stages that must finish first.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Awaitable],
+        depends_on: Iterable[str] = (),
+    ):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+class StageTiming:
+    """Start and end of a stage, in seconds relative to the pipeline start."""
+
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class PipelineResult:
+    """Outputs and timings of a pipeline run."""
+
+    def __init__(self, results: dict, timings: dict, stages: dict):
+        self.results = results
+        self.timings = timings
+        self._stages = stages
+
+    @property
+    def total(self) -> float:
+        return max((t.end for t in self.timings.values()), default=0.0)
+
+    def critical_path(self) -> list[str]:
+        """
+        Returns the chain of stages that determined the total run time,
+        found by walking back from the last stage to finish through the
+        latest-finishing dependency of each stage.
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n].end)
+        path = [name]
+        while True:
+            deps = [d for d in self._stages[name].depends_on if d in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: self.timings[n].end)
+            path.append(name)
+        return list(reversed(path))
+
+    def summary(self) -> dict:
+        """Per-stage durations and the critical path, as plain JSON-able data."""
+        return {
+            "stages": {
+                name: round(timing.duration, 3)
+                for name, timing in self.timings.items()
+            },
+            "critical_path": self.critical_path(),
+            "total_seconds": round(self.total, 3),
+        }
+
+    def report(self) -> str:
+        lines = [
+            f"{name}: {timing.duration:.2f}s (start {timing.start:.2f}s)"
+            for name, timing in sorted(
+                self.timings.items(), key=lambda item: item[1].start
+            )
+        ]
+        lines.append(f"critical path: {' -> '.join(self.critical_path())}")
+        lines.append(f"total: {self.total:.2f}s")
+        return "\n".join(lines)
+
+
+class Channel:
+    """
+    An append-only stream of values that lets a stage consume another stage's
+    output while it is still being produced.
+
+    Every reader sees every value from the start, so readers may begin at
+    any time. The producer must call close when done, passing its exception
+    if it failed, so readers stop waiting.
+    """
+
+    def __init__(self):
+        self._items: list = []
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._waiter: Optional[asyncio.Future] = None
+
+    def put(self, item):
+        if self._closed:
+            raise RuntimeError("Channel is closed")
+        self._items.append(item)
+        self._wake()
+
+    def close(self, error: Optional[BaseException] = None):
+        self._closed = True
+        self._error = error
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        index = 0
+        while True:
+            while index < len(self._items):
+                yield self._items[index]
+                index += 1
+            if self._closed:
+                if self._error is not None:
+                    raise self._error
+                return
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            await asyncio.shield(self._waiter)
+
+
+async def run_pipeline(
+    stages: list[Stage], initial: Optional[dict] = None
+) -> PipelineResult:
+    """
+    Runs stages as a dependency graph, starting every stage as soon as all of
+    its dependencies have finished, so independent branches run concurrently.
+
+    Args:
+        stages (list[Stage]): The stages to run. Dependencies must name other
+            stages in the list or keys of ``initial``.
+        initial (dict): Values available to stages before anything runs.
+
+    Returns:
+        PipelineResult: Results of every stage plus per-stage timings.
+
+    Raises:
+        ValueError: If a dependency is unknown or the graph has a cycle.
+        Exception: The first exception raised by a stage; stages that were
+            still running are cancelled.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    results = dict(initial or {})
+    timings: dict[str, StageTiming] = {}
+
+    for stage in stages:
+        for dep in stage.depends_on:
+            if dep not in by_name and dep not in results:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown '{dep}'")
+    _check_acyclic(by_name)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def run_stage(stage: Stage):
+        for dep in stage.depends_on:
+            if dep in tasks:
+                await tasks[dep]
+        kwargs = {dep: results[dep] for dep in stage.depends_on}
+        start = loop.time() - started
+        outcome = "error"
+        try:
+            with span("stage", stage=stage.name):
+                results[stage.name] = await stage.func(**kwargs)
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            end = loop.time() - started
+            timings[stage.name] = StageTiming(start, end)
+            STAGE_SECONDS.observe(end - start, stage=stage.name, outcome=outcome)
+        return results[stage.name]
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+    return PipelineResult(results, timings, by_name)
+
+
+def _check_acyclic(stages: dict):
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done or name not in stages:
+            return
+        if name in visiting:
+            raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+        visiting.add(name)
+        for dep in stages[name].depends_on:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in stages:
+        visit(name)
@@ -0,0 +1,231 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+import weakref
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from lib.http import get_session
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Mermaid bundle injected into the rendering pages; downloaded once if missing
+MERMAID_JS_PATH = os.getenv("MERMAID_JS_PATH", "data/mermaid.min.js")
+MERMAID_JS_URL = "https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.min.js"
+# Pre-warmed pages per process, i.e. the most diagrams rendered at once
+MERMAID_PAGES = int(os.getenv("MERMAID_PAGES", "2"))
+# Pages are replaced after this many renders to bound their memory use
+MERMAID_PAGE_MAX_RENDERS = int(os.getenv("MERMAID_PAGE_MAX_RENDERS", "200"))
+MERMAID_RENDER_TIMEOUT = float(os.getenv("MERMAID_RENDER_TIMEOUT", "10"))
+# Seconds before starting the browser is tried again after it failed
+MERMAID_START_RETRY = 60
+
+PAGE_HTML = """
+<!doctype html>
+<html>
+  <body style="margin: 0; background: white;"><div id="app"></div></body>
+</html>
+"""
+
+RENDER_SCRIPT = """
+async ([id, code, width]) => {
+  const app = document.getElementById('app');
+  app.style.width = width + 'px';
+  try {
+    await mermaid.parse(code);
+    const { svg } = await mermaid.render(id, code);
+    app.innerHTML = svg;
+    return { svg };
+  } catch (e) {
+    app.innerHTML = '';
+    document.getElementById('d' + id)?.remove();
+    return { error: String(e) };
+  }
+}
+"""
+
+# One pool per event loop; Playwright objects cannot be shared across loops
+_pools = weakref.WeakKeyDictionary()
+
+
+class MermaidRenderError(Exception):
+    """Raised when Mermaid rejects a diagram."""
+
+
+async def load_mermaid_bundle() -> str:
+    """
+    Returns the Mermaid JavaScript bundle, downloading it to MERMAID_JS_PATH
+    on first use so later renders never leave the machine.
+    """
+    if not os.path.isfile(MERMAID_JS_PATH):
+        logger.info("Downloading Mermaid bundle to %s", MERMAID_JS_PATH)
+        async with get_session().get(MERMAID_JS_URL) as response:
+            response.raise_for_status()
+            bundle = await response.read()
+        os.makedirs(os.path.dirname(MERMAID_JS_PATH) or ".", exist_ok=True)
+        partial = f"{MERMAID_JS_PATH}.{os.getpid()}.tmp"
+        with open(partial, "wb") as file:
+            file.write(bundle)
+        os.replace(partial, MERMAID_JS_PATH)
+    with open(MERMAID_JS_PATH, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+class BrowserPool:
+    """
+    A long-lived headless Chromium with pages that already have Mermaid loaded.
+
+    Rendering borrows an idle page, so at most ``size`` diagrams render at
+    once and callers beyond that wait for a page. Pages are recycled after
+    ``max_renders`` renders or after an error.
+
+    Args:
+        size (int): Number of pre-warmed pages.
+        max_renders (int): Renders after which a page is replaced.
+    """
+
+    def __init__(
+        self, size: int = MERMAID_PAGES, max_renders: int = MERMAID_PAGE_MAX_RENDERS
+    ):
+        self.size = max(1, size)
+        self.max_renders = max_renders
+        self._playwright = None
+        self._browser = None
+        self._bundle: Optional[str] = None
+        self._idle: Optional[asyncio.Queue] = None
+        self._renders: dict = {}
+        # Pages that could not be replaced yet; retried on the next render
+        self._missing = 0
+        self._ids = itertools.count()
+        self._start_lock = asyncio.Lock()
+        self._failed_at: Optional[float] = None
+
+    async def start(self):
+        """Launches the browser and warms every page. Safe to call repeatedly."""
+        async with self._start_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            now = time.monotonic()
+            if self._failed_at and now - self._failed_at < MERMAID_START_RETRY:
+                raise RuntimeError("Mermaid browser pool failed to start recently")
+            try:
+                await self._launch()
+            except Exception:
+                self._failed_at = now
+                await self.close()
+                raise
+            self._failed_at = None
+            logger.info("Mermaid browser pool started with %d pages", self.size)
+
+    async def _launch(self):
+        from playwright.async_api import async_playwright
+
+        self._bundle = await load_mermaid_bundle()
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(args=["--no-sandbox"])
+        self._idle = asyncio.Queue()
+        self._missing = 0
+        pages = await asyncio.gather(*(self._new_page() for _ in range(self.size)))
+        for page in pages:
+            self._idle.put_nowait(page)
+
+    async def _new_page(self):
+        page = await self._browser.new_page(viewport={"width": 1024, "height": 768})
+        await page.set_content(PAGE_HTML)
+        await page.add_script_tag(content=self._bundle)
+        await page.evaluate(
+            "() => mermaid.initialize({ startOnLoad: false, securityLevel: 'strict' })"
+        )
+        self._renders[page] = 0
+        return page
+
+    async def _recycle(self, page):
+        self._renders.pop(page, None)
+        try:
+            await page.close()
+        except Exception:
+            pass
+        return await self._new_page()
+
+    async def render(self, mermaid_code: str, width: int = 1024) -> tuple[str, bytes]:
+        """
+        Renders a diagram in a pooled page.
+
+        Returns:
+            tuple[str, bytes]: The SVG markup and a PNG screenshot of it.
+
+        Raises:
+            MermaidRenderError: If the Mermaid code is invalid.
+        """
+        await self.start()
+        while self._missing:
+            try:
+                self._idle.put_nowait(await self._new_page())
+            except Exception as e:
+                logger.warning("Could not replace Mermaid page: %s", e)
+                break
+            self._missing -= 1
+        if self._missing >= self.size:
+            raise RuntimeError("No Mermaid rendering pages available")
+        page = await self._idle.get()
+        healthy = False
+        try:
+            result = await asyncio.wait_for(
+                self._render_on(page, mermaid_code, width), MERMAID_RENDER_TIMEOUT
+            )
+            healthy = True
+            return result
+        except MermaidRenderError:
+            healthy = True
+            raise
+        finally:
+            self._renders[page] = self._renders.get(page, 0) + 1
+            if not healthy or self._renders[page] >= self.max_renders:
+                try:
+                    page = await self._recycle(page)
+                except Exception as e:
+                    logger.warning("Could not replace Mermaid page: %s", e)
+                    page = None
+                    self._missing += 1
+            if page is not None:
+                self._idle.put_nowait(page)
+
+    async def _render_on(self, page, mermaid_code: str, width: int):
+        await page.set_viewport_size({"width": width, "height": 768})
+        result = await page.evaluate(
+            RENDER_SCRIPT, [f"diagram{next(self._ids)}", mermaid_code, width]
+        )
+        if "error" in result:
+            raise MermaidRenderError(result["error"])
+        png = await page.locator("#app > svg").screenshot(type="png")
+        return result["svg"], png
+
+    async def close(self):
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+            if self._playwright is not None:
+                await self._playwright.stop()
+        finally:
+            self._browser = self._playwright = None
+
+
+def get_browser_pool() -> BrowserPool:
+    """Returns the browser pool of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = BrowserPool()
+    return pool
+
+
+async def close_browser_pools():
+    """Closes the browser pool of the running event loop, if it was started."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
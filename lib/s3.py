@@ -1,66 +1,163 @@
-import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
-from botocore.config import Config
+import asyncio
+import io
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional, Union
 
 from dotenv import load_dotenv
 
+from lib.metrics import ERRORS, S3_UPLOAD_SECONDS, span
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
 aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 region_name = os.getenv("AWS_S3_REGION")
 bucket_name = os.getenv("AWS_S3_BUCKET")
+# S3-compatible endpoint, e.g. MinIO or the benchmark's fake S3 (default: AWS)
+endpoint_url = os.getenv("AWS_S3_ENDPOINT_URL")
+
+# Uploads running at the same time per process; also the client's connection pool size
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "8"))
+
+_client = None
+_client_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+Data = Union[bytes, bytearray, memoryview, BinaryIO]
+
+
+def get_s3_client():
+    """
+    Returns the process-wide S3 client, creating it on first use.
+
+    boto3 clients are thread-safe, so every upload shares one client and its
+    pool of keep-alive connections instead of building a new session each time.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Imported on first use; boto3 is slow to import
+                import boto3
+                from botocore.config import Config
+
+                session = boto3.Session(
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    region_name=region_name,
+                )
+                _client = session.client(
+                    "s3",
+                    endpoint_url=endpoint_url,
+                    config=Config(
+                        # Custom endpoints rarely resolve bucket subdomains
+                        s3={"addressing_style": "path" if endpoint_url else "auto"},
+                        connect_timeout=10,
+                        read_timeout=30,
+                        max_pool_connections=S3_UPLOAD_WORKERS,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+    return _client
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload"
+                )
+    return _executor
+
+
+def public_url(key: str) -> str:
+    # Public URL of an object (bucket policy allows public read access)
+    if endpoint_url:
+        return f"{endpoint_url.rstrip('/')}/{bucket_name}/{key}"
+    return f"https://{bucket_name}.s3.{region_name}.amazonaws.com/{key}"
+
+
+def upload_bytes_to_s3(data: Data, key: str, content_type: str = "image/png"):
+    """
+    Upload in-memory data to the S3 bucket, without touching the disk.
+
+    :param data: Bytes or a readable binary file object
+    :param key: Full S3 object key, including any extension
+    :param content_type: Content-Type stored with the object
+    :return: The public URL of the object if it was uploaded, else False
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = io.BytesIO(data)
+    start = time.perf_counter()
+    try:
+        get_s3_client().upload_fileobj(
+            data, bucket_name, key, ExtraArgs={"ContentType": content_type}
+        )
+    except Exception as e:
+        from botocore.exceptions import ClientError, NoCredentialsError
+
+        S3_UPLOAD_SECONDS.observe(time.perf_counter() - start, outcome="error")
+        ERRORS.inc(component="s3")
+        if isinstance(e, NoCredentialsError):
+            logger.error("Credentials not available.")
+        elif isinstance(e, ClientError):
+            logger.error("Client error: %s", e)
+        else:
+            logger.error("Unexpected error: %s", e)
+        return False
+    S3_UPLOAD_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+    url = public_url(key)
+    logger.info("S3 upload successful: %s", url)
+    return url
 
 
 def upload_png_to_s3(file_path, object_name=None):
     """
     Upload a PNG file to an AWS S3 bucket.
 
-    :param file_path: Path to the local PNG file
-    :param bucket_name: S3 bucket name
-    :param object_name: S3 object name. If not specified, file_path's basename is used
-    :param aws_access_key_id: AWS access key ID (optional, uses default if not provided)
-    :param aws_secret_access_key: AWS secret access key (optional, uses default if not provided)
-    :param region_name: AWS region (optional)
-    :return: True if file was uploaded, else False
+    :param file_path: Path to the local PNG file, or the PNG as bytes or a binary file object
+    :param object_name: S3 object name without ".png" (default: file_path's basename)
+    :return: The public URL of the object if it was uploaded, else False
     """
+    logger.debug("S3 Upload - Bucket: %s, Region: %s", bucket_name, region_name)
+
+    if not isinstance(file_path, (str, os.PathLike)):
+        if object_name is None:
+            raise ValueError("object_name is required when uploading in-memory data")
+        return upload_bytes_to_s3(file_path, object_name + ".png")
 
     if object_name is None:
         object_name = os.path.basename(file_path)
-
-    print(f"S3 Upload - Bucket: {bucket_name}, Region: {region_name}", flush=True)
-
     try:
-        session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name,
-        )
-        s3_client = session.client(
-            "s3", config=Config(connect_timeout=10, read_timeout=30)
-        )
         with open(file_path, "rb") as f:
-            print(f"Uploading file to S3: {file_path}", flush=True)
-            s3_client.upload_fileobj(
-                f,
-                bucket_name,
-                object_name + ".png",
-                ExtraArgs={"ContentType": "image/png"},
-            )
-        # Return a public URL (bucket policy allows public read access)
-        url = f"https://{bucket_name}.s3.{region_name}.amazonaws.com/{object_name}.png"
-        print(f"S3 upload successful: {url}", flush=True)
-        return url
+            logger.info("Uploading file to S3: %s", file_path)
+            return upload_bytes_to_s3(f, object_name + ".png")
     except FileNotFoundError:
-        print("The file was not found.")
-        return False
-    except NoCredentialsError:
-        print("Credentials not available.")
-        return False
-    except ClientError as e:
-        print(f"Client error: {e}")
-        return False
-    except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.error("The file was not found.")
         return False
+
+
+async def upload_to_s3(data: Data, key: str, content_type: str = "image/png"):
+    """
+    Upload in-memory data to S3 from async code.
+
+    The blocking upload runs on a bounded thread pool shared by every job,
+    so at most S3_UPLOAD_WORKERS uploads are in flight per process.
+
+    :return: The public URL of the object if it was uploaded, else False
+    """
+    loop = asyncio.get_running_loop()
+    # Recorded here: the upload thread does not see the job's trace
+    with span("s3.upload", key=key):
+        return await loop.run_in_executor(
+            _get_executor(), upload_bytes_to_s3, data, key, content_type
+        )
+
@@ -0,0 +1,156 @@
+import ast
+import hashlib
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from lib.cache import TieredCache, make_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the skeleton format changes, so cached skeletons are rebuilt
+SKELETON_VERSION = 1
+# Docstrings are cut to this many lines
+SKELETON_DOCSTRING_LINES = int(os.getenv("SKELETON_DOCSTRING_LINES", "8"))
+# Module-level values longer than this are shown as "..."
+SKELETON_MAX_VALUE_CHARS = 80
+# Lines of the `if __name__ == "__main__":` block that are kept
+SKELETON_MAIN_LINES = 10
+
+# ast.parse is not thread-safe on some CPython 3.11 releases ("AST constructor
+# recursion depth mismatch"), and it holds the GIL anyway
+_parse_lock = threading.Lock()
+
+skeleton_cache = TieredCache(
+    "skeletons",
+    max_entries=4096,
+    max_disk_bytes=64 * 1024 * 1024,
+)
+
+
+def _docstring(node, indent: str) -> list[str]:
+    docstring = ast.get_docstring(node)
+    if not docstring:
+        return []
+    lines = docstring.strip().splitlines()
+    if len(lines) > SKELETON_DOCSTRING_LINES:
+        lines = lines[:SKELETON_DOCSTRING_LINES] + ["..."]
+    text = "\n".join(f"{indent}{line}" if line else "" for line in lines)
+    return [f'{indent}"""{text.lstrip()}"""']
+
+
+def _body_without_docstring(node) -> list:
+    body = node.body
+    if ast.get_docstring(node, clean=False) is not None:
+        return body[1:]
+    return body
+
+
+def _assignment(node, indent: str) -> list[str]:
+    """Keeps a module or class attribute with its value when the value is short."""
+    if isinstance(node, ast.AnnAssign):
+        target = ast.unparse(node.target)
+        line = f"{indent}{target}: {ast.unparse(node.annotation)}"
+    else:
+        line = f"{indent}{' = '.join(ast.unparse(t) for t in node.targets)}"
+    if node.value is not None:
+        value = ast.unparse(node.value)
+        if len(value) > SKELETON_MAX_VALUE_CHARS or "\n" in value:
+            value = "..."
+        line += f" = {value}"
+    return [line]
+
+
+def _function(node, indent: str) -> list[str]:
+    lines = [f"{indent}@{ast.unparse(d)}" for d in node.decorator_list]
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    signature = f"{indent}{prefix} {node.name}({ast.unparse(node.args)})"
+    if node.returns is not None:
+        signature += f" -> {ast.unparse(node.returns)}"
+    docstring = _docstring(node, indent + "    ")
+    if docstring:
+        return lines + [signature + ":"] + docstring
+    return lines + [signature + ": ..."]
+
+
+def _class(node, indent: str) -> list[str]:
+    lines = [f"{indent}@{ast.unparse(d)}" for d in node.decorator_list]
+    bases = ", ".join(ast.unparse(b) for b in node.bases + node.keywords)
+    header = f"class {node.name}({bases}):" if bases else f"class {node.name}:"
+    lines.append(indent + header)
+    members = _docstring(node, indent + "    ") + _statements(
+        _body_without_docstring(node), indent + "    "
+    )
+    return lines + (members or [f"{indent}    ..."])
+
+
+def _main_block(node, indent: str) -> list[str]:
+    lines = ast.unparse(node).splitlines()
+    if len(lines) > SKELETON_MAIN_LINES:
+        lines = lines[:SKELETON_MAIN_LINES] + ["    ..."]
+    return [f"{indent}{line}" for line in lines]
+
+
+def _is_main_block(node) -> bool:
+    return (
+        isinstance(node, ast.If)
+        and isinstance(node.test, ast.Compare)
+        and isinstance(node.test.left, ast.Name)
+        and node.test.left.id == "__name__"
+    )
+
+
+def _statements(body: list, indent: str) -> list[str]:
+    lines = []
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            lines += _function(node, indent)
+        elif isinstance(node, ast.ClassDef):
+            lines += _class(node, indent)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            lines += _assignment(node, indent)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)) and not indent:
+            lines.append(ast.unparse(node))
+        elif _is_main_block(node) and not indent:
+            lines += _main_block(node, indent)
+    return lines
+
+
+def build_skeleton(source: str) -> str:
+    """
+    Reduces Python source to its structure: imports, module constants,
+    classes, function signatures with decorators, docstrings and the
+    `if __name__ == "__main__":` entry point. Function bodies are dropped.
+
+    Raises:
+        SyntaxError: If source is not valid Python.
+    """
+    with _parse_lock:
+        tree = ast.parse(source)
+    lines = [f"# Skeleton of {len(source.splitlines())} lines, bodies elided"]
+    lines += _docstring(tree, "")
+    lines += _statements(_body_without_docstring(tree), "")
+    return "\n".join(lines)
+
+
+def python_skeleton(source: str) -> str:
+    """
+    Returns the skeleton of Python source, cached by the hash of the source.
+    Source that does not parse, e.g. Python 2, is returned unchanged.
+    """
+    digest = hashlib.sha256(source.encode("utf-8", errors="replace")).hexdigest()
+    key = make_key("skeleton", SKELETON_VERSION, SKELETON_DOCSTRING_LINES, digest)
+    cached = skeleton_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        skeleton = build_skeleton(source)
+    except (SyntaxError, ValueError, RecursionError) as e:
+        logger.debug("Keeping unparsable Python source in full: %s", e)
+        return source
+    skeleton_cache.set(key, skeleton)
+    return skeleton
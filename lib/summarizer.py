@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from lib.agent_template import chunk_summarizer_agent
+from lib.cache import TieredCache, make_key
+from lib.file_reader import format_files_document
+from lib.gemini import GEMINI_MODEL, run_agent_with_gemini
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "off" never summarises, "always" always does, "auto" only above the threshold
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "auto").lower()
+# Repository documents larger than this are map-reduced in "auto" mode
+SUMMARY_THRESHOLD_BYTES = int(os.getenv("SUMMARY_THRESHOLD_BYTES", "200000"))
+# Largest chunk of files sent to a single summarisation call
+SUMMARY_CHUNK_BYTES = int(os.getenv("SUMMARY_CHUNK_BYTES", "60000"))
+# Maximum number of chunks summarised at the same time per job
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+# Maximum number of reduce rounds over the chunk summaries
+SUMMARY_MAX_ROUNDS = 3
+
+summary_cache = TieredCache(
+    "summaries",
+    max_entries=1024,
+    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+
+def should_summarize(file_contents: dict, mode: Optional[str] = None) -> bool:
+    """Decides whether a repository is too large to be given to the agents verbatim."""
+    mode = (mode or SUMMARY_MODE).lower()
+    if mode == "always":
+        return True
+    if mode != "auto":
+        return False
+    size = sum(len(content.encode("utf-8")) for content in file_contents.values())
+    return size > SUMMARY_THRESHOLD_BYTES
+
+
+def _module_of(path: str) -> str:
+    return path.split("/", 1)[0] if "/" in path else "(root)"
+
+
+def chunk_files(
+    file_contents: dict, max_chunk_bytes: Optional[int] = None
+) -> list[dict]:
+    """
+    Splits files into chunks of whole modules (top-level directories).
+
+    Modules are never merged with each other, so a change in one module
+    leaves the chunks, and therefore the cached summaries, of every other
+    module untouched. Modules larger than max_chunk_bytes are split into
+    several chunks in file order.
+
+    Returns:
+        list[dict]: Chunks mapping relative file paths to contents.
+    """
+    max_chunk_bytes = max_chunk_bytes or SUMMARY_CHUNK_BYTES
+    modules: dict[str, list[tuple[str, str]]] = {}
+    for path, content in file_contents.items():
+        modules.setdefault(_module_of(path), []).append((path, content))
+
+    chunks = []
+    for files in modules.values():
+        chunk, size = {}, 0
+        for path, content in files:
+            file_size = len(content.encode("utf-8"))
+            if chunk and size + file_size > max_chunk_bytes:
+                chunks.append(chunk)
+                chunk, size = {}, 0
+            chunk[path] = content
+            size += file_size
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+def _chunk_key(chunk: dict) -> str:
+    fingerprint = [
+        (path, hashlib.sha256(content.encode("utf-8")).hexdigest())
+        for path, content in chunk.items()
+    ]
+    return make_key(GEMINI_MODEL, chunk_summarizer_agent, fingerprint)
+
+
+async def summarize_chunk(chunk: dict, semaphore: asyncio.Semaphore) -> str:
+    """Summarises one chunk, reusing the cached summary if its files are unchanged."""
+    key = _chunk_key(chunk)
+    cached = await summary_cache.aget(key)
+    if cached is not None:
+        return cached
+    async with semaphore:
+        response = await run_agent_with_gemini(
+            chunk_summarizer_agent,
+            format_files_document(chunk),
+            use_cache=False,
+            agent_name="chunk_summarizer",
+        )
+    summary = response.final_output.strip()
+    await summary_cache.aset(key, summary)
+    return summary
+
+
+def _chunk_label(chunk: dict) -> str:
+    paths = list(chunk)
+    return paths[0] if len(paths) == 1 else f"{paths[0]} .. {paths[-1]}"
+
+
+async def summarize_repository(file_contents: dict) -> str:
+    """
+    Map-reduces a repository that is too large for a single prompt.
+
+    Root README files are kept verbatim. Every other module is summarised
+    concurrently (at most SUMMARY_CONCURRENCY calls at once), and the
+    summaries are summarised again until they fit SUMMARY_THRESHOLD_BYTES.
+
+    Args:
+        file_contents (dict): Relative file paths mapped to contents, as
+            returned by read_files_in_directory.
+
+    Returns:
+        str: A document with the READMEs and one <summary> per chunk.
+    """
+    readmes = {
+        path: content
+        for path, content in file_contents.items()
+        if "/" not in path and path.lower().startswith("readme")
+    }
+    remaining = {p: c for p, c in file_contents.items() if p not in readmes}
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+    summaries: dict = {}
+    for round_number in range(1, SUMMARY_MAX_ROUNDS + 1):
+        chunks = chunk_files(remaining)
+        logger.info(
+            "Summarising %d files in %d chunks (round %d)",
+            len(remaining),
+            len(chunks),
+            round_number,
+        )
+        results = await asyncio.gather(
+            *(summarize_chunk(chunk, semaphore) for chunk in chunks)
+        )
+        summaries = {
+            _chunk_label(chunk): summary for chunk, summary in zip(chunks, results)
+        }
+        size = sum(len(s.encode("utf-8")) for s in summaries.values())
+        if size <= SUMMARY_THRESHOLD_BYTES or len(chunks) <= 1:
+            break
+        # Summarise the summaries, keeping them grouped by their module
+        remaining = {
+            f"{label}.summary.md": summary for label, summary in summaries.items()
+        }
+
+    parts = [format_files_document(readmes)] if readmes else []
+    parts += [
+        f'<summary of="{label}">\n{summary}\n</summary>'
+        for label, summary in summaries.items()
+    ]
+    return "\n".join(parts)
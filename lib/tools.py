@@ -1,55 +1,44 @@
-import mermaid as md
-import os, shutil, subprocess, tempfile
-from pathlib import Path
+import aiohttp
 import asyncio
-from playwright.async_api import async_playwright
-from uuid import uuid4
-from lib.s3 import upload_png_to_s3
+import base64
+import json
+import logging
+import os
+import textwrap
+import time
+from lib.cache import TieredCache, make_key
+from lib.http import get_session
+from lib.log import truncate
+from lib.metrics import DIAGRAM_SECONDS, ERRORS, span
+from lib.renderer import MermaidRenderError, get_browser_pool
+from lib.s3 import upload_to_s3
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-MERMAID_HTML = """
-<!doctype html>
-<html>
-  <body><div id="app"></div></body>
-  <script type="module">
-    import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.esm.min.mjs';
-    window.mermaidReady = (async () => {
-      mermaid.initialize({ startOnLoad: false });
-      return mermaid;
-    })();
-  </script>
-</html>
-"""
+logger = logging.getLogger(__name__)
+
+# "local" renders in the pooled headless browser, "ink" uses the mermaid.ink service
+MERMAID_RENDERER = os.getenv("MERMAID_RENDERER", "local").lower()
+MERMAID_INK_URL = "https://mermaid.ink"
+PLACEHOLDER_DIAGRAM_URL = "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=800&h=600&fit=crop&crop=center"
+
+# Maps diagram source hashes to their uploaded URLs; S3 objects never expire
+DIAGRAM_CACHE_ENABLED = os.getenv("DIAGRAM_CACHE_ENABLED", "true").lower() == "true"
+diagram_cache = TieredCache(
+    "diagrams", max_entries=1024, max_disk_bytes=16 * 1024**2
+)
+# Futures of the renders in progress, keyed by diagram_key
+_inflight_renders: dict = {}
 
 
 async def mermaid_to_svg(mermaid_code: str) -> str:
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(args=["--no-sandbox"])
-        page = await browser.new_page()
-        await page.set_content(MERMAID_HTML, wait_until="networkidle")
-        # Validate + render
-        await page.wait_for_function("() => window.mermaidReady !== undefined")
-        svg = await page.evaluate(
-            """
-      async (code) => {
-        const mermaid = await window.mermaidReady;
-        try {
-          // parse to validate first
-          await mermaid.parse(code);
-          const { svg } = await mermaid.render('g1', code);
-          return svg;
-        } catch (e) {
-          return JSON.stringify({ error: String(e) });
-        }
-      }
-    """,
-            mermaid_code,
-        )
-        await browser.close()
-        return svg
+    try:
+        svg, _ = await get_browser_pool().render(mermaid_code)
+    except MermaidRenderError as e:
+        return json.dumps({"error": str(e)})
+    return svg
 
 
 def save_svg(svg_text: str, out_svg: str):
@@ -60,8 +49,78 @@ def save_svg(svg_text: str, out_svg: str):
         f.write(svg_text)
 
 
+async def _render_with_ink(mermaid_code: str, width: int) -> bytes:
+    encoded = base64.b64encode(mermaid_code.encode("utf-8")).decode("ascii")
+    ink_url = f"{MERMAID_INK_URL}/img/{encoded}?type=png&width={width}"
+    logger.info("Generating diagram via Mermaid Ink: %s", truncate(ink_url, 100))
+    async with get_session().get(
+        ink_url, timeout=aiohttp.ClientTimeout(total=30)
+    ) as response:
+        if response.status != 200:
+            logger.warning("Mermaid Ink failed with status %s", response.status)
+            raise RuntimeError(f"Mermaid Ink returned {response.status}")
+        return await response.read()
+
+
+async def render_png(mermaid_code: str, width: int = 1024) -> bytes:
+    """
+    Renders Mermaid code to PNG bytes with the configured renderer.
+
+    The local renderer falls back to mermaid.ink if the browser cannot be
+    used, but not when Mermaid rejects the diagram itself.
+    """
+    if MERMAID_RENDERER == "local":
+        try:
+            _, png = await get_browser_pool().render(mermaid_code, width)
+            return png
+        except MermaidRenderError:
+            raise
+        except Exception as e:
+            logger.warning(
+                "Local Mermaid rendering unavailable (%s), using Mermaid Ink", e
+            )
+    return await _render_with_ink(mermaid_code, width)
+
+
+def normalize_mermaid(mermaid_code: str) -> str:
+    """
+    Canonical form of Mermaid source for cache keys: unified line endings,
+    common indentation, trailing whitespace, blank lines and %% comments
+    removed. Relative indentation is kept, as some diagram types use it.
+    """
+    kept = []
+    for line in mermaid_code.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith("%%") and not stripped.startswith("%%{"):
+            continue
+        kept.append(line.rstrip())
+    return textwrap.dedent("\n".join(kept))
+
+
+def diagram_key(mermaid_code: str, width: int = 1024) -> str:
+    """Content hash of a diagram, used both as cache key and as S3 object name."""
+    return make_key("mermaid", normalize_mermaid(mermaid_code), width)
+
+
+async def _render_and_upload(mermaid_code: str, width: int, object_name: str) -> str:
+    png = await render_png(mermaid_code, width)
+    logger.info("Rendered diagram, uploading to S3...")
+    s3_url = await upload_to_s3(png, f"{object_name}.png")
+    if not s3_url:
+        logger.warning("S3 upload failed, using placeholder")
+        raise RuntimeError("S3 upload failed")
+    logger.info("S3 upload successful: %s", truncate(s3_url, 100))
+    return s3_url
+
+
 async def mermaid_to_png(mermaid_code: str, width: int = 1024):
-    """Generate a PNG image from Mermaid code using Mermaid Ink API.
+    """Generate a PNG image from Mermaid code and upload it to S3.
+
+    Diagrams are cached by their normalised source: a diagram that was
+    rendered before returns its existing URL without rendering or uploading,
+    and identical diagrams requested at the same time are rendered once.
 
     Args:
     - mermaid_code (str): The Mermaid code to convert.
@@ -70,48 +129,43 @@ async def mermaid_to_png(mermaid_code: str, width: int = 1024):
     Returns:
     - str: The URL of the generated PNG file
     """
+    start = time.perf_counter()
+    with span("diagram"):
+        url, source = await _provide_diagram(mermaid_code, width)
+    DIAGRAM_SECONDS.observe(time.perf_counter() - start, source=source)
+    return url
+
+
+async def _provide_diagram(mermaid_code: str, width: int) -> tuple[str, str]:
+    """Returns the diagram URL and where it came from, for metrics."""
+    key = diagram_key(mermaid_code, width)
+    if DIAGRAM_CACHE_ENABLED:
+        cached = await diagram_cache.aget(key)
+        if cached is not None:
+            logger.info("Diagram cache hit: %s", truncate(cached, 100))
+            return cached, "cache"
+
+    shared = _inflight_renders.get(key)
+    if shared is not None:
+        # The same diagram is being rendered by another job: share its result
+        url = await asyncio.shield(shared)
+        return url or PLACEHOLDER_DIAGRAM_URL, "shared" if url else "error"
+
+    leader = asyncio.get_running_loop().create_future()
+    _inflight_renders[key] = leader
+    url = None
     try:
-        import base64
-        import urllib.parse
-        import requests
-        import tempfile
-
-        # Use Mermaid Ink service - a public service that converts mermaid to images
-        encoded = base64.b64encode(mermaid_code.encode("utf-8")).decode("ascii")
-        ink_url = f"https://mermaid.ink/img/{encoded}?type=png&width={width}"
-
-        print(f"✅ Generating diagram via Mermaid Ink: {ink_url[:100]}...", flush=True)
-
-        # Download the image from Mermaid Ink
-        response = requests.get(ink_url, timeout=30)
-        if response.status_code == 200:
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                temp_file.write(response.content)
-                temp_file_path = temp_file.name
-            
-            print("✅ Downloaded diagram from Mermaid Ink, uploading to S3...", flush=True)
-            
-            # Upload to S3
-            s3_url = upload_png_to_s3(temp_file_path, f"diagram-{str(uuid4())[:8]}")
-            
-            # Clean up temp file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
-            
-            if s3_url:
-                print(f"✅ S3 upload successful: {s3_url[:100]}...", flush=True)
-                return s3_url
-            else:
-                print("❌ S3 upload failed, using placeholder", flush=True)
-                raise RuntimeError("S3 upload failed")
-        else:
-            print(f"❌ Mermaid Ink failed with status {response.status_code}", flush=True)
-            raise RuntimeError(f"Mermaid Ink returned {response.status_code}")
-
+        # Content-addressed object name: re-uploads of a diagram overwrite one object
+        url = await _render_and_upload(mermaid_code, width, f"diagrams/{key}")
+        if DIAGRAM_CACHE_ENABLED:
+            await diagram_cache.aset(key, url)
+        return url, "render"
     except Exception as e:
-        print(f"Diagram generation failed: {e}", flush=True)
+        logger.error("Diagram generation failed: %s", e)
+        ERRORS.inc(component="diagram")
         # Return a placeholder diagram from Unsplash
-        return "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=800&h=600&fit=crop&crop=center"
+        return PLACEHOLDER_DIAGRAM_URL, "error"
+    finally:
+        del _inflight_renders[key]
+        if not leader.done():
+            leader.set_result(url)
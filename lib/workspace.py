@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import weakref
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "/tmp/newsletter_repos/jobs")
+# Total bytes that all job workspaces of this process may hold at once. The
+# quota is not shared between processes: with N worker processes the disk may
+# hold N times this much
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(2 * 1024**3)))
+
+
+class DiskQuota:
+    """
+    A byte budget shared by concurrent jobs.
+
+    ``acquire`` waits until enough of the budget has been released by other
+    jobs, so a burst of large downloads queues up instead of filling the disk.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._conditions = weakref.WeakKeyDictionary()
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        condition = self._conditions.get(loop)
+        if condition is None:
+            condition = asyncio.Condition()
+            self._conditions[loop] = condition
+        return condition
+
+    async def acquire(self, size: int):
+        if size > self.max_bytes:
+            raise ValueError(
+                f"Workspace needs {size} bytes, more than the {self.max_bytes} byte quota"
+            )
+        condition = self._condition()
+        async with condition:
+            if self.used + size > self.max_bytes:
+                logger.info(
+                    "Waiting for %d bytes of workspace quota (%d/%d in use)",
+                    size,
+                    self.used,
+                    self.max_bytes,
+                )
+            await condition.wait_for(lambda: self.used + size <= self.max_bytes)
+            self.used += size
+
+    async def release(self, size: int):
+        condition = self._condition()
+        async with condition:
+            self.used = max(0, self.used - size)
+            condition.notify_all()
+
+
+disk_quota = DiskQuota(WORKSPACE_QUOTA_BYTES)
+
+
+class Workspace:
+    """A private scratch directory for one job."""
+
+    def __init__(self, job_id: str, path: str, quota: DiskQuota):
+        self.job_id = job_id
+        self.path = path
+        self.quota = quota
+        self.reserved = 0
+        self._cleanup_callbacks: list[Callable[[], None]] = []
+
+    async def reserve(self, size: int):
+        """Reserves size bytes of the disk quota, waiting if it is exhausted."""
+        await self.quota.acquire(size)
+        self.reserved += size
+
+    def on_cleanup(self, callback: Callable[[], None]):
+        """Registers a callback to run when the workspace is removed."""
+        self._cleanup_callbacks.append(callback)
+
+    async def cleanup(self):
+        for callback in reversed(self._cleanup_callbacks):
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Workspace cleanup callback failed: %s", e)
+        self._cleanup_callbacks.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.reserved:
+            await self.quota.release(self.reserved)
+            self.reserved = 0
+
+
+def workspace_path(job_id: str) -> str:
+    """Returns the deterministic workspace directory of a job."""
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", job_id)
+    return os.path.join(WORKSPACE_ROOT, safe_id)
+
+
+@asynccontextmanager
+async def job_workspace(job_id: Optional[str] = None, quota: DiskQuota = disk_quota):
+    """
+    Creates an isolated workspace for a job and removes it when the job ends.
+
+    Args:
+        job_id (str): Job identifier; the workspace lives at WORKSPACE_ROOT/<job_id>.
+            A random id is used if omitted.
+        quota (DiskQuota): The disk budget reservations are taken from.
+
+    Yields:
+        Workspace: The job's workspace.
+    """
+    job_id = job_id or uuid4().hex
+    path = workspace_path(job_id)
+    # Leftovers from a crashed run of the same job
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    workspace = Workspace(job_id, path, quota)
+    try:
+        yield workspace
+    finally:
+        await workspace.cleanup()
@@ -1,60 +1,195 @@
-from lib.github import download_github_repo
+from lib.github import (
+    RefResolutionError,
+    RepositoryNotFoundError,
+    download_github_repo,
+    parse_github_ref,
+    parse_github_url,
+    resolve_ref,
+)
 from lib.agent_template import (
     newsletter_writer_agent,
     newsletter_editor_agent,
     text_to_json_writer,
     diagram_generator_agent,
 )
-import asyncio
-import google.generativeai as genai
-from lib.file_reader import read_files_in_directory
-from lib.notion import convert_json_to_notion_blocks, add_newsletter_to_notion
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from lib.gemini import (
+    get_model,
+    llm_cache,
+    run_agent_with_gemini,
+    stream_agent_with_gemini,
+)
+from lib.context_cache import SharedContext, share_context
+from lib.file_reader import read_files_in_directory, format_files_document
+from lib.notion import (
+    NotionBlocks,
+    NotionError,
+    convert_json_to_notion_blocks,
+    is_valid_page_id,
+    parse_block_stream,
+    publish_blocks_stream,
+)
+from lib.markdown_blocks import compile_markdown_stream
+from lib.pipeline import Channel, Stage, run_pipeline
+from lib.skeleton import skeleton_cache
+from lib.summarizer import should_summarize, summarize_repository, summary_cache
+from lib.metrics import (
+    ERRORS,
+    JOB_SECONDS,
+    register_collector,
+    render_metrics,
+    start_trace,
+)
+from lib.workspace import Workspace, job_workspace
+from lib.http import close_sessions, get_session
+from lib.renderer import close_browser_pools, get_browser_pool
+from lib.jobs import JobQueue, PermanentJobError, WorkerPool
+from lib.log import configure_logging, truncate
+from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.security import APIKeyHeader
+from pydantic import BaseModel
 from starlette.status import HTTP_403_FORBIDDEN
 
 from dotenv import load_dotenv
-import json
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Optional
+import asyncio
+import logging
 import os
+import time
 
 load_dotenv()
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-1.5-flash")
+configure_logging()
+logger = logging.getLogger(__name__)
 
 API_KEY = os.getenv("API_KEY")
 API_KEY_NAME = "x-api-key"
+# Serve /metrics without the API key, for scrapers on a private network
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+
+# Repository files given to the agents
+REPO_FILE_EXTENSIONS = ["md", "py"]
+# How the agents that read the repository see it: "full" file contents, or a
+# "digest" where Python files are reduced to signatures and docstrings. Agents
+# with the same mode share one prompt and its cached context
+WRITER_REPO_MODE = os.getenv("WRITER_REPO_MODE", "full").lower()
+DIAGRAM_REPO_MODE = os.getenv("DIAGRAM_REPO_MODE", "full").lower()
+# Notion page properties that may pin the branch, tag or commit to use
+REF_PROPERTIES = ["Commit", "Ref", "Branch"]
+# "local" compiles the editor's Markdown into Notion blocks, "llm" asks text_to_json_writer
+NOTION_BLOCKS_COMPILER = os.getenv("NOTION_BLOCKS_COMPILER", "local").lower()
+# Commit lookups made at the same time while submitting a batch
+BATCH_SUBMIT_CONCURRENCY = 8
+# Loading of the lazily imported clients at startup: "off", "background"
+# (serve at once, warm up alongside) or "blocking" (warm up before serving)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "off").lower()
+
+
+PLACEHOLDER_DIAGRAM_URL = "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=400&h=300&fit=crop&crop=center"
+
+FALLBACK_DIAGRAM = """graph TD
+    A[User] --> B[System]
+    B --> C[Result]"""
 
 
-async def run_agent_with_gemini(agent_prompt, user_input):
-    """Helper function to run agent prompts with Gemini API"""
-    try:
-        # Combine agent prompt with user input
-        full_prompt = f"{agent_prompt}\n\nUser Input:\n{user_input}"
-
-        # Generate content with Gemini
-        response = model.generate_content(full_prompt)
-
-        # Return response in a format similar to the original Runner
-        class AgentResponse:
-            def __init__(self, output):
-                self.final_output = output
+def clean_mermaid_code(raw_output: str) -> str:
+    """Strip code fences and problematic characters from the diagram agent output."""
+    # Extract Mermaid code
+    mermaid_code = raw_output.strip()
+    if mermaid_code.startswith("```mermaid"):
+        mermaid_code = mermaid_code[10:]  # Remove ```mermaid
+    if mermaid_code.endswith("```"):
+        mermaid_code = mermaid_code[:-3]  # Remove ```
+    mermaid_code = mermaid_code.strip()
+
+    # Clean up any problematic characters or syntax
+    lines = mermaid_code.split("\n")
+    cleaned_lines = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("```"):
+            # Remove any problematic characters
+            line = line.replace("{", "[").replace("}", "]")  # Convert {} to []
+            cleaned_lines.append(line)
+    return "\n".join(cleaned_lines)
+
+
+async def render_diagram(mermaid_code: str) -> str:
+    """Render Mermaid code to a hosted PNG URL, falling back to a simple diagram."""
+    # Convert Mermaid to PNG URL using our tools
+    from lib.tools import PLACEHOLDER_DIAGRAM_URL as RENDER_FAILED_URL
+    from lib.tools import mermaid_to_png
 
-        return AgentResponse(response.text)
+    try:
+        diagram_url_result = await mermaid_to_png(mermaid_code)
+        if diagram_url_result and diagram_url_result != RENDER_FAILED_URL:
+            logger.info("Generated diagram URL: %s", diagram_url_result)
+            return diagram_url_result
+        logger.warning("Diagram generation failed")
     except Exception as e:
-        print(f"Gemini API error: {e}")
-        raise
+        logger.warning("Error generating diagram: %s", e)
 
-
-async def run_generate_newsletter(notion_id: str, repo_link: str):
+    # Try a simpler diagram
     try:
-        print("Downloading repository from:", repo_link, flush=True)
-
-        directory = await download_github_repo(repo_link)
-
-        files_string = read_files_in_directory(directory, ["md", "py"])
+        logger.info("Attempting simple fallback diagram...")
+        # Cached after its first render, so repeated failures cost no render
+        diagram_url_result = await mermaid_to_png(FALLBACK_DIAGRAM)
+        if diagram_url_result and diagram_url_result != RENDER_FAILED_URL:
+            logger.info("Fallback diagram successful: %s", diagram_url_result)
+            return diagram_url_result
+        logger.warning("Using Unsplash placeholder")
+    except Exception as e2:
+        logger.warning("Fallback diagram also failed: %s", e2)
+    return PLACEHOLDER_DIAGRAM_URL
+
+
+def build_newsletter_stages(
+    notion_id: str,
+    repo_link: str,
+    workspace: Workspace,
+    ref: Optional[str] = None,
+) -> list[Stage]:
+    """
+    Builds the newsletter pipeline. The diagram branch (diagram agent, render
+    and upload) runs concurrently with the writer/editor branch. The editor's
+    Markdown is streamed and compiled into Notion blocks (or, with
+    NOTION_BLOCKS_COMPILER=llm, rewritten as JSON by text_to_json_writer),
+    which are published while they are generated; the diagram branch is
+    only waited for when an image block comes up. The writer and diagram
+    agents read the repository as WRITER_REPO_MODE and DIAGRAM_REPO_MODE;
+    agents with the same mode share one context, which is cached server-side.
+
+    Must be called from the event loop that runs the pipeline.
+    """
+    edited_text = Channel()
+    diagram_ready = asyncio.get_running_loop().create_future()
+
+    async def download():
+        logger.info("Downloading repository from: %s", repo_link)
+        return await download_github_repo(
+            repo_link, extensions=REPO_FILE_EXTENSIONS, workspace=workspace, ref=ref
+        )
 
-        user_prompt = f"""
+    async def repository_prompt(download, mode: str) -> str:
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(
+            None,
+            partial(read_files_in_directory, download, REPO_FILE_EXTENSIONS, mode=mode),
+        )
+        if should_summarize(files):
+            # Too large for one prompt: give the agents a map-reduced summary
+            summary = await summarize_repository(files)
+            return f"""
+        <repository summary>
+        {summary}
+        </repository summary>
+        <github link>
+        {repo_link}
+        </github link>
+        """
+        files_string = format_files_document(files)
+        return f"""
         <files>
         {files_string}
         </files>
@@ -63,116 +198,334 @@ async def run_generate_newsletter(notion_id: str, repo_link: str):
         </github link>
         """
 
-        diagram_agent_output = await run_agent_with_gemini(
-            diagram_generator_agent, user_prompt
+    async def user_prompt(download):
+        # One prompt per reader mode in use, shared by the agents using that mode
+        modes = sorted({WRITER_REPO_MODE, DIAGRAM_REPO_MODE})
+        prompts = await asyncio.gather(
+            *(repository_prompt(download, mode) for mode in modes)
         )
+        return dict(zip(modes, prompts))
 
-        # Extract Mermaid code and convert to PNG URL
-        mermaid_code = diagram_agent_output.final_output.strip()
-        if mermaid_code.startswith("```mermaid"):
-            mermaid_code = mermaid_code[10:]  # Remove ```mermaid
-        if mermaid_code.endswith("```"):
-            mermaid_code = mermaid_code[:-3]  # Remove ```
-        mermaid_code = mermaid_code.strip()
-
-        # Clean up any problematic characters or syntax
-        lines = mermaid_code.split("\n")
-        cleaned_lines = []
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith("```"):
-                # Remove any problematic characters
-                line = line.replace("{", "[").replace("}", "]")  # Convert {} to []
-                cleaned_lines.append(line)
-        mermaid_code = "\n".join(cleaned_lines)
-
-        print(f"Cleaned Mermaid code: {mermaid_code[:200]}...", flush=True)
-
-        # Convert Mermaid to PNG URL using our tools
-        from lib.tools import mermaid_to_png
+    async def context(user_prompt):
+        readers = [WRITER_REPO_MODE, DIAGRAM_REPO_MODE]
 
-        try:
-            diagram_url_result = await mermaid_to_png(mermaid_code)
-            if diagram_url_result:
-                diagram_url = diagram_url_result
-                print("Generated diagram URL:", diagram_url, flush=True)
-            else:
-                diagram_url = "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=400&h=300&fit=crop&crop=center"
-                print("Diagram upload failed, using placeholder", flush=True)
-        except Exception as e:
-            print(f"Error generating diagram: {e}", flush=True)
-            # Try a simpler diagram
-            simple_diagram = """graph TD
-    A[User] --> B[System]
-    B --> C[Result]"""
-            try:
-                print("Attempting simple fallback diagram...", flush=True)
-                diagram_url_result = await mermaid_to_png(simple_diagram)
-                if diagram_url_result:
-                    diagram_url = diagram_url_result
-                    print("Fallback diagram successful:", diagram_url, flush=True)
-                else:
-                    diagram_url = "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=400&h=300&fit=crop&crop=center"
-                    print("Using Unsplash placeholder", flush=True)
-            except Exception as e2:
-                print(f"Fallback diagram also failed: {e2}", flush=True)
-                diagram_url = "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=400&h=300&fit=crop&crop=center"
+        async def share(mode: str) -> SharedContext:
+            if readers.count(mode) < 2:
+                # Read by one agent only: caching it would add a create call
+                # and storage without saving any prompt tokens
+                return SharedContext(user_prompt[mode])
+            return await share_context(user_prompt[mode])
 
-        newsletter_draft = await run_agent_with_gemini(
-            newsletter_writer_agent, user_prompt
-        )
+        contexts = await asyncio.gather(*map(share, user_prompt))
+        return dict(zip(user_prompt, contexts))
 
-        edited_newsletter = await run_agent_with_gemini(
-            newsletter_editor_agent, newsletter_draft.final_output
+    async def diagram_code(context):
+        diagram_agent_output = await run_agent_with_gemini(
+            diagram_generator_agent,
+            "",
+            context=context[DIAGRAM_REPO_MODE],
+            agent_name="diagram",
         )
+        mermaid_code = clean_mermaid_code(diagram_agent_output.final_output)
+        logger.debug("Cleaned Mermaid code: %s", truncate(mermaid_code, 200))
+        return mermaid_code
 
-        # # Convert to JSON Blocks
+    async def diagram_url(diagram_code):
+        url = await render_diagram(diagram_code)
+        diagram_ready.set_result(url)
+        return url
 
-        json_blocks = await run_agent_with_gemini(
-            text_to_json_writer, edited_newsletter.final_output
+    async def draft(context):
+        newsletter_draft = await run_agent_with_gemini(
+            newsletter_writer_agent,
+            "",
+            context=context[WRITER_REPO_MODE],
+            agent_name="writer",
         )
+        return newsletter_draft.final_output
 
-        print("JSON blocks raw output:", json_blocks.final_output[:500], flush=True)
-
-        # Parse the JSON string output and convert to NotionBlocks
+    async def edited(draft):
+        # Streamed, so readers of edited_text can start on the first chunks
         try:
-            # Clean the JSON output by removing markdown code block markers
-            json_output = json_blocks.final_output.strip()
-            if json_output.startswith("```json"):
-                json_output = json_output[7:]  # Remove ```json
-            if json_output.endswith("```"):
-                json_output = json_output[:-3]  # Remove ```
-            json_output = json_output.strip()
-
-            parsed_json = json.loads(json_output)
-            # Import NotionBlocks from lib.notion
-            from lib.notion import NotionBlocks
-
-            notion_blocks_obj = NotionBlocks(**parsed_json)
-            notion_blocks = convert_json_to_notion_blocks(
-                notion_blocks_obj, diagram_url
+            edited_newsletter = await run_agent_with_gemini(
+                newsletter_editor_agent,
+                draft,
+                on_chunk=edited_text.put,
+                agent_name="editor",
             )
-            add_newsletter_to_notion(notion_id, notion_blocks)
-            print("Newsletter processing completed successfully!", flush=True)
-        except json.JSONDecodeError as e:
-            print(f"Failed to parse JSON output: {e}", flush=True)
-            print(f"Raw output: {json_blocks.final_output[:1000]}...", flush=True)
-        except Exception as e:
-            print(f"Error creating notion blocks: {e}", flush=True)
-            if "parsed_json" in locals():
-                print(
-                    f"Parsed JSON keys: {list(parsed_json.keys()) if isinstance(parsed_json, dict) else 'Not a dict'}",
-                    flush=True,
+        except BaseException as e:
+            edited_text.close(e)
+            raise
+        edited_text.close()
+        return edited_newsletter.final_output
+
+    async def release_context(context, diagram_code, draft):
+        for shared in context.values():
+            await shared.release()
+
+    async def converted_blocks(blocks):
+        async for block in blocks:
+            # Only image blocks need to wait for the diagram branch
+            url = await diagram_ready if block.type == "image" else ""
+            for notion_block in convert_json_to_notion_blocks(
+                NotionBlocks(blocks=[block]), url
+            ):
+                yield notion_block
+
+    async def publish(draft):
+        if NOTION_BLOCKS_COMPILER == "llm":
+            # The JSON writer needs the complete edited newsletter as its prompt
+            newsletter = "".join([chunk async for chunk in edited_text])
+            json_chunks = stream_agent_with_gemini(
+                text_to_json_writer, newsletter, agent_name="json_writer"
+            )
+            # Blocks are parsed and published while the JSON streams in
+            blocks = parse_block_stream(json_chunks)
+        else:
+            # Compiled locally, block by block, while the editor streams
+            blocks = compile_markdown_stream(edited_text)
+        if not await publish_blocks_stream(notion_id, converted_blocks(blocks)):
+            raise PermanentJobError(f"Invalid Notion page ID: {notion_id}")
+        return True
+
+    return [
+        Stage("download", download),
+        Stage("user_prompt", user_prompt, ["download"]),
+        Stage("context", context, ["user_prompt"]),
+        Stage("diagram_code", diagram_code, ["context"]),
+        Stage("diagram_url", diagram_url, ["diagram_code"]),
+        Stage("draft", draft, ["context"]),
+        Stage("release_context", release_context, ["context", "diagram_code", "draft"]),
+        Stage("edited", edited, ["draft"]),
+        # Reads the editor's output through edited_text while it is streamed
+        Stage("publish", publish, ["draft"]),
+    ]
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """
+    Whether retrying a failed job would only fail again: the repository or
+    ref does not exist, or Notion rejected the request itself (4xx).
+    """
+    if isinstance(error, NotionError):
+        return not error.retryable
+    return isinstance(error, RepositoryNotFoundError)
+
+
+async def run_generate_newsletter(
+    notion_id: str,
+    repo_link: str,
+    job_id: Optional[str] = None,
+    ref: Optional[str] = None,
+) -> dict:
+    """
+    Generates a newsletter for a repository and publishes it to a Notion page.
+
+    Returns:
+        dict: Per-stage timings and the critical path of the run, plus its
+            trace spans when JOB_TRACING is on.
+
+    Raises:
+        PermanentJobError: If the job cannot succeed however often it is retried.
+        Exception: If any stage fails, so the job queue can retry the job.
+    """
+    start = time.perf_counter()
+    with start_trace(job_id) as trace:
+        try:
+            if not is_valid_page_id(notion_id):
+                raise PermanentJobError(f"Invalid Notion page ID: {notion_id}")
+            # Each job works in its own directory, removed when the job ends
+            async with job_workspace(job_id) as workspace:
+                result = await run_pipeline(
+                    build_newsletter_stages(notion_id, repo_link, workspace, ref)
                 )
-    except Exception as e:
-        print(f"Background task error: {e}", flush=True)
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            ERRORS.inc(component="job")
+            logger.error("Background task error: %s", e)
+            if not isinstance(e, PermanentJobError) and is_permanent_failure(e):
+                raise PermanentJobError(str(e)) from e
+            raise
+    JOB_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+    logger.info("Newsletter processing completed successfully!")
+    logger.info("Stage timings:\n%s", result.report())
+    summary = result.summary()
+    if trace is not None:
+        summary["trace"] = trace.spans
+    return summary
+
+
+async def process_newsletter_job(job: dict) -> dict:
+    payload = job["payload"]
+    return await run_generate_newsletter(
+        payload["page_id"],
+        payload["repo_link"],
+        job_id=job["id"],
+        ref=payload.get("ref"),
+    )
+
+
+def newsletter_lock_key(job: dict) -> str:
+    """Jobs for one Notion page run one at a time, across all worker processes."""
+    return f"page:{job['payload']['page_id']}"
 
 
 # FastAPI Setup
 
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
-app = FastAPI()
+job_queue = JobQueue()
+worker_pool = WorkerPool(
+    job_queue, process_newsletter_job, lock_key=newsletter_lock_key
+)
+
+
+async def submit_newsletter_job(
+    page_id: str,
+    repo_link: str,
+    ref: Optional[str] = None,
+    batch_id: Optional[str] = None,
+) -> tuple[str, bool]:
+    """
+    Queues a newsletter job, coalescing duplicate deliveries.
+
+    The ref is pinned to its current commit, and submissions for the same
+    page, repository and commit attach to the job that is already queued or
+    running, or that completed within DEDUPE_WINDOW seconds.
+
+    Returns:
+        tuple[str, bool]: The job id, and whether a new job was created.
+
+    Raises:
+        ValueError: If repo_link is not a GitHub repository URL.
+        RefResolutionError: If GitHub could not tell where a /tree/ ref ends.
+    """
+    owner, repo = parse_github_url(repo_link)
+    ref = ref or parse_github_ref(repo_link) or "HEAD"
+    ref, commit = await resolve_ref(get_session(), owner, repo, ref)
+    pinned_ref = commit or ref
+
+    dedupe_key = f"{page_id}:{owner.lower()}/{repo.lower()}@{pinned_ref}"
+    # Queue writes wait for other processes' transactions: keep them off the loop
+    loop = asyncio.get_running_loop()
+    job_id, created = await loop.run_in_executor(
+        None,
+        partial(
+            job_queue.enqueue_unique,
+            {"page_id": page_id, "repo_link": repo_link, "ref": pinned_ref},
+            dedupe_key,
+            batch_id=batch_id,
+        ),
+    )
+    if created:
+        worker_pool.notify()
+    else:
+        logger.info("Coalesced duplicate request into job %s", job_id)
+    return job_id, created
+
+
+class BatchItem(BaseModel):
+    page_id: str
+    repo_link: str
+    ref: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+    # Most items of this batch processed at once (default: all workers)
+    max_concurrency: Optional[int] = None
+
+
+async def submit_newsletter_batch(batch: BatchRequest) -> dict:
+    """
+    Queues a newsletter job for every item of a batch.
+
+    Items go through the same coalescing as single requests, so repeated
+    repositories share jobs, downloads and caches. At most
+    batch.max_concurrency of the batch's jobs run at once.
+
+    Returns:
+        dict: The batch id and the job id of every item, in order.
+
+    Raises:
+        ValueError: If an item's repo_link is not a GitHub repository URL.
+        RefResolutionError: If GitHub could not tell where a /tree/ ref ends.
+    """
+    for item in batch.items:
+        parse_github_url(item.repo_link)
+
+    loop = asyncio.get_running_loop()
+    batch_id = await loop.run_in_executor(
+        None, job_queue.create_batch, batch.max_concurrency
+    )
+    semaphore = asyncio.Semaphore(BATCH_SUBMIT_CONCURRENCY)
+
+    async def submit(position: int, item: BatchItem):
+        async with semaphore:
+            job_id, created = await submit_newsletter_job(
+                item.page_id, item.repo_link, item.ref, batch_id=batch_id
+            )
+        await loop.run_in_executor(
+            None,
+            job_queue.add_batch_item,
+            batch_id,
+            position,
+            job_id,
+            item.model_dump(),
+        )
+        return {"page_id": item.page_id, "job_id": job_id, "deduplicated": not created}
+
+    jobs = await asyncio.gather(
+        *(submit(position, item) for position, item in enumerate(batch.items))
+    )
+    return {"batch_id": batch_id, "total": len(jobs), "jobs": list(jobs)}
+
+
+async def warm_up():
+    """
+    Loads the clients that are otherwise imported and created by the first
+    job: Gemini, S3, the HTTP session and, for local rendering, the browser.
+    Failures are logged and left for the first job to retry.
+    """
+    from lib.s3 import get_s3_client
+    from lib.tools import MERMAID_RENDERER
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    get_session()
+    steps = {
+        "gemini": loop.run_in_executor(None, get_model),
+        "s3": loop.run_in_executor(None, get_s3_client),
+    }
+    if MERMAID_RENDERER == "local":
+        steps["mermaid"] = get_browser_pool().start()
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.warning("Warm-up of %s failed: %s", name, result)
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - start)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    worker_pool.start()
+    warming = None
+    if STARTUP_WARMUP == "blocking":
+        await warm_up()
+    elif STARTUP_WARMUP == "background":
+        warming = asyncio.ensure_future(warm_up())
+    try:
+        yield
+    finally:
+        if warming is not None and not warming.done():
+            warming.cancel()
+            await asyncio.gather(warming, return_exceptions=True)
+        await worker_pool.stop()
+        await close_browser_pools()
+        await close_sessions()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 def verify_api_key(api_key: str = Depends(api_key_header)):
@@ -181,6 +534,20 @@ def verify_api_key(api_key: str = Depends(api_key_header)):
     return api_key
 
 
+def get_property_text(properties: dict, name: str) -> Optional[str]:
+    """Returns the plain-text value of a Notion page property, if it is set."""
+    prop = properties.get(name) or {}
+    if prop.get("url"):
+        return prop["url"]
+    if (prop.get("select") or {}).get("name"):
+        return prop["select"]["name"]
+    for key in ("rich_text", "title"):
+        text = "".join(part.get("plain_text", "") for part in prop.get(key) or [])
+        if text.strip():
+            return text.strip()
+    return None
+
+
 @app.get("/")
 def read_root(api_key: str = Depends(verify_api_key)):
     return {"message": "API is working"}
@@ -189,15 +556,13 @@ def read_root(api_key: str = Depends(verify_api_key)):
 @app.post("/newsletter")
 async def run_process(
     request: dict,
-    background_tasks: BackgroundTasks,
     api_key: str = Depends(verify_api_key),
 ):
-    print(f"Received request: {request}", flush=True)
+    # Bodies can be large; they are truncated and only logged at debug level
+    logger.debug("Received request: %s", request)
 
     properties = request.get("data", {}).get("properties", {})
 
-    print(f"Properties: {properties}", flush=True)
-
     if not properties or "GitHub" not in properties:
         raise HTTPException(
             status_code=400, detail="Invalid request: 'GitHub' property is required"
@@ -206,7 +571,13 @@ async def run_process(
     repo_link = request["data"]["properties"]["GitHub"]["url"]
     page_id = request.get("data", {}).get("id", "")
 
-    print(f"Processing Repo: {repo_link} for page ID: {page_id}")
+    # Optional branch, tag or commit to generate the newsletter for
+    ref = next(
+        filter(None, (get_property_text(properties, n) for n in REF_PROPERTIES)),
+        None,
+    )
+
+    logger.info("Processing Repo: %s for page ID: %s", repo_link, page_id)
 
     if not page_id:
         raise HTTPException(
@@ -218,11 +589,125 @@ async def run_process(
             status_code=400, detail="Invalid request: 'GitHub' property is required"
         )
 
-    # Add the task to background processing
-    background_tasks.add_task(run_generate_newsletter, page_id, repo_link)
+    try:
+        job_id, created = await submit_newsletter_job(page_id, repo_link, ref)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
+    except RefResolutionError as e:
+        # The sender should try again rather than get the default branch
+        raise HTTPException(status_code=503, detail=str(e))
 
     # Return immediately
     return {
         "status": "processing",
+        "job_id": job_id,
+        "deduplicated": not created,
         "message": f"Generating Newsletter for GitHub repo: {repo_link}",
     }
+
+
+@app.post("/newsletter/batch")
+async def run_batch(batch: BatchRequest, api_key: str = Depends(verify_api_key)):
+    if not batch.items:
+        raise HTTPException(
+            status_code=400, detail="Invalid request: 'items' must not be empty"
+        )
+    try:
+        submitted = await submit_newsletter_batch(batch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
+    except RefResolutionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "processing", **submitted}
+
+
+@app.get("/newsletter/batch/{batch_id}")
+def get_newsletter_batch(batch_id: str, api_key: str = Depends(verify_api_key)):
+    batch = job_queue.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
+@app.get("/newsletter/{job_id}")
+def get_newsletter_job(job_id: str, api_key: str = Depends(verify_api_key)):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "error": job["error"],
+        "result": job["result"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "repo_link": job["payload"]["repo_link"],
+        "page_id": job["payload"]["page_id"],
+    }
+
+
+@app.get("/queue")
+def get_queue_stats(api_key: str = Depends(verify_api_key)):
+    return worker_pool.stats()
+
+
+def collect_queue_metrics():
+    stats = worker_pool.stats()
+    yield (
+        "newsletter_jobs",
+        "gauge",
+        "Jobs in the queue by status.",
+        [({"status": status}, stats[status]) for status in ("queued", "running")],
+    )
+    yield (
+        "newsletter_workers",
+        "gauge",
+        "Workers of this process by state.",
+        [
+            ({"state": "busy"}, stats["busy_workers"]),
+            ({"state": "total"}, stats["workers"]),
+        ],
+    )
+
+
+def collect_cache_metrics():
+    from lib.tools import diagram_cache
+
+    caches = [llm_cache, summary_cache, skeleton_cache, diagram_cache]
+    stats = [(cache.name, cache.stats) for cache in caches]
+    yield (
+        "cache_lookups_total",
+        "counter",
+        "Cache lookups by result.",
+        [
+            ({"cache": name, "result": result}, values[field])
+            for name, values in stats
+            for result, field in (("hit", "hits"), ("miss", "misses"))
+        ],
+    )
+    yield (
+        "cache_hit_ratio",
+        "gauge",
+        "Share of cache lookups that were hits.",
+        [({"cache": name}, values["hit_ratio"]) for name, values in stats],
+    )
+
+
+register_collector(collect_queue_metrics)
+register_collector(collect_cache_metrics)
+
+
+def verify_metrics_access(api_key: str = Depends(api_key_header)):
+    if not METRICS_PUBLIC:
+        verify_api_key(api_key)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(_: None = Depends(verify_metrics_access)):
+    """Serves every metric in the Prometheus text format."""
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4"
+    )
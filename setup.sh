@@ -43,6 +43,11 @@ uv pip install -e ".[dev]"
 echo "🌐 Installing Playwright browsers..."
 playwright install chromium
 
+# Download the Mermaid bundle used by the local diagram renderer
+echo "🧜 Downloading the Mermaid bundle..."
+mkdir -p data
+curl -sSfL https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.min.js -o data/mermaid.min.js
+
 # Create .env file if it doesn't exist
 if [ ! -f .env ]; then
     echo "📝 Creating .env file from template..."
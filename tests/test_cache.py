@@ -0,0 +1,38 @@
+import pytest
+
+from lib.cache import TieredCache, make_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TieredCache("test", path=str(tmp_path / "test.sqlite3"))
+
+
+def test_make_key_depends_on_every_part():
+    assert make_key("a", 1) == make_key("a", 1)
+    assert make_key("a", 1) != make_key("a", 2)
+
+
+def test_disk_tier_survives_a_new_instance(cache):
+    cache.set("k", "value")
+    reopened = TieredCache("test", path=cache.path)
+    assert reopened.get("k") == "value"
+    assert reopened.disk_hits == 1
+
+
+def test_disk_tier_is_trimmed(tmp_path):
+    path = str(tmp_path / "small.sqlite3")
+    cache = TieredCache("small", max_entries=0, max_disk_bytes=10, path=path)
+    cache.set("a", "x" * 6)
+    cache.set("b", "y" * 6)
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 6
+
+
+@pytest.mark.asyncio
+async def test_async_access(cache):
+    assert await cache.aget("k") is None
+    await cache.aset("k", "value")
+    assert await cache.aget("k") == "value"
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
@@ -0,0 +1,103 @@
+import pytest
+
+import lib.context_cache as context_cache
+from lib.context_cache import (
+    LocalContextCacheClient,
+    SharedContext,
+    set_context_cache_client,
+    share_context,
+)
+from lib.file_reader import BYTES_PER_TOKEN
+
+
+class EchoModel:
+    """Answers with the prompt it was given."""
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return prompt
+
+
+class FailingClient(LocalContextCacheClient):
+    def create(self, text: str, ttl: int):
+        raise RuntimeError("model does not support caching")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = LocalContextCacheClient()
+    monkeypatch.setattr(context_cache, "get_model", EchoModel)
+    monkeypatch.setattr(context_cache, "_client", client)
+    return client
+
+
+def text_of(tokens: int) -> str:
+    return "x" * tokens * BYTES_PER_TOKEN
+
+
+@pytest.mark.asyncio
+async def test_large_context_is_cached_and_released(client):
+    context = await share_context(text_of(100), min_tokens=100)
+    assert context.cached
+    assert client.created == 1
+    assert client.contexts[context.handle] == text_of(100)
+
+    answer = await context.model().generate_content_async("Summarise it")
+    assert answer == f"{text_of(100)}\n\nSummarise it"
+
+    handle = context.handle
+    await context.release()
+    assert not context.cached
+    assert handle not in client.contexts
+    await context.release()
+
+
+@pytest.mark.asyncio
+async def test_small_context_is_sent_inline(client):
+    context = await share_context(text_of(99), min_tokens=100)
+    assert not context.cached
+    assert context.text == text_of(99)
+    assert client.created == 0
+
+
+@pytest.mark.asyncio
+async def test_no_client_sends_context_inline(monkeypatch):
+    monkeypatch.setattr(context_cache, "_client", None)
+    monkeypatch.setattr(context_cache, "CONTEXT_CACHE_BACKEND", "off")
+    context = await share_context(text_of(100), min_tokens=1)
+    assert not context.cached
+    assert context.text == text_of(100)
+
+
+@pytest.mark.asyncio
+async def test_failed_create_falls_back_to_inline(monkeypatch):
+    monkeypatch.setattr(context_cache, "_client", None)
+    set_context_cache_client(FailingClient())
+    context = await share_context(text_of(100), min_tokens=1)
+    assert not context.cached
+    assert context.text == text_of(100)
+
+
+def test_gemini_backend_needs_a_versioned_model(monkeypatch):
+    monkeypatch.setattr(context_cache, "_client", None)
+    monkeypatch.setattr(context_cache, "CONTEXT_CACHE_BACKEND", "gemini")
+    monkeypatch.setattr(context_cache, "CONTEXT_CACHE_MODEL", None)
+    assert context_cache.get_context_cache_client() is None
+
+    monkeypatch.setattr(
+        context_cache, "CONTEXT_CACHE_MODEL", "models/gemini-1.5-flash-002"
+    )
+    assert isinstance(
+        context_cache.get_context_cache_client(),
+        context_cache.GeminiContextCacheClient,
+    )
+
+
+@pytest.mark.asyncio
+async def test_release_survives_delete_errors():
+    class BrokenDelete(LocalContextCacheClient):
+        def delete(self, handle):
+            raise RuntimeError("already gone")
+
+    context = SharedContext("text", "local/1", BrokenDelete())
+    await context.release()
+    assert not context.cached
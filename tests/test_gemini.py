@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import lib.gemini as gemini
+from lib.gemini import run_agent_with_gemini, stream_agent_with_gemini
+
+
+class Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StreamedResponse:
+    def __init__(self, parts: list, error: Exception = None):
+        self._parts = parts
+        self._error = error
+        self.text = "".join(parts)
+        self.usage_metadata = None
+
+    async def __aiter__(self):
+        for part in self._parts:
+            await asyncio.sleep(0)
+            yield Chunk(part)
+        if self._error is not None:
+            raise self._error
+
+
+class FakeModel:
+    def __init__(self, parts: list, error: Exception = None):
+        self.parts = parts
+        self.error = error
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        return StreamedResponse(self.parts, self.error)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel(["one ", "two ", "three"])
+    monkeypatch.setattr(gemini, "get_model", lambda: model)
+    monkeypatch.setattr(gemini, "GEMINI_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(gemini, "_semaphores", {})
+    return model
+
+
+@pytest.mark.asyncio
+async def test_stream_yields_every_chunk(model):
+    chunks = [c async for c in stream_agent_with_gemini("p", "i", use_cache=False)]
+    assert chunks == ["one ", "two ", "three"]
+
+
+@pytest.mark.asyncio
+async def test_consumer_can_call_gemini_between_chunks(model):
+    # With one slot, a consumer waiting on another agent mid-stream used to
+    # deadlock: the stream held the slot the other agent needed
+    outputs = []
+    async for chunk in stream_agent_with_gemini("p", "i", use_cache=False):
+        other = await asyncio.wait_for(
+            run_agent_with_gemini("q", chunk, use_cache=False), timeout=5
+        )
+        outputs.append(other.final_output)
+    assert outputs == ["one two three"] * 3
+
+
+@pytest.mark.asyncio
+async def test_stream_error_is_raised(model):
+    model.error = RuntimeError("connection reset")
+    chunks = []
+    with pytest.raises(RuntimeError):
+        async for chunk in stream_agent_with_gemini("p", "i", use_cache=False):
+            chunks.append(chunk)
+    assert chunks == ["one ", "two ", "three"]
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_frees_its_slot(model):
+    stream = stream_agent_with_gemini("p", "i", use_cache=False)
+    assert await stream.__anext__() == "one "
+    await stream.aclose()
+    response = await asyncio.wait_for(
+        run_agent_with_gemini("q", "i", use_cache=False), timeout=5
+    )
+    assert response.final_output == "one two three"
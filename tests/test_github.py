@@ -0,0 +1,186 @@
+import io
+import os
+import zipfile
+from collections import OrderedDict
+
+import pytest
+
+import lib.github as github
+from lib.github import (
+    RefResolutionError,
+    _extract_archive,
+    _fetch_zip,
+    iter_zip_members,
+    resolve_ref,
+)
+
+FILES = {
+    "README.md": b"# Demo\n",
+    "pkg/__init__.py": b"",
+    "pkg/core.py": b"def run_agent():\n    return 1\n",
+    "logo.png": b"\x89PNG\r\n\x1a\n\0\0",
+    "data/blob.md": b"binary\0data",
+}
+
+
+def zipball() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path, content in FILES.items():
+            archive.writestr(f"demo-main/{path}", content)
+    return buffer.getvalue()
+
+
+class FakeContent:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    async def iter_chunked(self, size: int):
+        for start in range(0, len(self._data), size):
+            yield self._data[start : start + size]
+
+
+class FakeResponse:
+    def __init__(self, status: int, data: bytes = b""):
+        self.status = status
+        self.content = FakeContent(data)
+        self.headers: dict = {}
+        self._data = data
+
+    async def text(self):
+        return self._data.decode()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, status: int, data: bytes = b""):
+        self.response = FakeResponse(status, data)
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+class FakeCommitsAPI:
+    """Answers commit lookups: refs maps a ref to its SHA or an HTTP status."""
+
+    def __init__(self, refs: dict):
+        self.refs = refs
+        self.lookups: list[str] = []
+
+    def get(self, url, **kwargs):
+        ref = url.split("/commits/", 1)[1]
+        self.lookups.append(ref)
+        answer = self.refs.get(ref, 404)
+        if isinstance(answer, str):
+            return FakeResponse(200, answer.encode())
+        return FakeResponse(answer)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("spool_bytes", [10 * 1024**2, 16])
+async def test_fetched_archive_is_readable(monkeypatch, spool_bytes):
+    monkeypatch.setattr(github, "ZIP_SPOOL_MAX_BYTES", spool_bytes)
+    archive = await _fetch_zip(FakeSession(200, zipball()), "https://example/a.zip")
+    with archive:
+        assert isinstance(archive, io.BytesIO) == (spool_bytes > 1024)
+        members = dict(iter_zip_members(archive, ["md", "py"]))
+    assert members == {
+        "README.md": b"# Demo\n",
+        os.path.join("pkg", "__init__.py"): b"",
+        os.path.join("pkg", "core.py"): b"def run_agent():\n    return 1\n",
+    }
+
+
+@pytest.mark.asyncio
+async def test_fetched_archive_is_extracted(monkeypatch, tmp_path):
+    monkeypatch.setattr(github, "ZIP_SPOOL_MAX_BYTES", 16)
+    archive = await _fetch_zip(FakeSession(200, zipball()), "https://example/a.zip")
+    folder = await _extract_archive(archive, str(tmp_path), ["py"])
+    assert folder == str(tmp_path / "demo-main")
+    assert sorted(os.listdir(tmp_path / "demo-main" / "pkg")) == [
+        "__init__.py",
+        "core.py",
+    ]
+    assert not (tmp_path / "demo-main" / "README.md").exists()
+
+
+@pytest.mark.asyncio
+async def test_missing_archive(monkeypatch):
+    assert await _fetch_zip(FakeSession(404), "https://example/a.zip") is None
+    with pytest.raises(RuntimeError):
+        await _fetch_zip(FakeSession(502), "https://example/a.zip")
+
+
+def test_oversized_members_are_skipped():
+    members = dict(iter_zip_members(io.BytesIO(zipball()), ["py"], max_file_bytes=8))
+    assert members == {os.path.join("pkg", "__init__.py"): b""}
+
+
+def test_archive_over_total_limit_is_rejected():
+    with pytest.raises(ValueError):
+        list(iter_zip_members(io.BytesIO(zipball()), None, max_total_bytes=10))
+
+
+SHA = "a" * 40
+
+
+@pytest.fixture(autouse=True)
+def no_etags(monkeypatch):
+    monkeypatch.setattr(github, "_commit_etags", OrderedDict())
+
+
+@pytest.mark.asyncio
+async def test_ref_is_the_longest_prefix_that_exists():
+    api = FakeCommitsAPI({"main": "1" * 40, "feature/x": SHA})
+    assert await resolve_ref(api, "o", "r", "feature/x/docs") == ("feature/x", SHA)
+    assert await resolve_ref(api, "o", "r", "main/docs/api") == ("main", "1" * 40)
+
+
+@pytest.mark.asyncio
+async def test_ref_lookups_are_capped():
+    api = FakeCommitsAPI({"main": SHA})
+    assert await resolve_ref(api, "o", "r", "main/a/b/c/d/e/f") == ("main", SHA)
+    assert sorted(api.lookups, key=len) == ["main", "main/a", "main/a/b", "main/a/b/c"]
+
+
+@pytest.mark.asyncio
+async def test_unknown_ref_falls_back_to_default_branch():
+    api = FakeCommitsAPI({"HEAD": SHA})
+    assert await resolve_ref(api, "o", "r", "gone/docs") == ("HEAD", SHA)
+    assert await resolve_ref(api, "o", "r", "gone") == ("gone", None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [403, 429, 502])
+async def test_unanswered_lookup_is_an_error(status):
+    api = FakeCommitsAPI({"feature/x": status, "feature": 404, "HEAD": SHA})
+    with pytest.raises(RefResolutionError):
+        await resolve_ref(api, "o", "r", "feature/x/docs")
+
+
+@pytest.mark.asyncio
+async def test_commit_sha_needs_no_lookup():
+    api = FakeCommitsAPI({})
+    assert await resolve_ref(api, "o", "r", SHA.upper()) == (SHA, SHA)
+    assert api.lookups == []
+
+
+@pytest.mark.asyncio
+async def test_commit_etags_are_bounded(monkeypatch):
+    monkeypatch.setattr(github, "COMMIT_ETAG_MAX_ENTRIES", 2)
+
+    class TaggedAPI(FakeCommitsAPI):
+        def get(self, url, **kwargs):
+            response = super().get(url, **kwargs)
+            response.headers["ETag"] = '"tag"'
+            return response
+
+    api = TaggedAPI({"a": SHA, "b": SHA, "c": SHA})
+    for ref in ("a", "b", "c"):
+        await resolve_ref(api, "o", "r", ref)
+    assert list(github._commit_etags) == [("o", "r", "b"), ("o", "r", "c")]
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import pytest
+
+from lib.jobs import (
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    JobQueue,
+    PermanentJobError,
+    WorkerPool,
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_duplicate_enqueue_returns_the_existing_job(queue):
+    job_id, created = queue.enqueue_unique({"n": 1}, "page:repo@sha")
+    assert created
+    assert queue.enqueue_unique({"n": 2}, "page:repo@sha") == (job_id, False)
+
+    # Running and recently succeeded jobs still absorb duplicates
+    queue.claim("worker")
+    assert queue.enqueue_unique({"n": 3}, "page:repo@sha") == (job_id, False)
+    queue.complete(job_id, "done", "worker")
+    assert queue.enqueue_unique({"n": 4}, "page:repo@sha") == (job_id, False)
+
+    other_id, created = queue.enqueue_unique({"n": 5}, "page:repo@other")
+    assert created and other_id != job_id
+
+
+def test_old_or_failed_jobs_do_not_absorb_duplicates(queue):
+    job_id, _ = queue.enqueue_unique({}, "key", max_attempts=1)
+    queue.claim("worker")
+    queue.fail(job_id, "boom", "worker")
+    retry_id, created = queue.enqueue_unique({}, "key")
+    assert created and retry_id != job_id
+
+    queue.claim("worker")
+    queue.complete(retry_id, None, "worker")
+    later_id, created = queue.enqueue_unique({}, "key", window=0)
+    assert created and later_id != retry_id
+
+
+def test_expired_lease_is_reclaimed(queue):
+    job_id = queue.enqueue({"n": 1})
+    assert queue.claim("crashed", ttl=-1)["id"] == job_id
+    assert queue.claim("healthy") is None
+
+    assert queue.recover() == 1
+    job = queue.claim("healthy")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    assert job["lease_owner"] == "healthy"
+
+    # The old owner can no longer finish or renew the job
+    queue.complete(job_id, "stale", "crashed")
+    assert queue.renew("crashed", [job_id]) == {job_id}
+    assert queue.get(job_id)["status"] == RUNNING
+    queue.complete(job_id, "fresh", "healthy")
+    assert queue.get(job_id)["result"] == "fresh"
+
+
+def test_live_lease_is_kept(queue):
+    job_id = queue.enqueue({})
+    queue.claim("worker", ttl=60)
+    assert queue.recover() == 0
+    assert queue.renew("worker", [job_id]) == set()
+
+
+def test_release_does_not_count_the_attempt(queue):
+    job_id = queue.enqueue({})
+    queue.claim("worker")
+    queue.release(job_id, "worker")
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == (QUEUED, 0)
+
+
+def test_batch_never_runs_more_than_max_concurrency(queue):
+    batch_id = queue.create_batch(max_concurrency=2)
+    ids = [
+        queue.enqueue_unique({}, f"item:{n}", batch_id=batch_id)[0] for n in range(5)
+    ]
+    loose_id = queue.enqueue({})
+
+    claimed = [queue.claim("worker") for _ in range(4)]
+    claimed_ids = [job["id"] for job in claimed if job is not None]
+    assert claimed_ids == [ids[0], ids[1], loose_id]
+
+    queue.complete(ids[0], None, "worker")
+    assert queue.claim("worker")["id"] == ids[2]
+    assert queue.claim("worker") is None
+
+    queue.fail(ids[1], "boom", "worker", retry=False)
+    assert queue.claim("worker")["id"] == ids[3]
+
+
+def test_failed_attempt_is_retried_with_backoff(queue):
+    job_id = queue.enqueue({}, max_attempts=2)
+    queue.claim("worker")
+    assert queue.fail(job_id, "timeout", "worker")
+    job = queue.get(job_id)
+    assert job["status"] == QUEUED
+    assert job["available_at"] > time.time()
+
+    queue._connect().execute("UPDATE jobs SET available_at = 0")
+    queue.claim("worker")
+    assert not queue.fail(job_id, "timeout", "worker")
+    assert queue.get(job_id)["status"] == FAILED
+
+
+def test_permanent_failure_is_not_retried(queue):
+    job_id = queue.enqueue({}, max_attempts=3)
+    queue.claim("worker")
+    assert not queue.fail(job_id, "bad page id", "worker", retry=False)
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == (FAILED, 1)
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_fails_permanent_errors_at_once(queue):
+    calls = []
+
+    async def handler(job):
+        calls.append(job["id"])
+        if job["payload"]["permanent"]:
+            raise PermanentJobError("invalid page id")
+        return "ok"
+
+    failing = queue.enqueue({"permanent": True}, max_attempts=3)
+    passing = queue.enqueue({"permanent": False}, max_attempts=3)
+    pool = WorkerPool(queue, handler, concurrency=2, poll_interval=0.01)
+    pool.start()
+    try:
+        for _ in range(500):
+            statuses = {queue.get(i)["status"] for i in (failing, passing)}
+            if statuses <= {SUCCEEDED, FAILED}:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await pool.stop()
+
+    job = queue.get(failing)
+    assert (job["status"], job["attempts"], job["error"]) == (
+        FAILED,
+        1,
+        "invalid page id",
+    )
+    assert queue.get(passing)["result"] == "ok"
+    assert sorted(calls) == sorted([failing, passing])
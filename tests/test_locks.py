@@ -0,0 +1,46 @@
+import pytest
+
+from lib.locks import (
+    FileLockBackend,
+    LockBackend,
+    MemoryLockBackend,
+    SQLiteLockBackend,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "file"])
+def locks(request, tmp_path) -> LockBackend:
+    if request.param == "sqlite":
+        return SQLiteLockBackend(str(tmp_path / "locks.sqlite3"))
+    if request.param == "file":
+        return FileLockBackend(str(tmp_path / "locks"))
+    return MemoryLockBackend()
+
+
+def test_lock_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LockBackend()
+
+
+def test_key_has_one_owner(locks):
+    assert locks.acquire("page:1", "a", 60)
+    assert locks.acquire("page:1", "a", 60)
+    assert not locks.acquire("page:1", "b", 60)
+    assert locks.acquire("page:2", "b", 60)
+
+
+def test_renew_and_release_need_the_owner(locks):
+    locks.acquire("page:1", "a", 60)
+    assert locks.renew("page:1", "a", 60)
+    assert not locks.renew("page:1", "b", 60)
+    locks.release("page:1", "b")
+    assert not locks.acquire("page:1", "b", 60)
+    locks.release("page:1", "a")
+    assert not locks.renew("page:1", "a", 60)
+    assert locks.acquire("page:1", "b", 60)
+
+
+def test_expired_lease_can_be_taken(locks):
+    assert locks.acquire("page:1", "a", -1)
+    assert not locks.renew("page:1", "a", 60)
+    assert locks.acquire("page:1", "b", 60)
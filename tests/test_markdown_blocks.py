@@ -0,0 +1,127 @@
+import pytest
+
+from lib.markdown_blocks import (
+    DIAGRAM_PLACEHOLDER,
+    MarkdownBlockCompiler,
+    compile_markdown,
+    compile_markdown_stream,
+)
+
+DOCUMENT = """# Weekly **digest**
+
+The entry point is run_agent_with_gemini, called from `__main__`.
+
+- Calls `run_agent_with_gemini` with *retries*
+- Computes 2*3*4 up front
+1. Parses __init__ first
+
+<DIAGRAM_IMAGE_URL>
+
+```python
+def run_agent_with_gemini(**kwargs):
+    return __import__("os")
+```
+
+See [the_docs](https://example.com/some_page_here).
+"""
+
+
+def texts(blocks):
+    return [(block.type, block.text) for block in blocks]
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("run_agent_with_gemini", "run_agent_with_gemini"),
+        ("`run_agent_with_gemini`", "run_agent_with_gemini"),
+        ("call `a_b` and `c_d`", "call a_b and c_d"),
+        ("``a ` b``", "a ` b"),
+        ("__init__ and __main__", "__init__ and __main__"),
+        ("2*3*4", "2*3*4"),
+        ("a * b * c", "a * b * c"),
+        ("**bold** and __strong text__", "bold and strong text"),
+        ("*it* and _it_ and ~~gone~~", "it and it and gone"),
+        ("***both***", "both"),
+        ("snake_case _word_", "snake_case word"),
+        ("see https://example.com/a_b_c", "see https://example.com/a_b_c"),
+    ],
+)
+def test_inline_formatting(markdown, expected):
+    assert texts(compile_markdown(markdown).blocks) == [("paragraph", expected)]
+
+
+def test_link_keeps_target():
+    blocks = compile_markdown("Read [the_docs](https://example.com/a_b) now").blocks
+    assert texts(blocks) == [
+        ("paragraph", "Read the_docs (https://example.com/a_b) now")
+    ]
+
+
+def test_lists_and_headings():
+    markdown = "## Set **up**\n- first_item\n- `second_item`\n  continued\n1. one\n"
+    assert texts(compile_markdown(markdown).blocks) == [
+        ("heading_2", "Set up"),
+        ("bulleted_list_item", "first_item"),
+        ("bulleted_list_item", "second_item continued"),
+        ("numbered_list_item", "one"),
+    ]
+
+
+def test_fenced_code_is_kept_verbatim():
+    markdown = "```python\nx = a_b * c_d  # **not bold**\n\nprint(x)\n```\nafter"
+    blocks = compile_markdown(markdown).blocks
+    assert texts(blocks) == [
+        ("paragraph", "x = a_b * c_d  # **not bold**\n\nprint(x)"),
+        ("paragraph", "after"),
+    ]
+    assert blocks[0].is_code
+
+
+def test_markdown_fence_is_unwrapped():
+    blocks = compile_markdown("```markdown\nHello _there_\n```\n").blocks
+    assert texts(blocks) == [("paragraph", "Hello there")]
+
+
+@pytest.mark.parametrize(
+    "markdown",
+    [
+        DIAGRAM_PLACEHOLDER,
+        f"- {DIAGRAM_PLACEHOLDER}",
+        f"![Architecture]({DIAGRAM_PLACEHOLDER})",
+    ],
+)
+def test_diagram_placeholder(markdown):
+    blocks = compile_markdown(markdown).blocks
+    assert [(block.type, block.url) for block in blocks] == [
+        ("image", DIAGRAM_PLACEHOLDER)
+    ]
+
+
+def test_placeholder_inside_paragraph():
+    blocks = compile_markdown(f"Before {DIAGRAM_PLACEHOLDER} after").blocks
+    assert [block.type for block in blocks] == ["paragraph", "image", "paragraph"]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_feeding_in_pieces_matches_whole_document(size):
+    compiler = MarkdownBlockCompiler()
+    blocks = []
+    for start in range(0, len(DOCUMENT), size):
+        blocks += compiler.feed(DOCUMENT[start : start + size])
+    blocks += compiler.close()
+    assert blocks == compile_markdown(DOCUMENT).blocks
+
+
+@pytest.mark.asyncio
+async def test_stream_matches_whole_document():
+    async def chunks():
+        for start in range(0, len(DOCUMENT), 5):
+            yield DOCUMENT[start : start + 5]
+
+    blocks = [block async for block in compile_markdown_stream(chunks())]
+    assert blocks == compile_markdown(DOCUMENT).blocks
+    assert texts(blocks)[1] == (
+        "paragraph",
+        "The entry point is run_agent_with_gemini, called from __main__.",
+    )
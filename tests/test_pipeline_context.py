@@ -0,0 +1,56 @@
+import pytest
+
+import main
+from lib.context_cache import SharedContext
+
+
+@pytest.fixture
+def repository(tmp_path):
+    (tmp_path / "README.md").write_text("# Demo\n")
+    (tmp_path / "app.py").write_text('def run():\n    """Runs the app."""\n')
+    return str(tmp_path)
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    calls = []
+
+    async def share_context(text, min_tokens=None):
+        calls.append(text)
+        return SharedContext(text)
+
+    monkeypatch.setattr(main, "share_context", share_context)
+    return calls
+
+
+async def run_context_stages(repository: str) -> dict:
+    stages = {
+        stage.name: stage
+        for stage in main.build_newsletter_stages(
+            "0" * 32, "https://github.com/owner/demo", workspace=None
+        )
+    }
+    prompts = await stages["user_prompt"].func(download=repository)
+    return await stages["context"].func(user_prompt=prompts)
+
+
+def test_agents_read_the_same_mode_by_default():
+    assert main.WRITER_REPO_MODE == main.DIAGRAM_REPO_MODE
+
+
+@pytest.mark.asyncio
+async def test_default_modes_share_one_context(repository, shared):
+    context = await run_context_stages(repository)
+    assert len(shared) == 1
+    assert context[main.WRITER_REPO_MODE] is context[main.DIAGRAM_REPO_MODE]
+    assert "def run():" in shared[0]
+
+
+@pytest.mark.asyncio
+async def test_different_modes_are_sent_inline(repository, shared, monkeypatch):
+    monkeypatch.setattr(main, "WRITER_REPO_MODE", "full")
+    monkeypatch.setattr(main, "DIAGRAM_REPO_MODE", "digest")
+    context = await run_context_stages(repository)
+    assert shared == []
+    assert set(context) == {"full", "digest"}
+    assert not any(c.cached for c in context.values())